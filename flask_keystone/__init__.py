@@ -33,11 +33,18 @@ function and decorators exist (most useful of which are
 :func:`FlaskKeystone.requires_role` and :func:`User.has_role`).
 """
 
+import atexit
+import gc
+import threading
+import time
+
 import flask
 from flask import request
 
-from functools import wraps
+from functools import partial, wraps
 
+from keystoneauth1 import adapter as ksa_adapter
+from keystoneauth1 import loading as ksa_loading
 from keystonemiddleware import auth_token
 
 from oslo_config import cfg
@@ -48,30 +55,106 @@ from werkzeug.local import LocalProxy
 from flask_keystone.config import RAX_OPTS
 from flask_keystone.exceptions import (FlaskKeystoneException,
                                        FlaskKeystoneForbidden,
+                                       FlaskKeystoneTooManyRequests,
                                        FlaskKeystoneUnauthorized,
                                        handle_exception)
 
 from flask_keystone.anonymous import AnonymousBase
+from flask_keystone.audit import AuditLogger
+from flask_keystone.circuit import CircuitBreaker
+from flask_keystone.http_pool import HTTPPool
+from flask_keystone.log_sampling import SampledLogger
+from flask_keystone.middleware import make_auth_protocol
+from flask_keystone.offline import Keyset, OfflineTokenMiddleware
+from flask_keystone.policy import credentials_for, Policy
+from flask_keystone.profiling import ALLOWED_KEY, RequestProfiler
+from flask_keystone.propagation import IdentityClient
+from flask_keystone.ratelimit import RateLimiter
+from flask_keystone.revocation import KeystoneRevocationFeed, RevocationPoller
+from flask_keystone.roles import is_expression, RoleExpression
+from flask_keystone.token_cache import TokenCache, TokenRefresher
+from flask_keystone.trusted import TrustedHeaderMiddleware
 from flask_keystone.user import UserBase
 
 
 __version__ = "0.2"
 
 
-current_user = LocalProxy(lambda: _get_user())
+class _ThreadLocalVar(threading.local):
+    """
+    Thread-local stand-in for :class:`contextvars.ContextVar`.
+
+    Used before Python 3.7, which lacks :mod:`contextvars`; only `get`,
+    `set` and `reset` are provided.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.value = default
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        token, self.value = (self.value,), value
+        return token
+
+    def reset(self, token):
+        self.value = token[0]
+
 
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = _ThreadLocalVar
 
-def _get_request_ctx():
-    if hasattr(flask, 'globals') and hasattr(flask.globals, 'request_ctx'):
+
+# NOTE: the identity of the current request is either the user itself, or a
+# partial building it, so that endpoints that never touch current_user
+# don't pay for it. Being a ContextVar, it follows the request into copied
+# contexts, such as those of async views and greenlets (before Python 3.7,
+# it is only thread-local).
+_identity = ContextVar("flask_keystone.identity", default=None)
+
+#: Request context attribute holding the token restoring the identity in
+#: place before the request's, as contexts may be nested.
+_TOKEN_ATTR = "flask_keystone_identity_token"
+
+
+if hasattr(flask, 'globals') and hasattr(flask.globals, 'request_ctx'):
+    def _get_request_ctx():
         # get context for Flask >= 2.2
         return flask.globals.request_ctx._get_current_object()
-    else:
+else:  # pragma: no cover
+    def _get_request_ctx():
         # get context for Flask < 2.2
         return flask._request_ctx_stack.top
 
 
 def _get_user():
-    return _get_request_ctx().keystone_user
+    user = _identity.get()
+    if user.__class__ is partial:
+        user = user()
+        _identity.set(user)
+    return user
+
+
+def _set_identity(identity):
+    token = _identity.set(identity)
+    ctx = _get_request_ctx()
+    if not hasattr(ctx, _TOKEN_ATTR):
+        setattr(ctx, _TOKEN_ATTR, token)
+
+
+def _clear_user(error=None):
+    ctx = _get_request_ctx()
+    token = getattr(ctx, _TOKEN_ATTR, None)
+    if token is not None:
+        delattr(ctx, _TOKEN_ATTR)
+        _identity.reset(token)
+
+
+current_user = LocalProxy(_get_user)
 
 
 class FlaskKeystone(object):
@@ -81,14 +164,20 @@ class FlaskKeystone(object):
     :type app: `flask.Flask`
     :param str config_group: :class:`oslo_config.cfg.OptGroup` to which
                              to attach.
+    :param revocation_feed: Source of revocation events, used instead of
+                            Keystone when `revocation_enabled` is set.
+    :type revocation_feed: :class:`revocation.LocalRevocationFeed`
 
     Note that consistent with the Application Factory method of `flask.Flask`
     instantiation, it is possible to pass these parameters either during
     __init__, or via an init_app function after instantiation.
     """
 
-    def __init__(self, app=None, config_group="flask_keystone"):
+    def __init__(self, app=None, config_group="flask_keystone",
+                 revocation_feed=None):
         self.app = app
+        self.revocation_feed = revocation_feed
+        self._role_expressions = []
         if app is not None:  # pragma: no cover
             self.init_app(app, config_group)
 
@@ -116,42 +205,120 @@ class FlaskKeystone(object):
         logging.setup(cfg.CONF, "flask_keystone")
 
         self.config = cfg.CONF[config_group]
+        self.auth_logger = SampledLogger(
+            self.logger,
+            sample_rate=self.config.log_sample_rate,
+            rate_limit=self.config.log_rate_limit,
+            interval=self.config.log_rate_interval
+        )
+        atexit.register(self.auth_logger.flush)
         self.roles = self._parse_roles()
         self.User = self._make_user_model()
         self.Anonymous = self._make_anonymous_model()
+        self.rate_limiter = self._make_rate_limiter()
+        self.audit = self._make_audit_logger()
+        self.policy = self._make_policy()
         self.logger.debug("Initialized keystone with roles: %s and "
                           "allow_anonymous: %s" % (
                               self.roles,
                               self.config.allow_anonymous_access
                           ))
-        app.wsgi_app = auth_token.AuthProtocol(app.wsgi_app, {})
+        self.profiler = self._make_profiler(app)
+        wsgi_app = app.wsgi_app
+        if self.profiler is not None:
+            wsgi_app = self.profiler.wrap_validated(wsgi_app)
+        app.wsgi_app = self._make_offline_validator(
+            wsgi_app, self._make_auth_protocol(wsgi_app))
+        if self.profiler is not None:
+            app.wsgi_app = self.profiler.wrap(app.wsgi_app)
+        self.client = self._make_client()
 
         self.logger.debug("Adding before_request request handler.")
         app.before_request(self._make_before_request())
+        self.logger.debug("Adding teardown_request request handler.")
+        app.teardown_request(_clear_user)
+        app.teardown_request(lambda error=None: self.auth_logger.sweep())
         self.logger.debug("Registering Custom Error Handler.")
         app.register_error_handler(FlaskKeystoneException, handle_exception)
 
+    def warmup(self, app):
+        """
+        Build all lazily initialized state ahead of the first request.
+
+        :param app: `flask.Flask` application the extension was initialized
+                    with.
+        :type app: `flask.Flask`
+
+        Pre-fork servers such as gunicorn (with `preload_app = True`) load
+        the application once and fork their workers from it. Calling this
+        method once every route has been registered, and before the workers
+        are forked:
+
+        - compiles every role expression used by :func:`requires_role`,
+        - builds the application's URL map and a throwaway User, so that the
+          first request of each worker doesn't pay for them,
+        - serializes the error responses returned by the extension, and
+        - moves every object allocated so far out of the reach of the
+          garbage collector, using :func:`gc.freeze`.
+
+        As the garbage collector writes to every object it tracks, a frozen
+        heap stays shared, copy-on-write, between the workers instead of
+        being copied into each of them by their first collection.
+
+        No threads are started, and no connections opened, by this method.
+        """
+        role_map = self.User.role_map
+        for expression in self._role_expressions:
+            expression.evaluate(role_map, 0)
+
+        keystone_roles = sorted(set().union(*self.roles.values()))
+        headers = {
+            "X-Identity-Status": "Confirmed",
+            "X-User-Id": "warmup",
+            "X-Project-Id": "warmup",
+            "X-Roles": ",".join(keystone_roles),
+        }
+        with app.test_request_context("/", headers=headers):
+            user = self.User(request)
+            for role in self.roles:
+                user.has_role(role)
+                getattr(user, "is_%s" % role)()
+            if self.policy is not None:
+                credentials_for(user)
+            for error in (FlaskKeystoneUnauthorized(),
+                          FlaskKeystoneForbidden(),
+                          FlaskKeystoneTooManyRequests()):
+                handle_exception(error)
+
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        self.logger.debug("Warmed up, %d objects frozen." % (
+            gc.get_freeze_count() if hasattr(gc, "get_freeze_count") else 0
+        ))
+
     def _set_user(self, request):
         """
-        Instantiate a user and attach it to the request context.
+        Attach a lazily instantiated user to the request context.
 
         :param request: The request from which to instantiate the User.
         :type request: :class:`flask.Request`
 
-        This function instantiates a :class:`FlaskKeystone.User` and applies
-        it to the request context for retrieval and comparison at any point
-        during a single request.
+        This function prepares a :class:`FlaskKeystone.User` for the request
+        context, for retrieval and comparison at any point during a single
+        request. The User itself is only instantiated the first time
+        :obj:`current_user` is accessed.
         """
-        _get_request_ctx().keystone_user = self.User(request)
+        _set_identity(partial(self.User, request))
 
     def _set_anonymous_user(self):
         """
-        Instantiate an anonymous user and attach it to the request context.
+        Attach the shared anonymous user to the request context.
 
         This function should only be called if "allow_anonymous_access is
         set in the configuration for flask_keystone.
         """
-        _get_request_ctx().keystone_user = self.Anonymous()
+        _set_identity(self.Anonymous.instance)
 
     def _parse_roles(self):
         """
@@ -161,12 +328,393 @@ class FlaskKeystone(object):
         roles in a flatter format than a standard dictionary. This
         function serves to transform these roles into a standard
         python dictionary.
+
+        Glob patterns from "role_patterns" are added alongside the keystone
+        roles they stand for, and compiled by
+        :class:`flask_keystone.roles.RoleMap`.
+
+        :raises: ValueError if a role pattern is not of the form
+                 "pattern=configured_role".
         """
         roles = {}
         for keystone_role, flask_role in self.config.roles.items():
             roles.setdefault(flask_role, set()).add(keystone_role)
+        for entry in self.config.role_patterns:
+            pattern, _, flask_role = entry.rpartition("=")
+            if not pattern or not flask_role:
+                raise ValueError("Invalid role pattern '%s', expected "
+                                 "pattern=configured_role." % entry)
+            roles.setdefault(flask_role.strip(), set()).add(pattern.strip())
         return roles
 
+    def _make_rate_limiter(self):
+        """
+        Generate the per-identity rate limiter from oslo_config.
+
+        :returns: A configured rate limiter, or None if rate limiting is
+                  disabled.
+        :rtype: :class:`flask_keystone.ratelimit.RateLimiter`
+        """
+        if not self.config.rate_limit_enabled:
+            return None
+        return RateLimiter(
+            rate=self.config.rate_limit_rate,
+            burst=self.config.rate_limit_burst,
+            role_quotas=self.config.rate_limit_role_quotas,
+            key=self.config.rate_limit_key
+        )
+
+    def _make_audit_logger(self):
+        """
+        Generate the asynchronous audit logger from oslo_config.
+
+        :returns: A configured audit logger, or None if auditing is disabled.
+        :rtype: :class:`flask_keystone.audit.AuditLogger`
+        """
+        if not self.config.audit_enabled:
+            return None
+        return AuditLogger(
+            queue_size=self.config.audit_queue_size,
+            batch_size=self.config.audit_batch_size,
+            flush_interval=self.config.audit_flush_interval
+        )
+
+    def _make_offline_validator(self, wsgi_app, fallback):
+        """
+        Validate JWS tokens locally, if enabled.
+
+        :param wsgi_app: The WSGI application to wrap.
+        :param fallback: The application wrapped in
+                         :mod:`keystonemiddleware`, validating other tokens.
+        :raises: ValueError if no keyset file is configured, or it can't be
+                 loaded.
+        :returns: The wrapped application, or `fallback` if offline
+                  validation is disabled. The middleware is exposed as
+                  `self.offline`.
+        """
+        self.offline = None
+        config = self.config
+        if not config.offline_validation_enabled:
+            return fallback
+        if not config.offline_keyset_file:
+            raise ValueError("offline_keyset_file must be set when "
+                             "offline_validation_enabled is.")
+        self.offline = OfflineTokenMiddleware(
+            wsgi_app,
+            Keyset(config.offline_keyset_file,
+                   check_interval=config.offline_keyset_check_interval),
+            fallback=fallback if config.offline_fallback else None,
+            issuer=config.offline_issuer,
+            audience=config.offline_audience,
+            leeway=config.offline_leeway
+        )
+        return self.offline
+
+    def _make_profiler(self, app):
+        """
+        Create the request profiler and its endpoint, if enabled.
+
+        :param app: `flask.Flask` application to profile.
+        :type app: `flask.Flask`
+        :raises: ValueError if profiling is enabled without a role.
+        :returns: The profiler, or None if profiling is disabled.
+        :rtype: :class:`flask_keystone.profiling.RequestProfiler`
+
+        Sampled requests are profiled from outside of
+        :mod:`keystonemiddleware`, so that token validation is profiled,
+        while requested profiles only start once the token is validated.
+        Profiles are listed at `profiling_endpoint`, and each is retrieved
+        as text at `profiling_endpoint/<id>`, with optional `sort` and
+        `limit` query arguments.
+        """
+        config = self.config
+        if not config.profiling_enabled:
+            return None
+        if config.profiling_role not in self.roles:
+            raise ValueError("profiling_role must be a configured role when "
+                             "profiling_enabled is set.")
+
+        profiler = RequestProfiler(
+            sample_rate=config.profiling_sample_rate,
+            header=config.profiling_header,
+            capacity=config.profiling_buffer_size
+        )
+
+        @self.requires_role(config.profiling_role)
+        def list_profiles():
+            return flask.jsonify(
+                [profile.to_dict() for profile in profiler.profiles()]
+            )
+
+        @self.requires_role(config.profiling_role)
+        def show_profile(profile_id):
+            profile = profiler.get(profile_id)
+            if profile is None:
+                flask.abort(404)
+            try:
+                text = profile.render(
+                    sort=request.args.get("sort", "cumulative"),
+                    limit=request.args.get("limit", 30, type=int)
+                )
+            except ValueError:
+                flask.abort(400)
+            return flask.Response(text, mimetype="text/plain")
+
+        endpoint = config.profiling_endpoint.rstrip("/")
+        app.add_url_rule(endpoint, "flask_keystone_profiles", list_profiles)
+        app.add_url_rule(endpoint + "/<int:profile_id>",
+                         "flask_keystone_profile", show_profile)
+        return profiler
+
+    def _make_client(self):
+        """
+        Create the client making requests on behalf of the current user.
+
+        :raises: ValueError if `propagation_service_token` is set in
+                 trusted-header mode, or without `keystone_authtoken`
+                 credentials.
+        :returns: The client, or None if propagation is disabled.
+        :rtype: :class:`flask_keystone.propagation.IdentityClient`
+        """
+        config = self.config
+        if not config.propagation_enabled:
+            return None
+        service_token = None
+        if config.propagation_service_token:
+            if self.auth_protocol is None:
+                raise ValueError("propagation_service_token can't be set "
+                                 "when trusted_headers_enabled is.")
+            # NOTE: the auth plugin caches the token until it expires.
+            service_token = self._make_identity_adapter().get_token
+        return IdentityClient(
+            HTTPPool(pool_size=config.propagation_pool_size,
+                     block=config.propagation_pool_block),
+            timeout=config.propagation_timeout,
+            service_token=service_token,
+            signing_key=config.propagation_signing_key
+        )
+
+    def _make_auth_protocol(self, wsgi_app):
+        """
+        Wrap a WSGI application in :mod:`keystonemiddleware`.
+
+        :param wsgi_app: The WSGI application to wrap.
+        :returns: The wrapped application.
+
+        Unless a feature extending token validation is enabled, the plain
+        :class:`keystonemiddleware.auth_token.AuthProtocol` is used. The
+        in-process token cache, connection pool, circuit breaker and
+        revocation poller, if any, are exposed as `self.token_cache`,
+        `self.http_pool`, `self.breaker` and `self.revocations`, and the
+        middleware itself as `self.auth_protocol`.
+
+        In trusted-header mode, :mod:`keystonemiddleware` is skipped
+        altogether, and the application only wrapped in a
+        :class:`flask_keystone.trusted.TrustedHeaderMiddleware`, exposed as
+        `self.trusted_headers`.
+        """
+        self.token_cache = None
+        self.http_pool = None
+        self.breaker = None
+        self.revocations = None
+        self.trusted_headers = None
+        self._refresher = None
+        self.auth_protocol = None
+        self._identity_adapter = None
+        config = self.config
+        if config.trusted_headers_enabled:
+            if not config.trusted_headers_key:
+                raise ValueError("trusted_headers_key must be set when "
+                                 "trusted_headers_enabled is.")
+            self.logger.warning("Trusting signed identity headers; tokens "
+                                "will not be validated.")
+            self.trusted_headers = TrustedHeaderMiddleware(
+                wsgi_app,
+                config.trusted_headers_key,
+                max_age=config.trusted_headers_max_age
+            )
+            return self.trusted_headers
+
+        cached = any((config.token_refresh_enabled,
+                      config.circuit_breaker_enabled,
+                      config.revocation_enabled))
+        if not (cached or config.keystone_pool_enabled):
+            self.auth_protocol = auth_token.AuthProtocol(wsgi_app, {})
+            return self.auth_protocol
+
+        protocol = make_auth_protocol(auth_token.AuthProtocol)
+        if config.keystone_pool_enabled:
+            protocol.http_pool = self.http_pool = HTTPPool(
+                pool_size=config.keystone_pool_size,
+                block=config.keystone_pool_block,
+                keepalive=config.keystone_keepalive,
+                retries=config.keystone_retries,
+                retry_budget=config.keystone_retry_budget
+            )
+            protocol.http_timeout = config.keystone_timeout
+        middleware = self.auth_protocol = protocol(wsgi_app, {})
+        if not cached:
+            return middleware
+
+        stale_grace = 0.0
+        if config.circuit_breaker_enabled:
+            middleware.breaker = self.breaker = CircuitBreaker(
+                failure_threshold=config.circuit_breaker_threshold,
+                reset_timeout=config.circuit_breaker_reset_timeout
+            )
+            middleware.reject_status = config.circuit_breaker_reject_status
+            stale_grace = config.circuit_breaker_stale_grace
+        ttl = cfg.CONF.keystone_authtoken.token_cache_time
+        middleware.token_cache = self.token_cache = TokenCache(
+            max_size=config.token_cache_size,
+            ttl=ttl,
+            refresh_window=config.token_refresh_window,
+            stale_grace=stale_grace
+        )
+        if config.revocation_enabled:
+            feed = self.revocation_feed or KeystoneRevocationFeed(
+                self._make_identity_adapter())
+            interval = config.revocation_poll_interval
+            middleware.revocations = self.revocations = RevocationPoller(
+                feed,
+                self.token_cache,
+                interval=interval,
+                retention=ttl + stale_grace + interval
+            )
+        if config.token_refresh_enabled:
+            middleware.identity = self._make_identity_adapter()
+            middleware.refresher = self._refresher = TokenRefresher(
+                middleware.refresh_token,
+                workers=config.token_refresh_workers,
+                rate=config.token_refresh_rate
+            )
+        return middleware
+
+    def _make_identity_adapter(self):
+        """
+        Create an adapter of Keystone, authenticated as the service itself.
+
+        :raises: ValueError if `keystone_authtoken` has no `auth_type`.
+        :returns: The adapter, created once, with the `keystone_authtoken`
+                  credentials and options, as :mod:`keystonemiddleware`
+                  reads them.
+        :rtype: :class:`keystoneauth1.adapter.Adapter`
+        """
+        if self._identity_adapter is not None:
+            return self._identity_adapter
+        group = "keystone_authtoken"
+        auth = ksa_loading.load_auth_from_conf_options(cfg.CONF, group)
+        if auth is None:
+            raise ValueError("keystone_authtoken has no auth_type; the "
+                             "service has no credentials to call Keystone "
+                             "with.")
+        conf = cfg.CONF[group]
+        options = {
+            "cert": conf.certfile,
+            "key": conf.keyfile,
+            "cacert": conf.cafile,
+            "insecure": conf.insecure,
+            "timeout": conf.http_connect_timeout,
+        }
+        if self.http_pool is not None:
+            options["session"] = self.http_pool.session
+            if self.config.keystone_timeout is not None:
+                options["timeout"] = self.config.keystone_timeout
+        session = ksa_loading.session.Session().load_from_options(**options)
+        self._identity_adapter = ksa_adapter.Adapter(
+            session,
+            auth=auth,
+            service_type="identity",
+            interface=conf.interface,
+            region_name=conf.region_name,
+            connect_retries=conf.http_request_max_retries
+        )
+        return self._identity_adapter
+
+    def stats(self):
+        """
+        Report the state of the extension's token validation machinery.
+
+        :returns: A mapping with, for each enabled feature, the counters it
+                  reports: `http_pool` (see :func:`HTTPPool.stats`),
+                  `token_refresh` (see :func:`TokenRefresher.stats`),
+                  `circuit_breaker` (see :func:`CircuitBreaker.stats`),
+                  `revocation` (see :func:`RevocationPoller.stats`),
+                  `trusted_headers` (see
+                  :func:`TrustedHeaderMiddleware.stats`),
+                  `offline_validation` (see
+                  :func:`OfflineTokenMiddleware.stats`), `profiling`
+                  (see :func:`RequestProfiler.stats`) and `propagation`
+                  (see :func:`IdentityClient.stats`).
+        :rtype: dict
+        """
+        stats = {}
+        if self.http_pool is not None:
+            stats["http_pool"] = self.http_pool.stats()
+        if self._refresher is not None:
+            stats["token_refresh"] = self._refresher.stats()
+        if self.breaker is not None:
+            stats["circuit_breaker"] = self.breaker.stats()
+        if self.revocations is not None:
+            stats["revocation"] = self.revocations.stats()
+        if self.trusted_headers is not None:
+            stats["trusted_headers"] = self.trusted_headers.stats()
+        if self.offline is not None:
+            stats["offline_validation"] = self.offline.stats()
+        if self.profiler is not None:
+            stats["profiling"] = self.profiler.stats()
+        if self.client is not None:
+            stats["propagation"] = self.client.stats()
+        return stats
+
+    def _make_policy(self):
+        """
+        Load and compile the policy file named in oslo_config.
+
+        :returns: The compiled policy, or None if no policy file is
+                  configured.
+        :rtype: :class:`flask_keystone.policy.Policy`
+        """
+        if not self.config.policy_file:
+            return None
+        self.logger.debug("Loading policy file %s" % self.config.policy_file)
+        return Policy.from_file(
+            self.config.policy_file,
+            default_rule=self.config.policy_default_rule
+        )
+
+    def _audit(self, outcome, required=None, from_headers=False):
+        """
+        Record an auth decision on the audit stream, if enabled.
+
+        :param str outcome: The decision made for the current request.
+        :param required: The roles or scope required by the endpoint.
+        :param bool from_headers: Read the identity from the request headers
+                                  rather than :obj:`current_user`, for
+                                  decisions made before a user is attached.
+
+        The latency recorded is measured from the start of the extension's
+        before_request handler.
+        """
+        if self.audit is None:
+            return
+        if from_headers:
+            user_id = request.environ.get("HTTP_X_USER_ID")
+            project_id = request.environ.get("HTTP_X_PROJECT_ID")
+        else:
+            user_id = current_user.user_id or None
+            project_id = current_user.project_id or None
+        start = request.environ.get("flask_keystone.auth_start")
+        self.audit.record(
+            outcome=outcome,
+            user_id=user_id,
+            project_id=project_id,
+            method=request.method,
+            endpoint=request.path,
+            required=required,
+            latency=time.monotonic() - start if start else None
+        )
+
     def _make_before_request(self):
         """
         Generate the before_request function to be added to the app.
@@ -182,32 +730,62 @@ class FlaskKeystone(object):
 
             This function guarantees that a bad token will return a 401
             when :mod:`keystonemiddleware` is configured to
-            defer_auth_decision. Once this is done, it instantiates a user
-            from the generated User model and attaches it to the request
-            context for later access.
+            defer_auth_decision. The identity headers are read straight
+            from the WSGI environ. Once this is done, it attaches a user
+            from the generated User model to the request context for later
+            access; the user is only instantiated when first accessed. If
+            rate limiting is enabled, the request is then charged to the
+            user's quota, raising a
+            :exception:`exceptions.FlaskKeystoneTooManyRequests` once it
+            is exhausted. Requests asking to be profiled are finally allowed
+            to keep their profile if the user holds `profiling_role`.
             """
-            identity_status = request.headers.get(
-                "X-Identity-Status", "Invalid"
-            )
+            environ = request.environ
+            if self.audit is not None:
+                environ["flask_keystone.auth_start"] = time.monotonic()
+
+            identity_status = environ.get("HTTP_X_IDENTITY_STATUS")
             if identity_status != "Confirmed":
+                user_id = environ.get("HTTP_X_USER_ID", "None")
                 msg = ("Couldn't authenticate user '%s' with "
                        "X-Identity-Status '%s'")
-                self.logger.info(msg % (
-                    request.headers.get("X-User-Id", "None"),
-                    request.headers.get("X-Identity-Status", "None")
-                ))
+                self.auth_logger.info(
+                    ("unauthenticated", user_id, request.path),
+                    msg,
+                    user_id,
+                    identity_status or "None"
+                )
                 if not self.config.allow_anonymous_access:
                     msg = "Anonymous Access disabled, rejecting %s"
-                    self.logger.debug(
-                        msg % request.headers.get("X-User-Id", "None")
-                    )
+                    self.logger.debug(msg, user_id)
+                    self._audit("unauthorized", from_headers=True)
                     raise FlaskKeystoneUnauthorized()
                 else:
                     self.logger.debug("Setting Anonymous user.")
                     self._set_anonymous_user()
+                    self._audit("anonymous")
                     return
 
-            self._set_user(request)
+            self._set_user(request._get_current_object())
+
+            limiter = self.rate_limiter
+            if limiter is not None and not limiter.allow(current_user):
+                msg = "Rate limited User '%s' accessing '%s'."
+                self.auth_logger.info(
+                    ("rate_limited", current_user.user_id, request.path),
+                    msg,
+                    current_user.user_id,
+                    request.path
+                )
+                self._audit("rate_limited")
+                raise FlaskKeystoneTooManyRequests()
+
+            profiler = self.profiler
+            if profiler is not None and profiler.requested(environ):
+                if current_user.has_role(self.config.profiling_role):
+                    environ[ALLOWED_KEY] = True
+
+            self._audit("authenticated", from_headers=True)
 
         return before_request
 
@@ -259,6 +837,9 @@ class FlaskKeystone(object):
         extension, attempting to have all the same attributes (though they will
         all be empty strings other than `Anonymous.roles`), and having the
         same helper functions (though they will always return false).
+
+        A single, immutable instance is created alongside the class as
+        `Anonymous.instance`, and is shared by every anonymous request.
         """
         class Anonymous(AnonymousBase):
             """
@@ -272,6 +853,7 @@ class FlaskKeystone(object):
             pass
 
         Anonymous.generate_is_role_functions(self.roles)
+        Anonymous.instance = Anonymous()
 
         return Anonymous
 
@@ -279,26 +861,38 @@ class FlaskKeystone(object):
         """
         Require specific configured roles for access to a :mod:`flask` route.
 
-        :param roles: Role or list of roles to test for access
-                      (only one role is required to pass).
+        :param roles: Role, role expression or list of roles to test for
+                      access (only one role is required to pass).
         :type roles: str OR list(str)
         :raises: FlaskKeystoneForbidden
+        :raises: ValueError if a role expression is not valid.
 
         This method will gate a particular endpoint to only be accessed by
         :class:`FlaskKeystone.User`'s with a particular configured role. If the
         role given does not exist, or if the user does not have the requested
         role, a FlaskKeystoneForbidden exception will be thrown, resulting in a
         403 response to the client.
+
+        Roles may be combined into an expression, such as
+        "admin or (support and billing)". Expressions and lists of roles are
+        parsed once, when the endpoint is decorated, and evaluated with
+        bitwise tests against the user's roles.
         """
+        required = roles
+        if isinstance(roles, list):
+            required = RoleExpression.any_of(roles) if roles else None
+        elif isinstance(roles, str) and is_expression(roles):
+            required = RoleExpression(roles)
+        if isinstance(required, RoleExpression):
+            self._role_expressions.append(required)
+
         def wrap(f):
             @wraps(f)
             def wrapped_f(*args, **kwargs):
-                if isinstance(roles, list):
-                    if any(current_user.has_role(role) for role in roles):
-                        return f(*args, **kwargs)
-
-                elif isinstance(roles, str):
-                    if current_user.has_role(roles):
+                if isinstance(roles, (list, str)):
+                    user = current_user
+                    if required is not None and user.has_role(required):
+                        self._audit("authorized", roles)
                         return f(*args, **kwargs)
                 else:
                     msg = ("roles parameter for requires_role on endpoint %s "
@@ -311,12 +905,164 @@ class FlaskKeystone(object):
                 msg = ("Rejected User '%s' access to '%s' "
                        "due to RBAC. (Requires '%s')")
 
-                self.logger.info(msg % (
+                self.auth_logger.info(
+                    ("rbac", current_user.user_id, request.path),
+                    msg,
                     current_user.user_id,
                     request.path,
                     roles
-                ))
+                )
+
+                self._audit("forbidden", roles)
+                raise FlaskKeystoneForbidden()
+
+            return wrapped_f
+        return wrap
+
+    def requires_project(self, project_arg="project_id", domain_arg=None,
+                         override_role=None):
+        """
+        Require the URL's project or domain to match the user's scope.
+
+        :param str project_arg: Name of the view argument holding the
+                                project id. (default: "project_id")
+        :param str domain_arg: Name of the view argument holding the domain
+                               id, if the route is domain scoped.
+        :param str override_role: Configured role which bypasses the
+                                  ownership check. Defaults to the
+                                  `project_override_role` option.
+        :raises: FlaskKeystoneForbidden
+
+        This method will gate a particular endpoint to only be accessed by
+        :class:`FlaskKeystone.User`'s whose token is scoped to the project
+        (and/or domain) named in the route, for example:
+
+        .. code-block:: python
+
+           @app.route("/projects/<project_id>/servers")
+           @key.requires_project()
+           def list_servers(project_id):
+               ...
+
+        If the route does not carry the named view arguments, the endpoint is
+        considered misconfigured and a FlaskKeystoneForbidden exception will
+        be thrown, resulting in a 403 response to the client.
+        """
+        def wrap(f):
+            @wraps(f)
+            def wrapped_f(*args, **kwargs):
+                project_id = kwargs.get(project_arg)
+                domain_id = kwargs.get(domain_arg) if domain_arg else None
+
+                if project_id is None and domain_id is None:
+                    msg = ("requires_project on endpoint %s expects view "
+                           "argument '%s', but none was given.")
+                    self.logger.error(msg % (
+                        request.path,
+                        domain_arg or project_arg
+                    ))
+                    raise FlaskKeystoneForbidden()
+
+                scope = {"project_id": project_id, "domain_id": domain_id}
+                in_scope = True
+                if project_id is not None:
+                    in_scope = current_user.in_project(project_id)
+                if in_scope and domain_id is not None:
+                    in_scope = current_user.in_domain(domain_id)
+                if in_scope:
+                    self._audit("authorized", scope)
+                    return f(*args, **kwargs)
+
+                role = override_role or self.config.project_override_role
+                if role and current_user.has_role(role):
+                    self._audit("authorized", scope)
+                    return f(*args, **kwargs)
+
+                msg = ("Rejected User '%s' access to '%s' "
+                       "due to project scope. (Requires '%s')")
+
+                self.auth_logger.info(
+                    ("scope", current_user.user_id, request.path),
+                    msg,
+                    current_user.user_id,
+                    request.path,
+                    project_id if domain_id is None else domain_id
+                )
+
+                self._audit("forbidden", scope)
+                raise FlaskKeystoneForbidden()
+
+            return wrapped_f
+        return wrap
+
+    def enforce(self, rule, target=None):
+        """
+        Check a policy rule against :obj:`current_user`.
+
+        :param str rule: Name of the policy rule to check.
+        :param dict target: The object of the check, such as
+                            `{"project_id": project_id}`.
+        :returns: Whether or not the current user passes the rule.
+        :rtype: bool
+
+        The user's credentials are built once per request, and the result of
+        every rule evaluated (including rules referenced by other rules) is
+        cached for the rest of the request, keyed on the rule and target.
+        If no policy file is configured, every check fails.
+        """
+        if self.policy is None:
+            msg = "Enforcing policy rule '%s', but no policy_file is set."
+            self.logger.error(msg % rule)
+            return False
+
+        ctx = _get_request_ctx()
+        state = getattr(ctx, "keystone_policy", None)
+        if state is None:
+            state = ctx.keystone_policy = (credentials_for(current_user), {})
+        credentials, cache = state
+        return self.policy.enforce(rule, credentials, target, cache)
+
+    def requires_policy(self, rule):
+        """
+        Require a policy rule to pass for access to a :mod:`flask` route.
+
+        :param str rule: Name of the policy rule to check.
+        :raises: FlaskKeystoneForbidden
+
+        This method will gate a particular endpoint to only be accessed by
+        :class:`FlaskKeystone.User`'s passing a rule of the configured policy
+        file. The view arguments of the route are used as the target of the
+        check, so that rules such as "project_id:%(project_id)s" may be used:
+
+        .. code-block:: python
+
+           @app.route("/projects/<project_id>/servers")
+           @key.requires_policy("server:list")
+           def list_servers(project_id):
+               ...
+
+        If the rule does not pass, a FlaskKeystoneForbidden exception will be
+        thrown, resulting in a 403 response to the client.
+        """
+        def wrap(f):
+            @wraps(f)
+            def wrapped_f(*args, **kwargs):
+                if self.enforce(rule, kwargs):
+                    self._audit("authorized", rule)
+                    return f(*args, **kwargs)
+
+                msg = ("Rejected User '%s' access to '%s' "
+                       "due to policy. (Requires '%s')")
+
+                self.auth_logger.info(
+                    ("policy", current_user.user_id, request.path),
+                    msg,
+                    current_user.user_id,
+                    request.path,
+                    rule
+                )
 
+                self._audit("forbidden", rule)
                 raise FlaskKeystoneForbidden()
 
             return wrapped_f
@@ -339,10 +1085,13 @@ class FlaskKeystone(object):
             if current_user.anonymous:
                 msg = ("Rejected User '%s access to '%s' as user"
                        " could not be authenticated.")
-                self.logger.warn(msg % (
+                self.auth_logger.warning(
+                    ("login_required", current_user.user_id, request.path),
+                    msg,
                     current_user.user_id,
                     request.path
-                ))
+                )
+                self._audit("unauthorized")
                 raise FlaskKeystoneUnauthorized()
             return f(*args, **kwargs)
         return wrapped_f
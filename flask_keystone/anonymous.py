@@ -26,12 +26,17 @@ Once generated, the Anonymous model will have the following attributes:
   role as an arugment and returns a boolean if the user has the requested
   configured role (always `False`).
 - An approximation of all attrs that would be added by `keystonemiddleware`,
-  all set to an empty `str`, except roles, which is an emply list.
+  all set to an empty `str`, except roles, which is an empty frozenset.
+
+As every Anonymous user is identical, a single frozen instance is created
+alongside the generated class and shared by all anonymous requests.
 """
 
-from oslo_config import cfg
 from oslo_log import log as logging
 
+from flask_keystone.roles import RoleMap
+from flask_keystone.snapshot import IdentitySnapshot
+
 
 class AnonymousBase(object):
     """
@@ -53,8 +58,15 @@ class AnonymousBase(object):
     that should be present on a User class, though these attributes are
     statically generated based on `keystonemiddleware.auth_token` 's
     documentation (Though all attributes will be set to an empty string).
+
+    Instances are frozen once initialized: any attempt to set or delete an
+    attribute raises an `AttributeError`, which makes it safe to share a
+    single instance between threads.
     """
 
+    logger = logging.getLogger(__name__)
+    role_map = RoleMap({})
+
     def __init__(self):
         """
         Initialize an instance of :class:`flask_keystone.AnonymousBase`.
@@ -63,13 +75,6 @@ class AnonymousBase(object):
         with the exception that all attributes will be set to an empty string,
         and all helper methods will return False.
         """
-        self.logger = logging.getLogger(__name__)
-        try:
-            logging.register_options(cfg.CONF)
-        except cfg.ArgsAlreadyParsedError:  # pragma: no cover
-            pass
-        logging.setup(cfg.CONF, "flask_keystone")
-
         self.anonymous = True
         self.auth_token = ""
         self.service_token = ""
@@ -102,7 +107,59 @@ class AnonymousBase(object):
         self.user = ""
         self.role = ""
 
-        self.roles = []
+        self.roles = frozenset()
+        self.project_ids = frozenset()
+        self.domain_ids = frozenset()
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(
+                "Anonymous users are immutable, can't set '%s'." % name
+            )
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(
+                "Anonymous users are immutable, can't delete '%s'." % name
+            )
+        object.__delattr__(self, name)
+
+    def snapshot(self):
+        """
+        Take a compact, picklable snapshot of this instance.
+
+        :rtype: :class:`flask_keystone.snapshot.IdentitySnapshot`
+        """
+        return IdentitySnapshot.from_user(self)
+
+    def in_project(self, project_id):
+        """
+        Determine whether this instance is scoped to a project.
+
+        :param str project_id: The project (or legacy tenant) id to test.
+        :returns: Whether or not the token is scoped to the project.
+        :rtype: bool
+
+        Note that as this is an Anonymous user, this function will always
+        return `False`.
+        """
+        return False
+
+    def in_domain(self, domain_id):
+        """
+        Determine whether this instance is scoped to a domain.
+
+        :param str domain_id: The domain id to test.
+        :returns: Whether or not the token is scoped to the domain.
+        :rtype: bool
+
+        Note that as this is an Anonymous user, this function will always
+        return `False`.
+        """
+        return False
 
     def _has_keystone_role(self, role):
         """
@@ -151,5 +208,6 @@ class AnonymousBase(object):
         Note that as this is an Anonymous user, these functions will always
         return `False`.
         """
+        cls.role_map = RoleMap(roles)
         for access_role in roles.keys():
             setattr(cls, "is_" + access_role, lambda x: False)
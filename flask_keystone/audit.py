@@ -0,0 +1,188 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Asynchronous audit stream of authentication and authorization decisions.
+
+When `audit_enabled` is set, every decision made by the extension (a token
+accepted or rejected in `before_request`, a role or project check passed or
+failed in a decorator) is recorded as a structured event:
+
+.. code-block:: json
+
+   {
+      "outcome": "forbidden",
+      "user_id": "auser",
+      "project_id": "atenant",
+      "method": "GET",
+      "endpoint": "/requires_support",
+      "required": "support",
+      "latency": 0.00021
+   }
+
+Events are pushed onto a bounded queue without blocking the request, and a
+background thread writes them in batches to the `flask_keystone.audit`
+logger, one JSON document per line. When the queue is full, events are
+dropped and counted rather than slowing the request down; the drop count is
+reported with the next batch written.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+from oslo_log import log as logging
+
+
+_STOP = object()
+
+
+class AuditLogger(object):
+    """
+    Bounded, batching writer of audit events.
+
+    :param logger: Logger the batches are written to.
+                   (default: the `flask_keystone.audit` logger)
+    :param int queue_size: Maximum number of events waiting to be written.
+    :param int batch_size: Maximum number of events written at once.
+    :param float flush_interval: Maximum number of seconds an event waits
+                                 for its batch to fill up.
+
+    The writer thread is started on the first recorded event, and restarted
+    if the process has forked since, so it is safe to create an AuditLogger
+    before a pre-fork server spawns its workers.
+    """
+
+    def __init__(self, logger=None, queue_size=10000, batch_size=100,
+                 flush_interval=1.0):
+        self.logger = logger or logging.getLogger(__name__)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._reported_dropped = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._pid = None
+
+    def record(self, outcome, user_id=None, project_id=None, method=None,
+               endpoint=None, required=None, latency=None):
+        """
+        Queue an audit event, dropping it if the queue is full.
+
+        :param str outcome: The decision made, such as "authenticated",
+                            "unauthorized" or "forbidden".
+        :param str user_id: The id of the user the decision was made for.
+        :param str project_id: The project the user's token is scoped to.
+        :param str method: The HTTP method of the request.
+        :param str endpoint: The path of the request.
+        :param required: The roles or scope required by the endpoint.
+        :param float latency: Seconds spent in the extension before the
+                              decision was made.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        event = {
+            "outcome": outcome,
+            "user_id": user_id,
+            "project_id": project_id,
+            "method": method,
+            "endpoint": endpoint,
+            "required": required,
+            "latency": latency,
+        }
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Block until every queued event has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Write any queued events and stop the writer thread."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            self._pid = None
+
+    def _start(self):
+        """Start the writer thread for the current process."""
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # NOTE: the parent's writer thread did not survive the fork,
+                # and its queue may have been copied mid-operation.
+                self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(
+                target=self._run,
+                name="flask-keystone-audit"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = pid
+
+    def _run(self):
+        """Collect events into batches and write them until stopped."""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            except Exception:  # pragma: no cover
+                self.logger.exception("Failed to write audit events.")
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        """Write a batch of events to the audit logger."""
+        self.logger.info("\n".join(
+            json.dumps(event, sort_keys=True) for event in batch
+        ))
+        self.written += len(batch)
+
+        dropped = self.dropped
+        if dropped != self._reported_dropped:
+            msg = "Dropped %d audit events as the audit queue was full."
+            self.logger.warning(msg % (dropped - self._reported_dropped))
+            self._reported_dropped = dropped
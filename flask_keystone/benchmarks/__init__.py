@@ -0,0 +1,25 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for the per-request cost of the Flask Keystone Extension.
+
+Each benchmark is a runnable module, for example:
+
+.. code-block:: bash
+
+   python -m flask_keystone.benchmarks.allocations
+
+The auth throughput of a whole application under load is measured by the
+`flask-keystone-bench` command, see :mod:`flask_keystone.benchmarks.load`.
+"""
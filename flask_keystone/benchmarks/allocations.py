@@ -0,0 +1,267 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Allocation profile of the per-request identity path.
+
+This harness drives an application created by
+:func:`flask_keystone.benchmarks.app.make_app` through confirmed,
+anonymous and rejected requests with :mod:`tracemalloc` enabled, and
+reports, per request, the memory allocated by:
+
+- `UserBase.__init__`
+- `AnonymousBase.__init__`
+- the extension's `before_request` handler
+- `handle_exception`
+
+For each of these, three figures are reported:
+
+- `peak`: the high-water mark of memory allocated during the call, which
+  includes short-lived objects freed before the call returns.
+- `retained`: memory still allocated when the call returns.
+- `blocks`: the number of allocator blocks (roughly, objects) retained.
+
+:mod:`keystonemiddleware` is replaced by a pass-through, so it is not
+measured. Before Python 3.9, whose :mod:`tracemalloc` can't reset its peak,
+the `peak` of each call is only the memory it retains.
+
+If the peak allocation of any function exceeds its threshold, the run exits
+with a non-zero status, which allows it to guard against regressions in CI:
+
+.. code-block:: bash
+
+   python -m flask_keystone.benchmarks.allocations -n 2000 \\
+       --threshold before_request=12000
+"""
+
+import argparse
+import sys
+import tracemalloc
+
+from functools import wraps
+from unittest import mock
+
+import flask_keystone
+from flask_keystone.anonymous import AnonymousBase
+from flask_keystone.benchmarks.app import (clear, configure,
+                                           CONFIRMED_HEADERS, make_app)
+from flask_keystone.user import UserBase
+
+
+#: Scenarios, as (name, allow_anonymous_access, headers, expected status).
+SCENARIOS = [
+    ("confirmed", False, CONFIRMED_HEADERS, 200),
+    ("anonymous", True, {}, 200),
+    ("rejected", False, {}, 401),
+]
+
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+#: Default peak bytes allowed per request for each traced function.
+THRESHOLDS = {
+    "UserBase.__init__": 8192,
+    "AnonymousBase.__init__": 4096,
+    "before_request": 16384,
+    "handle_exception": 4096,
+}
+
+
+class AllocationTracer(object):
+    """
+    Accumulate the allocations made by wrapped functions.
+
+    Nested calls are supported: the peak of an outer call always includes
+    the peak of any call made within it.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._stack = []
+
+    def wrap(self, name, func):
+        """
+        Wrap a function so that its allocations are recorded under a name.
+
+        :param str name: The name to record allocations under.
+        :param func: The function to wrap.
+        :returns: The wrapped function.
+        """
+        @wraps(func)
+        def traced(*args, **kwargs):
+            self._enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._exit(name)
+        return traced
+
+    def reset(self):
+        """Discard all recorded allocations."""
+        self.stats = {}
+
+    def _enter(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            outer = self._stack[-1]
+            outer[2] = max(outer[2], peak)
+        if _reset_peak is not None:
+            _reset_peak()
+        self._stack.append([current, sys.getallocatedblocks(), current])
+
+    def _exit(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        if _reset_peak is None:
+            peak = current
+        blocks = sys.getallocatedblocks()
+        start, start_blocks, saved_peak = self._stack.pop()
+        peak = max(peak, saved_peak)
+        if self._stack:
+            outer = self._stack[-1]
+            outer[2] = max(outer[2], peak)
+
+        stat = self.stats.setdefault(name, [0, 0, 0, 0])
+        stat[0] += 1
+        stat[1] += peak - start
+        stat[2] += current - start
+        stat[3] += blocks - start_blocks
+
+
+def _make_app(tracer):
+    """Create the fake application, with the traced functions wrapped."""
+    make_before_request = flask_keystone.FlaskKeystone._make_before_request
+
+    def _make_before_request(self):
+        return tracer.wrap("before_request", make_before_request(self))
+
+    app, _ = make_app("allocations", patches=[
+        mock.patch.object(flask_keystone.FlaskKeystone,
+                          "_make_before_request", _make_before_request),
+        mock.patch.object(flask_keystone, "handle_exception",
+                          tracer.wrap("handle_exception",
+                                      flask_keystone.handle_exception)),
+    ])
+    return app
+
+
+def run(requests=1000, warmup=50):
+    """
+    Profile the allocations of each scenario.
+
+    :param int requests: Number of requests measured per scenario.
+    :param int warmup: Number of requests made before measuring, so that
+                       one-off caches are excluded.
+    :returns: Mapping of scenario to a mapping of function name to
+              `(peak, retained, blocks)` per request.
+    :rtype: dict
+    """
+    tracer = AllocationTracer()
+    results = {}
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    with mock.patch.object(UserBase, "__init__",
+                           tracer.wrap("UserBase.__init__",
+                                       UserBase.__init__)), \
+            mock.patch.object(AnonymousBase, "__init__",
+                              tracer.wrap("AnonymousBase.__init__",
+                                          AnonymousBase.__init__)):
+        try:
+            for name, allow_anonymous, headers, status in SCENARIOS:
+                configure(allow_anonymous=allow_anonymous)
+                client = _make_app(tracer).test_client()
+                for _ in range(warmup):
+                    client.get("/identity", headers=headers)
+                tracer.reset()
+                for _ in range(requests):
+                    response = client.get("/identity", headers=headers)
+                    if response.status_code != status:
+                        raise RuntimeError(
+                            "Scenario %s returned %d, expected %d." % (
+                                name, response.status_code, status))
+                results[name] = dict(
+                    (func, tuple(value / float(requests)
+                                 for value in stat[1:]))
+                    for func, stat in tracer.stats.items()
+                )
+        finally:
+            clear()
+            if not was_tracing:
+                tracemalloc.stop()
+
+    return results
+
+
+def check(results, thresholds):
+    """
+    Compare peak allocations against their thresholds.
+
+    :param dict results: Results as returned by :func:`run`.
+    :param dict thresholds: Mapping of function name to peak bytes allowed
+                            per request.
+    :returns: Human readable descriptions of each regression.
+    :rtype: list(str)
+    """
+    failures = []
+    for scenario, functions in sorted(results.items()):
+        for func, (peak, _, _) in sorted(functions.items()):
+            limit = thresholds.get(func)
+            if limit is not None and peak > limit:
+                failures.append(
+                    "%s: %s allocated %.0f bytes per request (limit %d)" % (
+                        scenario, func, peak, limit))
+    return failures
+
+
+def _threshold(value):
+    name, _, limit = value.partition("=")
+    if name not in THRESHOLDS or not limit.isdigit():
+        raise argparse.ArgumentTypeError(
+            "expected one of %s followed by =BYTES" % ", ".join(THRESHOLDS))
+    return name, int(limit)
+
+
+def main(argv=None):
+    """Run the allocation profile from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m flask_keystone.benchmarks.allocations",
+        description="Profile allocations of the per-request identity path."
+    )
+    parser.add_argument("-n", "--requests", type=int, default=1000,
+                        help="requests measured per scenario")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="requests made before measuring")
+    parser.add_argument("--threshold", type=_threshold, action="append",
+                        default=[], metavar="FUNCTION=BYTES",
+                        help="override the peak bytes allowed per request")
+    args = parser.parse_args(argv)
+
+    thresholds = dict(THRESHOLDS)
+    thresholds.update(args.threshold)
+    results = run(requests=args.requests, warmup=args.warmup)
+
+    row = "%-10s %-24s %10s %10s %8s"
+    print(row % ("scenario", "function", "peak", "retained", "blocks"))
+    for scenario, functions in sorted(results.items()):
+        for func, (peak, retained, blocks) in sorted(functions.items()):
+            print(row % (scenario, func, "%.0f" % peak, "%.0f" % retained,
+                         "%.1f" % blocks))
+
+    failures = check(results, thresholds)
+    for failure in failures:
+        print("REGRESSION: %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
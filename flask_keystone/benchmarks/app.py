@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The application driven by the benchmarks.
+
+:mod:`keystonemiddleware` is replaced by a pass-through while the
+application is created, and the identity headers it would normally produce
+are sent directly, so only the extension itself is measured.
+"""
+
+import contextlib
+
+from unittest import mock
+
+import flask
+
+from oslo_config import cfg
+
+import flask_keystone
+from flask_keystone.config import RAX_OPTS
+
+
+CONFIRMED_HEADERS = {
+    "X-Identity-Status": "Confirmed",
+    "X-User-Id": "auser",
+    "X-User-Name": "auser",
+    "X-Project-Id": "atenant",
+    "X-Project-Name": "atenantname",
+    "X-Roles": "admin_role_1,support_role_1",
+}
+
+ROLES = {
+    "admin_role_1": "admin",
+    "support_role_1": "support",
+}
+
+
+def configure(allow_anonymous=False, roles=None):
+    """
+    Override the extension's configuration for a benchmark.
+
+    :param bool allow_anonymous: Value of `allow_anonymous_access`.
+    :param dict roles: Value of `roles`. (default: :data:`ROLES`)
+    """
+    cfg.CONF.register_opts(RAX_OPTS, group="flask_keystone")
+    cfg.CONF.set_override("roles", roles or ROLES, group="flask_keystone")
+    cfg.CONF.set_override("allow_anonymous_access", allow_anonymous,
+                          group="flask_keystone")
+
+
+def clear():
+    """Remove the overrides made by :func:`configure`."""
+    cfg.CONF.clear_override("roles", group="flask_keystone")
+    cfg.CONF.clear_override("allow_anonymous_access", group="flask_keystone")
+
+
+def make_app(name="benchmark", patches=()):
+    """
+    Create an application with an `/identity` route, and its extension.
+
+    :param str name: Name of the application.
+    :param patches: Additional :func:`mock.patch` objects applied while the
+                    extension is initialized.
+    :returns: The application and its extension.
+    :rtype: tuple(`flask.Flask`, :class:`flask_keystone.FlaskKeystone`)
+    """
+    app = flask.Flask(name)
+    key = flask_keystone.FlaskKeystone()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(
+            flask_keystone.auth_token, "AuthProtocol",
+            lambda app, conf: app
+        ))
+        for patch in patches:
+            stack.enter_context(patch)
+        key.init_app(app)
+
+    @app.route("/identity")
+    def identity():
+        return "%s %s" % (flask_keystone.current_user.user_id,
+                          flask_keystone.current_user.has_role("admin"))
+
+    return app, key
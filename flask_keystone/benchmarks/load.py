@@ -0,0 +1,480 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Auth throughput of an application using the extension.
+
+This harness, installed as the `flask-keystone-bench` command, builds a
+Flask application with the extension, and drives it in-process through its
+WSGI interface with a mix of requests:
+
+- `valid`: a valid token, with a couple of roles.
+- `invalid`: a token which is rejected.
+- `anonymous`: no token at all.
+- `many_roles`: a valid token with `--roles` roles.
+
+Requests are spread over `--concurrency` threads or forked processes, and
+throughput and p50/p95/p99 latencies are reported for each kind of request,
+along with the status codes it got.
+
+In the default `keystone` mode, the application is wrapped in
+:mod:`keystonemiddleware` as usual, but tokens are looked up in memory
+rather than validated by Keystone, so that the cost of the middleware and
+the extension is measured without any network. In `trusted` mode, the
+identity headers are signed instead (see :mod:`flask_keystone.trusted`).
+
+Any option of the extension may be set from a configuration file, for
+instance to measure the token cache:
+
+.. code-block:: bash
+
+   flask-keystone-bench -n 20000 -c 8 --model processes \\
+       --mix valid=80,invalid=5,anonymous=5,many_roles=10 \\
+       --config-file bench.conf
+"""
+
+import argparse
+import bisect
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from unittest import mock
+
+import flask
+
+from keystoneauth1 import fixture as ksa_fixture
+from keystonemiddleware import auth_token
+from keystonemiddleware.auth_token import _exceptions as ksm_exceptions
+from oslo_config import cfg
+
+from flask_keystone import current_user, FlaskKeystone
+from flask_keystone.benchmarks.app import ROLES
+from flask_keystone.config import RAX_OPTS
+from flask_keystone.trusted import sign_headers
+
+
+KINDS = ("valid", "invalid", "anonymous", "many_roles")
+
+DEFAULT_MIX = {"valid": 70, "invalid": 10, "anonymous": 10, "many_roles": 10}
+
+_TRUSTED_KEY = "flask-keystone-bench"
+
+
+def parse_mix(value):
+    """
+    Parse a request mix, such as "valid=70,invalid=30".
+
+    :param str value: Comma separated kind=weight pairs.
+    :raises: ValueError if a kind or weight is not valid.
+    :returns: Mapping of kind to weight.
+    :rtype: dict
+    """
+    mix = {}
+    for pair in value.split(","):
+        kind, _, weight = pair.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError("Unknown request kind '%s'." % kind)
+        mix[kind] = float(weight)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The request mix must have a positive weight.")
+    return mix
+
+
+def _token(user_id, roles):
+    token = ksa_fixture.V2Token(user_id=user_id, tenant_id="atenant",
+                                tenant_name="atenantname")
+    for role in roles:
+        token.add_role(name=role)
+    return token
+
+
+def _identity(user_id, roles):
+    return {
+        "X-Identity-Status": "Confirmed",
+        "X-User-Id": user_id,
+        "X-User-Name": user_id,
+        "X-Project-Id": "atenant",
+        "X-Project-Name": "atenantname",
+        "X-Roles": ",".join(roles),
+    }
+
+
+def _many_roles(count):
+    roles = sorted(ROLES)
+    return roles + ["role_%d" % i for i in range(max(0, count - len(roles)))]
+
+
+def _headers(mode, many_roles):
+    """Build the request headers of each kind of request."""
+    valid_roles = sorted(ROLES)
+    if mode == "keystone":
+        return {
+            "valid": {"X-Auth-Token": "valid"},
+            "invalid": {"X-Auth-Token": "invalid"},
+            "anonymous": {},
+            "many_roles": {"X-Auth-Token": "many_roles"},
+        }
+
+    headers = {
+        "valid": _identity("auser", valid_roles),
+        "invalid": _identity("auser", valid_roles),
+        "anonymous": {},
+        "many_roles": _identity("auser", _many_roles(many_roles)),
+    }
+    for kind in ("valid", "many_roles"):
+        headers[kind]["X-Identity-Signature"] = sign_headers(
+            _TRUSTED_KEY, headers[kind], "GET", "/bench", timestamp=0)
+    headers["invalid"]["X-Identity-Signature"] = "0:" + "0" * 64
+    return headers
+
+
+def _environ(headers):
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": "/bench",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in headers.items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    return environ
+
+
+def configure(mode="keystone", allow_anonymous=True, config_file=None):
+    """
+    Configure the extension and keystonemiddleware for a run.
+
+    :param str mode: "keystone" or "trusted".
+    :param bool allow_anonymous: Value of `allow_anonymous_access`.
+    :param str config_file: oslo.config file read before the overrides.
+    """
+    if config_file:
+        cfg.CONF(args=[], default_config_files=[config_file])
+    cfg.CONF.register_opts(RAX_OPTS, group="flask_keystone")
+    cfg.CONF.set_override("roles", ROLES, group="flask_keystone")
+    cfg.CONF.set_override("allow_anonymous_access", allow_anonymous,
+                          group="flask_keystone")
+    cfg.CONF.set_override("trusted_headers_enabled", mode == "trusted",
+                          group="flask_keystone")
+    cfg.CONF.set_override("trusted_headers_key", _TRUSTED_KEY,
+                          group="flask_keystone")
+    cfg.CONF.set_override("trusted_headers_max_age", 0,
+                          group="flask_keystone")
+    cfg.CONF.set_override("delay_auth_decision", True,
+                          group="keystone_authtoken")
+    cfg.CONF.set_override("www_authenticate_uri", "https://localhost",
+                          group="keystone_authtoken")
+
+
+def clear():
+    """Remove the overrides made by :func:`configure`."""
+    for name in ("roles", "allow_anonymous_access",
+                 "trusted_headers_enabled", "trusted_headers_key",
+                 "trusted_headers_max_age"):
+        cfg.CONF.clear_override(name, group="flask_keystone")
+    for name in ("delay_auth_decision", "www_authenticate_uri"):
+        cfg.CONF.clear_override(name, group="keystone_authtoken")
+
+
+def build_app():
+    """
+    Create the application driven by the benchmark.
+
+    :returns: The application, with a `/bench` route.
+    :rtype: `flask.Flask`
+    """
+    app = flask.Flask("flask_keystone_bench")
+    key = FlaskKeystone()
+    key.init_app(app)
+
+    @app.route("/bench")
+    def bench():
+        if current_user.anonymous:
+            return "anonymous"
+        return "%s %s" % (current_user.user_id,
+                          current_user.has_role("admin"))
+
+    return app
+
+
+def _fetch_token_patch(many_roles):
+    """Patch keystonemiddleware to look tokens up in memory."""
+    tokens = {
+        "valid": _token("auser", sorted(ROLES)),
+        "many_roles": _token("auser", _many_roles(many_roles)),
+    }
+
+    def fetch_token(self, token, **kwargs):
+        try:
+            return tokens[token]
+        except KeyError:
+            raise ksm_exceptions.InvalidToken()
+
+    return mock.patch.object(auth_token.AuthProtocol, "fetch_token",
+                             fetch_token)
+
+
+def _plan(mix, requests, seed):
+    """Decide the kind of each request, in order."""
+    generator = random.Random(seed)
+    kinds = sorted(mix)
+    # NOTE: as random.Random.choices does, which Python 3.5 lacks.
+    cumulative = list(itertools.accumulate(mix[kind] for kind in kinds))
+    total = cumulative[-1]
+    return [kinds[bisect.bisect(cumulative, generator.random() * total)]
+            for _ in range(requests)]
+
+
+def _drive(app, environs, plan, timings):
+    """Issue the planned requests, recording (kind, status, seconds)."""
+    status = []
+
+    def start_response(value, headers, exc_info=None):
+        status.append(value)
+
+    for kind in plan:
+        environ = dict(environs[kind])
+        environ["wsgi.input"] = io.BytesIO()
+        del status[:]
+        start = time.perf_counter()
+        body = app(environ, start_response)
+        try:
+            for _ in body:
+                pass
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+        elapsed = time.perf_counter() - start
+        timings.append((kind, int(status[0].split(" ", 1)[0]), elapsed))
+
+
+def _split(plan, parts):
+    return [plan[i::parts] for i in range(parts)]
+
+
+def _run_threads(app, environs, plans):
+    timings = [[] for _ in plans]
+    threads = [threading.Thread(target=_drive,
+                                args=(app, environs, plan, timings[i]))
+               for i, plan in enumerate(plans)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [timing for part in timings for timing in part], elapsed
+
+
+def _run_processes(app, environs, plans):
+    children = []
+    start = time.perf_counter()
+    for plan in plans:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os.close(read_fd)
+            status = 0
+            try:
+                timings = []
+                _drive(app, environs, plan, timings)
+                with os.fdopen(write_fd, "w") as f:
+                    json.dump(timings, f)
+            except Exception:
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    timings = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        if data:
+            timings.extend(tuple(timing) for timing in json.loads(data))
+    return timings, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values.
+
+    :param list values: Sorted values.
+    :param float fraction: Percentile, between 0 and 1.
+    :rtype: float
+    """
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(fraction * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(timings, elapsed):
+    """
+    Aggregate request timings per kind of request.
+
+    :param list timings: (kind, status, seconds) of each request.
+    :param float elapsed: Wall clock seconds the requests took.
+    :returns: Mapping of kind (and "total") to its `requests`, `statuses`,
+              `throughput` (requests per second) and `p50`, `p95` and `p99`
+              latencies (milliseconds).
+    :rtype: dict
+    """
+    groups = {}
+    for kind, status, seconds in timings:
+        groups.setdefault(kind, []).append((status, seconds))
+    groups["total"] = [(status, seconds) for _, status, seconds in timings]
+
+    results = {}
+    for kind, values in groups.items():
+        latencies = sorted(seconds * 1000 for _, seconds in values)
+        statuses = {}
+        for status, _ in values:
+            statuses[status] = statuses.get(status, 0) + 1
+        results[kind] = {
+            "requests": len(values),
+            "statuses": statuses,
+            "throughput": len(values) / elapsed if elapsed else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+    return results
+
+
+def run(requests=10000, concurrency=4, model="threads", mix=None,
+        mode="keystone", many_roles=100, warmup=100, config_file=None,
+        seed=0):
+    """
+    Drive the application with a mix of requests.
+
+    :param int requests: Number of requests measured.
+    :param int concurrency: Number of threads or processes.
+    :param str model: "threads" or "processes".
+    :param dict mix: Weight of each kind of request.
+                     (default: :data:`DEFAULT_MIX`)
+    :param str mode: "keystone" or "trusted".
+    :param int many_roles: Roles held by `many_roles` requests.
+    :param int warmup: Requests issued, and not measured, before the run.
+    :param str config_file: oslo.config file of extension options.
+    :param int seed: Seed of the request plan.
+    :returns: As :func:`summarize`.
+    :rtype: dict
+    """
+    mix = mix or DEFAULT_MIX
+    configure(mode=mode, config_file=config_file)
+    try:
+        with _fetch_token_patch(many_roles):
+            app = build_app()
+            environs = dict(
+                (kind, _environ(headers))
+                for kind, headers in _headers(mode, many_roles).items()
+            )
+            _drive(app, environs, _plan(mix, warmup, seed + 1), [])
+
+            plans = _split(_plan(mix, requests, seed), max(1, concurrency))
+            if model == "processes":
+                timings, elapsed = _run_processes(app, environs, plans)
+            else:
+                timings, elapsed = _run_threads(app, environs, plans)
+    finally:
+        clear()
+    return summarize(timings, elapsed)
+
+
+def _format(value, pattern="%.3f"):
+    return "-" if value is None else pattern % value
+
+
+def main(argv=None):
+    """Run the auth throughput benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="flask-keystone-bench",
+        description="Measure the auth throughput of the Flask Keystone "
+                    "Extension."
+    )
+    parser.add_argument("-n", "--requests", type=int, default=10000,
+                        help="requests measured")
+    parser.add_argument("-c", "--concurrency", type=int, default=4,
+                        help="threads or processes issuing requests")
+    parser.add_argument("--model", choices=["threads", "processes"],
+                        default="threads",
+                        help="run requests in threads or forked processes")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weight of each kind of request, as "
+                             "valid=70,invalid=10,anonymous=10,"
+                             "many_roles=10")
+    parser.add_argument("--mode", choices=["keystone", "trusted"],
+                        default="keystone",
+                        help="validate tokens with keystonemiddleware, or "
+                             "trust signed identity headers")
+    parser.add_argument("--roles", type=int, default=100,
+                        help="roles held by many_roles tokens")
+    parser.add_argument("--warmup", type=int, default=100,
+                        help="requests issued before measuring")
+    parser.add_argument("--config-file",
+                        help="oslo.config file of extension options")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.model == "processes" and not hasattr(os, "fork"):
+        print("The processes model requires os.fork.")
+        return 1
+
+    results = run(requests=args.requests, concurrency=args.concurrency,
+                  model=args.model, mix=args.mix, mode=args.mode,
+                  many_roles=args.roles, warmup=args.warmup,
+                  config_file=args.config_file)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return 0
+
+    row = "%-11s %9s %-18s %12s %9s %9s %9s"
+    print(row % ("outcome", "requests", "statuses", "req/s", "p50 (ms)",
+                 "p95 (ms)", "p99 (ms)"))
+    for kind in KINDS + ("total",):
+        if kind not in results:
+            continue
+        figures = results[kind]
+        statuses = ",".join("%s:%s" % item for item in
+                            sorted(figures["statuses"].items()))
+        print(row % (kind, figures["requests"], statuses,
+                     _format(figures["throughput"], "%.1f"),
+                     _format(figures["p50"]), _format(figures["p95"]),
+                     _format(figures["p99"])))
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
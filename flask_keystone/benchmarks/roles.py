@@ -0,0 +1,131 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cost of role handling for users holding many keystone roles.
+
+Federated users may arrive with hundreds of keystone roles in "X-Roles".
+For users holding 1, 10, 100 and 1000 roles, this harness reports, in
+microseconds per call:
+
+- `parse`: parsing the header with :func:`flask_keystone.roles.parse_roles`,
+  as the first request carrying it does.
+- `user`: creating a User from the request's identity headers, whose roles
+  were parsed before.
+- `has_role`: a configured role check.
+- `keystone_role`: testing a keystone role the user doesn't hold.
+
+.. code-block:: bash
+
+   python -m flask_keystone.benchmarks.roles -n 2000
+"""
+
+import argparse
+import sys
+import timeit
+
+from types import SimpleNamespace
+
+from flask_keystone.benchmarks.app import CONFIRMED_HEADERS, ROLES
+from flask_keystone.roles import parse_roles
+from flask_keystone.user import UserBase
+
+
+SIZES = (1, 10, 100, 1000)
+
+
+def _request(count):
+    """Build a request whose user holds `count` keystone roles."""
+    roles = ["admin_role_1"] + ["role_%d" % i for i in range(count - 1)]
+    environ = dict(
+        ("HTTP_" + name.upper().replace("-", "_"), value)
+        for name, value in CONFIRMED_HEADERS.items()
+    )
+    environ["HTTP_X_ROLES"] = ", ".join(roles)
+    return SimpleNamespace(environ=environ)
+
+
+def _user_model():
+    configured = {}
+    for keystone_role, flask_role in ROLES.items():
+        configured.setdefault(flask_role, set()).add(keystone_role)
+
+    class User(UserBase):
+        pass
+
+    User.generate_has_role_function(configured)
+    User.generate_is_role_functions(configured)
+    return User
+
+
+def run(requests=1000, sizes=SIZES):
+    """
+    Measure role handling for each number of roles.
+
+    :param int requests: Calls measured per figure.
+    :param sizes: Numbers of keystone roles held by the user.
+    :returns: Mapping of number of roles to a mapping of figure name to
+              microseconds per call.
+    :rtype: dict
+    """
+    User = _user_model()
+    results = {}
+    for count in sizes:
+        request = _request(count)
+        header = request.environ["HTTP_X_ROLES"]
+        user = User(request)
+
+        vocabulary = User.role_map.vocabulary
+
+        figures = {
+            "parse": timeit.timeit(lambda: parse_roles(header, vocabulary),
+                                   number=requests),
+            "user": timeit.timeit(lambda: User(request), number=requests),
+            "has_role": timeit.timeit(lambda: user.has_role("admin"),
+                                      number=requests),
+            "keystone_role": timeit.timeit(
+                lambda: user._has_keystone_role("unheld_role"),
+                number=requests),
+        }
+        results[count] = dict(
+            (name, seconds * 1e6 / requests)
+            for name, seconds in figures.items()
+        )
+    return results
+
+
+def main(argv=None):
+    """Run the role handling benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m flask_keystone.benchmarks.roles",
+        description="Measure role handling for users with many roles."
+    )
+    parser.add_argument("-n", "--requests", type=int, default=1000,
+                        help="calls measured per figure")
+    args = parser.parse_args(argv)
+
+    results = run(requests=args.requests)
+    row = "%-6s %12s %12s %14s %18s"
+    print(row % ("roles", "parse (us)", "user (us)", "has_role (us)",
+                 "keystone_role (us)"))
+    for count in sorted(results):
+        figures = results[count]
+        print(row % tuple([count] + [
+            "%.2f" % figures[name]
+            for name in ("parse", "user", "has_role", "keystone_role")
+        ]))
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
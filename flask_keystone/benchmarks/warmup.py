@@ -0,0 +1,174 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cost of forking workers with and without :func:`FlaskKeystone.warmup`.
+
+This harness imitates a pre-fork server: the application is loaded once in
+the parent process, optionally warmed up, and then several workers are
+forked from it. Each worker reports:
+
+- `first`: the latency of its first request, in milliseconds.
+- `rest`: the mean latency of its following requests, in milliseconds.
+- `private`: the memory it no longer shares with the parent, in KiB, after
+  serving its requests and running a full garbage collection.
+- `rss`: its resident set size, in KiB.
+
+Memory figures are read from `/proc/self/smaps_rollup`, so are only
+available on Linux.
+
+.. code-block:: bash
+
+   python -m flask_keystone.benchmarks.warmup --workers 4 -n 200
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+from flask_keystone.benchmarks.app import (clear, configure,
+                                           CONFIRMED_HEADERS, make_app)
+
+
+def _memory():
+    """Read the private and resident memory of this process, in KiB."""
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0])
+    except (IOError, OSError):
+        return None, None
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return private, fields.get("Rss")
+
+
+def _worker(app, requests, write_fd):
+    """Serve requests in a forked worker, and report to the parent."""
+    client = app.test_client()
+    start = time.perf_counter()
+    client.get("/identity", headers=CONFIRMED_HEADERS)
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get("/identity", headers=CONFIRMED_HEADERS)
+    rest = (time.perf_counter() - start) / max(requests, 1)
+
+    gc.collect()
+    private, rss = _memory()
+    with os.fdopen(write_fd, "w") as f:
+        json.dump({"first": first * 1000, "rest": rest * 1000,
+                   "private": private, "rss": rss}, f)
+
+
+def _fork_workers(app, workers, requests):
+    """Fork workers from the current process and collect their reports."""
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            os.close(read_fd)
+            status = 0
+            try:
+                _worker(app, requests, write_fd)
+            except Exception:
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    reports = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as f:
+            data = f.read()
+        os.waitpid(pid, 0)
+        if data:
+            reports.append(json.loads(data))
+    return reports
+
+
+def _mean(reports, name):
+    values = [report[name] for report in reports
+              if report[name] is not None]
+    return sum(values) / len(values) if values else None
+
+
+def run(workers=4, requests=200):
+    """
+    Compare workers forked from a cold and a warmed up application.
+
+    :param int workers: Number of workers forked for each mode.
+    :param int requests: Number of requests served by each worker after
+                         its first.
+    :returns: Mapping of mode ("cold" or "warm") to the mean of each figure
+              reported by its workers.
+    :rtype: dict
+    """
+    results = {}
+    configure()
+    try:
+        for mode in ("cold", "warm"):
+            app, key = make_app("warmup_%s" % mode)
+            if mode == "warm":
+                key.warmup(app)
+            reports = _fork_workers(app, workers, requests)
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+            results[mode] = dict(
+                (name, _mean(reports, name))
+                for name in ("first", "rest", "private", "rss")
+            )
+    finally:
+        clear()
+    return results
+
+
+def main(argv=None):
+    """Run the warmup comparison from the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python -m flask_keystone.benchmarks.warmup",
+        description="Compare forked workers with and without warmup."
+    )
+    parser.add_argument("--workers", type=int, default=4,
+                        help="workers forked for each mode")
+    parser.add_argument("-n", "--requests", type=int, default=200,
+                        help="requests served by each worker")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        print("This benchmark requires os.fork.")
+        return 1
+
+    results = run(workers=args.workers, requests=args.requests)
+    row = "%-6s %12s %12s %14s %10s"
+    print(row % ("mode", "first (ms)", "rest (ms)", "private (KiB)",
+                 "rss (KiB)"))
+    for mode in ("cold", "warm"):
+        figures = results[mode]
+        print(row % tuple([mode] + [
+            "-" if figures[name] is None else "%.2f" % figures[name]
+            for name in ("first", "rest", "private", "rss")
+        ]))
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Circuit breaker around token validation.
+
+When Keystone is slow or down, every request carrying a token the service
+has not validated recently waits for the validation to time out. With
+`circuit_breaker_enabled`, after `circuit_breaker_threshold` consecutive
+validations fail, the circuit opens and Keystone is no longer called:
+
+- tokens validated before the outage keep being served from the in-process
+  token cache, for up to `circuit_breaker_stale_grace` seconds after their
+  entry would have expired (and never after the token itself expires),
+- other tokens are rejected at once, with a 503 or, if
+  `circuit_breaker_reject_status` is 401, as invalid tokens.
+
+After `circuit_breaker_reset_timeout` seconds, the circuit is half-open: a
+single validation is let through as a probe, and closes the circuit if
+Keystone answers it, or reopens it if not.
+
+.. code-block:: ini
+
+   [flask_keystone]
+   circuit_breaker_enabled = True
+   circuit_breaker_threshold = 5
+   circuit_breaker_reset_timeout = 30
+   circuit_breaker_stale_grace = 300
+   circuit_breaker_reject_status = 503
+
+Only failures to reach Keystone count: a token Keystone rejects is a
+successful validation. The state of the circuit, and how many requests it
+rejected or served from stale entries, are reported by
+:func:`FlaskKeystone.stats`.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker(object):
+    """
+    Tracks failures of a remote service, and when to stop calling it.
+
+    :param int failure_threshold: Consecutive failures after which the
+                                  circuit opens. (default: 5)
+    :param float reset_timeout: Seconds after which an open circuit lets a
+                                probe through. (default: 30)
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self.served_stale = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Decide whether the service may be called.
+
+        :returns: Whether or not the call may go ahead. When the circuit is
+                  half-open, only one call at a time is allowed, and its
+                  outcome must be recorded.
+        :rtype: bool
+        """
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() >= self._opened_at + self.reset_timeout:
+                    self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Record a call the service answered, closing the circuit."""
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                LOG.info("Keystone is reachable again; closing the circuit.")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """Record a call the service failed, opening the circuit if due."""
+        with self._lock:
+            self.failures += 1
+            tripped = self.failures >= self.failure_threshold
+            if self.state == HALF_OPEN or (self.state == CLOSED and tripped):
+                LOG.warning("Keystone is unreachable after %d failures; "
+                            "opening the circuit for %s seconds."
+                            % (self.failures, self.reset_timeout))
+                self.state = OPEN
+                self.opened += 1
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self):
+        """
+        Report the state of the circuit.
+
+        :returns: The `state` ("closed", "open" or "half_open"), consecutive
+                  `failures`, times it `opened`, calls it `rejected`, and
+                  tokens `served_stale` while Keystone was unavailable.
+        :rtype: dict
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "served_stale": self.served_stale,
+        }
@@ -55,6 +55,15 @@ And it is also possible to specify several roles:
    [flask_keystone]
    roles = admin_role_1:admin,support_role_1:support
 
+Whole families of keystone roles may be mapped at once with glob patterns,
+in the "role_patterns" directive. As keystone roles often contain colons,
+its entries take the form "pattern=configured_role":
+
+.. code-block:: ini
+
+   [flask_keystone]
+   role_patterns = rax_managed:*=managed,ticketing:admin:*=support
+
 Using a Different Configuration Group
 -------------------------------------
 
@@ -100,6 +109,241 @@ Or alternately, if you are using the Application Factory construct for Flask:
 
 
 
+Project Scoped Access
+---------------------
+
+Endpoints decorated with :func:`FlaskKeystone.requires_project` only allow
+callers whose token is scoped to the project (or domain) named in the URL.
+A configured role may be nominated to bypass this check, which is useful for
+operators who need to act on any tenant:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   roles = admin_role_1:admin
+   project_override_role = admin
+
+Rate Limiting
+-------------
+
+Authenticated requests can be throttled per user (or per project) with an
+in-process token bucket. Holders of a configured role may be granted a more
+generous quota, and throttled requests receive a 429 response:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   roles = admin_role_1:admin
+   rate_limit_enabled = True
+   rate_limit_key = project_id
+   rate_limit_rate = 10
+   rate_limit_burst = 20
+   rate_limit_role_quotas = admin:100
+
+Auditing
+--------
+
+Every authentication and authorization decision made by the extension can be
+recorded as a JSON event on the `flask_keystone.audit` logger. Events are
+queued and written in batches by a background thread, so auditing never
+blocks a request; if the queue fills up, events are dropped and counted:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   audit_enabled = True
+   audit_queue_size = 10000
+   audit_batch_size = 100
+   audit_flush_interval = 1.0
+
+Logging Auth Failures
+---------------------
+
+Rejected requests are logged with the user, path and reason they were
+rejected for. To keep a single broken client from flooding the logs, these
+messages may be sampled and capped per user, path and reason; suppressed
+messages are reported in a summary line once each interval has passed:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   log_sample_rate = 0.1
+   log_rate_limit = 10
+   log_rate_interval = 60
+
+Policy Files
+------------
+
+Instead of (or alongside) configured roles, endpoints may be gated by rules
+from a standard OpenStack policy file with
+:func:`FlaskKeystone.requires_policy`. The file is loaded and compiled once,
+when the extension is initialized; rules which are not defined fall back to
+`policy_default_rule`:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   policy_file = /etc/myapp/policy.yaml
+   policy_default_rule = default
+
+Token Refresh
+-------------
+
+Tokens validated by :mod:`keystonemiddleware` are cached for
+`token_cache_time` seconds. With `token_refresh_enabled`, tokens still in
+use near the end of that time are revalidated in the background, so that
+steady traffic never waits on Keystone:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   token_refresh_enabled = True
+   token_refresh_window = 30
+   token_refresh_workers = 2
+   token_refresh_rate = 10
+
+Connection Pooling
+------------------
+
+With `keystone_pool_enabled`, tokens are validated over a single pool of
+keep-alive connections per process, rather than keystonemiddleware's default
+session, so that TLS handshakes with Keystone are only paid as the pool
+grows. Retries of failed connections are capped process-wide by
+`keystone_retry_budget` (per second), and come before keystonemiddleware's
+own `http_request_max_retries`:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   keystone_pool_enabled = True
+   keystone_pool_size = 10
+   keystone_pool_block = False
+   keystone_keepalive = True
+   keystone_timeout = 5
+   keystone_retries = 2
+   keystone_retry_budget = 1
+
+Pool saturation and connection counts are reported by
+:func:`FlaskKeystone.stats`.
+
+Circuit Breaker
+---------------
+
+With `circuit_breaker_enabled`, consecutive failures to reach Keystone open
+a circuit: Keystone is no longer called, tokens validated before the outage
+are served from the in-process cache for up to `circuit_breaker_stale_grace`
+seconds past their expiry, and other tokens are rejected at once. A single
+probe is let through every `circuit_breaker_reset_timeout` seconds:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   circuit_breaker_enabled = True
+   circuit_breaker_threshold = 5
+   circuit_breaker_reset_timeout = 30
+   circuit_breaker_stale_grace = 300
+   circuit_breaker_reject_status = 503
+
+The state of the circuit is reported by :func:`FlaskKeystone.stats`.
+
+Token Revocation
+----------------
+
+With `revocation_enabled`, Keystone's revocation events are polled every
+`revocation_poll_interval` seconds, and revoked tokens are removed from the
+in-process token cache, so that long `token_cache_time` values remain safe:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   revocation_enabled = True
+   revocation_poll_interval = 10
+
+Trusted Headers
+---------------
+
+Behind a gateway which already validates tokens, or for load tests, the
+identity headers may instead be set by the upstream hop and signed with a
+shared key (see :mod:`flask_keystone.trusted`). Tokens are then not
+validated at all, and requests without a valid signature are treated as
+carrying an invalid token:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   trusted_headers_enabled = True
+   trusted_headers_key = a-long-random-secret
+   trusted_headers_max_age = 300
+
+Offline Validation
+------------------
+
+With `offline_validation_enabled`, tokens issued as JSON Web Signatures
+are verified in the worker against a local keyset file, which is reloaded
+when it changes, and the identity headers built from their claims (see
+:mod:`flask_keystone.offline`). Other tokens are still validated by
+:mod:`keystonemiddleware`, unless `offline_fallback` is disabled:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   offline_validation_enabled = True
+   offline_keyset_file = /etc/service/keyset.json
+   offline_issuer = https://tokens.example.com
+   offline_audience = service
+
+Request Profiling
+-----------------
+
+With `profiling_enabled`, a `profiling_sample_rate` fraction of requests,
+and requests made with the `X-Flask-Keystone-Profile` header and a valid
+token by holders of `profiling_role`, are profiled with :mod:`cProfile`.
+The latest profiles are served to holders of `profiling_role` at
+`profiling_endpoint` (see :mod:`flask_keystone.profiling`):
+
+.. code-block:: ini
+
+   [flask_keystone]
+   profiling_enabled = True
+   profiling_role = admin
+   profiling_sample_rate = 0.001
+
+Identity Propagation
+--------------------
+
+With `propagation_enabled`, `FlaskKeystone.client` makes requests to other
+services on behalf of the current user, forwarding its token (and, with
+`propagation_service_token`, a token of the service itself) over a pool of
+keep-alive connections shared by the process. With
+`propagation_signing_key`, the caller's identity headers are forwarded
+signed, so that downstream services in trusted-header mode don't validate
+the token again (see :mod:`flask_keystone.propagation`):
+
+.. code-block:: ini
+
+   [flask_keystone]
+   propagation_enabled = True
+   propagation_pool_size = 20
+   propagation_timeout = 10
+   propagation_signing_key = a-long-random-secret
+
+Pre-fork Servers
+----------------
+
+When the application is loaded once and forked into workers, as gunicorn
+does with `preload_app = True`, call :func:`FlaskKeystone.warmup` once all
+routes are registered. It builds the state the extension would otherwise
+create on each worker's first request, and freezes the heap from the
+garbage collector so that workers keep sharing it:
+
+.. code-block:: python
+
+   app = create_app(__name__)
+   key.warmup(app)
+
+The effect on worker memory and first request latency can be measured with
+`python -m flask_keystone.benchmarks.warmup`.
+
 Example Configuration File
 --------------------------
 
@@ -124,5 +368,163 @@ from oslo_config import cfg
 
 RAX_OPTS = [
     cfg.DictOpt('roles', default={}),
-    cfg.BoolOpt('allow_anonymous_access', default=False)
+    cfg.ListOpt('role_patterns', default=[],
+                help='Glob patterns of keystone roles granting configured '
+                     'roles, as pattern=configured_role entries.'),
+    cfg.BoolOpt('allow_anonymous_access', default=False),
+    cfg.StrOpt('project_override_role', default=None,
+               help='Configured role which bypasses project and domain '
+                    'ownership checks made by requires_project.'),
+    cfg.BoolOpt('rate_limit_enabled', default=False,
+                help='Throttle authenticated requests per identity.'),
+    cfg.StrOpt('rate_limit_key', default='user_id',
+               choices=['user_id', 'project_id'],
+               help='User attribute on which request quotas are keyed.'),
+    cfg.FloatOpt('rate_limit_rate', default=10.0, min=0,
+                 help='Requests per second allowed for each identity.'),
+    cfg.IntOpt('rate_limit_burst', default=20, min=1,
+               help='Requests each identity may make in a single burst.'),
+    cfg.DictOpt('rate_limit_role_quotas', default={},
+                help='Requests per second for holders of configured roles, '
+                     'as configured_role:rate pairs.'),
+    cfg.BoolOpt('audit_enabled', default=False,
+                help='Write auth decisions to the flask_keystone.audit '
+                     'logger from a background thread.'),
+    cfg.IntOpt('audit_queue_size', default=10000, min=1,
+               help='Audit events held in memory before new events are '
+                    'dropped.'),
+    cfg.IntOpt('audit_batch_size', default=100, min=1,
+               help='Maximum number of audit events written at once.'),
+    cfg.FloatOpt('audit_flush_interval', default=1.0, min=0,
+                 help='Seconds an audit event may wait for its batch.'),
+    cfg.FloatOpt('log_sample_rate', default=1.0, min=0, max=1,
+                 help='Fraction of auth failure messages which are logged.'),
+    cfg.IntOpt('log_rate_limit', default=0, min=0,
+               help='Auth failure messages logged per user, path and reason '
+                    'in each log_rate_interval, or 0 for no limit.'),
+    cfg.FloatOpt('log_rate_interval', default=60.0, min=1,
+                 help='Seconds after which suppressed auth failure messages '
+                      'are summarized.'),
+    cfg.StrOpt('policy_file', default=None,
+               help='Path to a JSON or YAML oslo.policy style policy file, '
+                    'enforced by requires_policy.'),
+    cfg.StrOpt('policy_default_rule', default='default',
+               help='Policy rule checked in place of rules which are not '
+                    'defined in the policy file.'),
+    cfg.BoolOpt('token_refresh_enabled', default=False,
+                help='Revalidate cached tokens in the background before '
+                     'their cache entries expire.'),
+    cfg.IntOpt('token_cache_size', default=10000, min=1,
+               help='Validated tokens held in the in-process token cache.'),
+    cfg.FloatOpt('token_refresh_window', default=30.0, min=0,
+                 help='Seconds before a cached token expires from which '
+                      'requests carrying it trigger a refresh.'),
+    cfg.IntOpt('token_refresh_workers', default=2, min=1,
+               help='Threads revalidating tokens in the background.'),
+    cfg.FloatOpt('token_refresh_rate', default=10.0, min=0,
+                 help='Maximum number of token refreshes started per second.'),
+    cfg.BoolOpt('keystone_pool_enabled', default=False,
+                help='Validate tokens over a pool of keep-alive connections '
+                     'shared by the process.'),
+    cfg.IntOpt('keystone_pool_size', default=10, min=1,
+               help='Connections to each Keystone host kept open.'),
+    cfg.BoolOpt('keystone_pool_block', default=False,
+                help='Wait for a free pooled connection rather than opening '
+                     'an extra one when the pool is saturated.'),
+    cfg.BoolOpt('keystone_keepalive', default=True,
+                help='Enable TCP keep-alive on pooled connections.'),
+    cfg.FloatOpt('keystone_timeout', default=None, min=0,
+                 help='Seconds before a request to Keystone times out. '
+                      'Defaults to http_connect_timeout.'),
+    cfg.IntOpt('keystone_retries', default=0, min=0,
+               help='Retries of failed connections to Keystone, made by the '
+                    'pool before keystonemiddleware\'s own retries.'),
+    cfg.FloatOpt('keystone_retry_budget', default=1.0, min=0,
+                 help='Retries of failed connections allowed per second '
+                      'across the process.'),
+    cfg.BoolOpt('circuit_breaker_enabled', default=False,
+                help='Stop calling Keystone while it is unreachable, serving '
+                     'previously validated tokens from the cache.'),
+    cfg.IntOpt('circuit_breaker_threshold', default=5, min=1,
+               help='Consecutive failures to reach Keystone after which the '
+                    'circuit opens.'),
+    cfg.FloatOpt('circuit_breaker_reset_timeout', default=30.0, min=0,
+                 help='Seconds after which an open circuit lets a probe '
+                      'through to Keystone.'),
+    cfg.FloatOpt('circuit_breaker_stale_grace', default=300.0, min=0,
+                 help='Seconds past their cache expiry during which '
+                      'validated tokens are served while Keystone is '
+                      'unreachable.'),
+    cfg.IntOpt('circuit_breaker_reject_status', default=503,
+               choices=[401, 503],
+               help='Status returned, while the circuit is open, to requests '
+                    'carrying a token which is not cached.'),
+    cfg.BoolOpt('revocation_enabled', default=False,
+                help='Remove revoked tokens from the in-process token cache, '
+                     'by polling Keystone revocation events.'),
+    cfg.FloatOpt('revocation_poll_interval', default=10.0, min=1,
+                 help='Seconds between polls of Keystone revocation events.'),
+    cfg.BoolOpt('trusted_headers_enabled', default=False,
+                help='Skip keystonemiddleware, and trust identity headers '
+                     'signed with trusted_headers_key instead.'),
+    cfg.StrOpt('trusted_headers_key', default=None, secret=True,
+               help='Key shared with the hops signing identity headers.'),
+    cfg.FloatOpt('trusted_headers_max_age', default=300.0, min=0,
+                 help='Seconds a signature of identity headers is accepted '
+                      'for, or 0 to accept signatures of any age.'),
+    cfg.BoolOpt('offline_validation_enabled', default=False,
+                help='Verify JWS tokens locally against the keys in '
+                     'offline_keyset_file.'),
+    cfg.StrOpt('offline_keyset_file', default=None,
+               help='Path to the JSON Web Key Set file of keys with which '
+                    'tokens may be signed.'),
+    cfg.FloatOpt('offline_keyset_check_interval', default=5.0, min=0,
+                 help='Seconds between checks of the keyset file for '
+                      'changes.'),
+    cfg.StrOpt('offline_issuer', default=None,
+               help='Issuer (iss claim) required of tokens verified '
+                    'offline.'),
+    cfg.StrOpt('offline_audience', default=None,
+               help='Audience (aud claim) required of tokens verified '
+                    'offline.'),
+    cfg.FloatOpt('offline_leeway', default=0.0, min=0,
+                 help='Seconds of clock skew tolerated when checking token '
+                      'expiry.'),
+    cfg.BoolOpt('offline_fallback', default=True,
+                help='Validate tokens which are not signed with a key of '
+                     'the keyset with keystonemiddleware, rather than '
+                     'rejecting them.'),
+    cfg.BoolOpt('profiling_enabled', default=False,
+                help='Profile sampled requests, and requests asking for it '
+                     'made by holders of profiling_role.'),
+    cfg.StrOpt('profiling_role', default=None,
+               help='Configured role allowed to request profiles, and to '
+                    'retrieve them from profiling_endpoint.'),
+    cfg.FloatOpt('profiling_sample_rate', default=0.0, min=0, max=1,
+                 help='Fraction of all requests which are profiled.'),
+    cfg.StrOpt('profiling_header', default='X-Flask-Keystone-Profile',
+               help='Header with which a request asks to be profiled.'),
+    cfg.IntOpt('profiling_buffer_size', default=50, min=1,
+               help='Profiles kept in memory by each process.'),
+    cfg.StrOpt('profiling_endpoint', default='/_flask_keystone/profiles',
+               help='Path at which profiles are listed and retrieved.'),
+    cfg.BoolOpt('propagation_enabled', default=False,
+                help='Provide FlaskKeystone.client, making requests to other '
+                     'services with the token of the current user.'),
+    cfg.IntOpt('propagation_pool_size', default=10, min=1,
+               help='Connections to each downstream host kept open.'),
+    cfg.BoolOpt('propagation_pool_block', default=False,
+                help='Wait for a free pooled connection rather than opening '
+                     'an extra one when the pool is saturated.'),
+    cfg.FloatOpt('propagation_timeout', default=10.0, min=0,
+                 help='Seconds before a request to a downstream service '
+                      'times out.'),
+    cfg.BoolOpt('propagation_service_token', default=False,
+                help='Send a token of the service itself as '
+                     'X-Service-Token, obtained with the keystone_authtoken '
+                     'credentials.'),
+    cfg.StrOpt('propagation_signing_key', default=None, secret=True,
+               help='Key shared with downstream services in trusted-header '
+                    'mode, with which the identity headers of the current '
+                    'user are forwarded signed.')
 ]
@@ -26,7 +26,12 @@ automatically handled and transformed to appear as follows to the client:
    }
 """
 
-from flask import jsonify
+from flask import current_app, jsonify
+
+
+_MAX_CACHED_BODIES = 256
+
+_bodies = {}
 
 
 def handle_exception(error):
@@ -39,10 +44,27 @@ def handle_exception(error):
 
     This function is automatically added to the wrapped :class`flask.Flask`
     when the extension is initialized.
+
+    The serialized body of exceptions without a payload is cached, as the
+    same few errors are returned over and over again.
     """
-    response = jsonify(error.to_dict())
-    response.status_code = error.status_code
-    return response
+    if error.payload:
+        response = jsonify(error.to_dict())
+        response.status_code = error.status_code
+        return response
+
+    key = (error.status_code, error.title, error.message)
+    cached = _bodies.get(key)
+    if cached is None:
+        response = jsonify(error.to_dict())
+        if len(_bodies) < _MAX_CACHED_BODIES:
+            _bodies[key] = (response.get_data(), response.mimetype)
+        response.status_code = error.status_code
+        return response
+
+    body, mimetype = cached
+    return current_app.response_class(body, status=error.status_code,
+                                      mimetype=mimetype)
 
 
 class FlaskKeystoneException(Exception):
@@ -154,3 +176,61 @@ class FlaskKeystoneForbidden(FlaskKeystoneException):
             title="Forbidden",
             message=message
         )
+
+
+class FlaskKeystoneTooManyRequests(FlaskKeystoneException):
+    """
+    The authenticated identity has exceeded its request quota.
+
+    This exception will be thrown when per-identity rate limiting is enabled
+    and the bucket for the current user (or project) is empty.
+
+    This exception will be caught by :func:`handle_exceptions` and therefore
+    generate the following client response:
+
+    .. code-block:: json
+
+       {
+         "code": 429,
+         "message": "Too many requests have been made, please retry later.",
+         "title": "Too Many Requests"
+       }
+    """
+    status_code = 429
+
+    def __init__(self):
+        message = "Too many requests have been made, please retry later."
+        FlaskKeystoneException.__init__(
+            self,
+            title="Too Many Requests",
+            message=message
+        )
+
+
+class FlaskKeystoneServiceUnavailable(FlaskKeystoneException):
+    """
+    The identity service cannot currently validate the request's token.
+
+    This exception is represented by the response returned while the
+    circuit breaker around token validation is open, to requests carrying a
+    token which has not been validated before. As it is returned by the
+    middleware, before the request reaches :mod:`flask`, the response is
+    serialized once rather than by :func:`handle_exceptions`:
+
+    .. code-block:: json
+
+       {
+         "code": 503,
+         "message": "The identity service is temporarily unavailable.",
+         "title": "Service Unavailable"
+       }
+    """
+    status_code = 503
+
+    def __init__(self):
+        message = "The identity service is temporarily unavailable."
+        FlaskKeystoneException.__init__(
+            self,
+            title="Service Unavailable",
+            message=message
+        )
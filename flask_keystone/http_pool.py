@@ -0,0 +1,233 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pooled, keep-alive HTTP connections to the identity service.
+
+When `keystone_pool_enabled` is set, every call :mod:`keystonemiddleware`
+makes to Keystone in a process goes through a single :class:`HTTPPool`,
+whose connections are kept open between calls, so that TLS handshakes are
+only paid when the pool grows:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   keystone_pool_enabled = True
+   keystone_pool_size = 20
+   keystone_pool_block = False
+   keystone_keepalive = True
+   keystone_timeout = 5
+   keystone_retries = 2
+   keystone_retry_budget = 1
+
+- `keystone_pool_size` connections are kept open per Keystone host. Set it
+  to at least the number of requests a worker validates concurrently; when
+  more are made at once, extra connections are opened and discarded
+  (or, with `keystone_pool_block`, requests wait for a free connection).
+- `keystone_retries` failed connections are retried within the pool, but
+  only while the process-wide `keystone_retry_budget` (retries per second)
+  allows it, so that retries cannot multiply the load of a struggling
+  Keystone. These retries are made before, and in addition to, those of
+  keystonemiddleware's own `http_request_max_retries`.
+
+The pool is replaced in a process which has forked since it was used, so
+that workers of a pre-fork server never share connections.
+
+:func:`HTTPPool.stats` reports how many requests were made, how many found
+the pool saturated, and how many connections were opened.
+"""
+
+import os
+import socket
+import threading
+import time
+
+import requests
+
+from keystoneauth1 import session as ksa_session
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from flask_keystone.ratelimit import TokenBucket
+
+
+class RetryBudget(object):
+    """
+    Process-wide allowance of retries per second.
+
+    :param float rate: Retries allowed per second. A burst of up to one
+                       second's worth (and at least one) is allowed, unless
+                       the rate is 0, in which case no retry is.
+    """
+
+    def __init__(self, rate):
+        capacity = max(1.0, rate) if rate > 0 else 0.0
+        self._bucket = TokenBucket(rate, capacity, time.monotonic())
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def spend(self):
+        """
+        Take a retry from the budget.
+
+        :returns: Whether or not a retry is allowed.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._bucket.consume(time.monotonic()):
+                return True
+            self.exhausted += 1
+            return False
+
+
+class BudgetedRetry(Retry):
+    """
+    :class:`urllib3.util.retry.Retry` which only retries within a budget.
+
+    :param budget: The budget retries are taken from.
+    :type budget: :class:`RetryBudget`
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.budget = kwargs.pop("budget", None)
+        super(BudgetedRetry, self).__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        retry = super(BudgetedRetry, self).new(**kwargs)
+        retry.budget = self.budget
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None,
+                  _pool=None, _stacktrace=None):
+        retry = super(BudgetedRetry, self).increment(
+            method=method, url=url, response=response, error=error,
+            _pool=_pool, _stacktrace=_stacktrace
+        )
+        if self.budget is not None and not self.budget.spend():
+            raise MaxRetryError(_pool, url, error)
+        return retry
+
+
+class PooledAdapter(ksa_session.TCPKeepAliveAdapter):
+    """
+    HTTP adapter recording the use of its pool, and reset after a fork.
+
+    :param pool: The pool owning this adapter.
+    :type pool: :class:`HTTPPool`
+    :param bool keepalive: Whether TCP keep-alive is enabled on connections.
+    """
+
+    def __init__(self, pool, keepalive=True, **kwargs):
+        self.pool = pool
+        self.keepalive = keepalive
+        self._pid = os.getpid()
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if not self.keepalive:
+            kwargs.setdefault("socket_options", [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            ])
+        super(PooledAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if self._pid != os.getpid():
+            # NOTE: connections opened by the parent process are still open
+            # in the parent, so are forgotten rather than reused.
+            self.poolmanager.clear()
+            self._pid = os.getpid()
+        self.pool._acquire()
+        try:
+            return super(PooledAdapter, self).send(request, **kwargs)
+        finally:
+            self.pool._release()
+
+    def connections_opened(self):
+        """Count the connections opened by every host pool of the adapter."""
+        pools = self.poolmanager.pools
+        return sum(getattr(pools.get(key), "num_connections", 0)
+                   for key in pools.keys())
+
+
+class HTTPPool(object):
+    """
+    A :class:`requests.Session` with a bounded, keep-alive connection pool.
+
+    :param int pool_size: Connections kept open per host. (default: 10)
+    :param bool block: Wait for a free connection rather than opening an
+                       extra one when the pool is saturated.
+                       (default: False)
+    :param bool keepalive: Enable TCP keep-alive on connections.
+                           (default: True)
+    :param int retries: Retries of failed connections. (default: 0)
+    :param float retry_budget: Retries allowed per second across the
+                               process. (default: 1.0)
+    """
+
+    def __init__(self, pool_size=10, block=False, keepalive=True, retries=0,
+                 retry_budget=1.0):
+        self.pool_size = pool_size
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+        self._lock = threading.Lock()
+        self.budget = RetryBudget(retry_budget)
+        self.adapter = PooledAdapter(
+            self,
+            keepalive=keepalive,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            pool_block=block,
+            max_retries=BudgetedRetry(total=retries, read=False, status=0,
+                                      redirect=False, budget=self.budget)
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def _acquire(self):
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= self.pool_size:
+                self.saturated += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        """
+        Report the use of the pool.
+
+        :returns: Counters of the pool, as follows:
+
+                  - `requests`: requests made through the pool.
+                  - `in_flight`: requests currently being made.
+                  - `peak_in_flight`: most requests made at once.
+                  - `saturated`: requests made while every pooled
+                    connection was already in use.
+                  - `connections`: connections opened.
+                  - `retry_budget_exhausted`: retries denied by the budget.
+        :rtype: dict
+        """
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "saturated": self.saturated,
+            "connections": self.adapter.connections_opened(),
+            "retry_budget_exhausted": self.budget.exhausted,
+        }
@@ -0,0 +1,176 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sampling and rate-capped logging for repetitive auth failures.
+
+A single misbehaving client can produce the same "Couldn't authenticate
+user" or "Rejected User ... due to RBAC" line thousands of times a second.
+:class:`SampledLogger` sits in front of a logger and, for each message key
+(typically the reason, user id and path of a rejection):
+
+- keeps only a `log_sample_rate` fraction of messages, and
+- emits at most `log_rate_limit` messages per `log_rate_interval` seconds.
+
+Suppressed messages are never formatted. Instead, once a key's interval has
+elapsed, a single summary line reports how many messages were suppressed:
+
+.. code-block:: text
+
+   Suppressed 1843 'rbac' messages for user 'auser' on '/admin' in the
+   last 60 seconds.
+
+Summaries are written by the next message logged, or by :func:`sweep`,
+which :class:`flask_keystone.FlaskKeystone` calls at the end of every
+request, so that the count of a burst isn't lost once it stops. The
+windows still open when the process exits are flushed then.
+"""
+
+import random
+import threading
+import time
+
+from collections import OrderedDict
+
+from oslo_log import log as logging
+
+
+class SampledLogger(object):
+    """
+    Logger wrapper applying sampling and per-key rate caps.
+
+    :param logger: The logger messages are written to.
+    :param float sample_rate: Fraction of messages kept, between 0 and 1.
+                              (default: 1.0)
+    :param int rate_limit: Messages emitted per key and interval, or 0 for
+                           no limit. (default: 0)
+    :param float interval: Length of a rate limiting window in seconds.
+                           (default: 60)
+    :param int max_keys: Maximum number of keys tracked at once.
+                         (default: 10000)
+
+    Keys are tuples of `(reason, user_id, path)`. When more than `max_keys`
+    keys are active, the oldest window is closed early.
+    """
+
+    def __init__(self, logger, sample_rate=1.0, rate_limit=0, interval=60.0,
+                 max_keys=10000):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def debug(self, key, msg, *args):
+        """Log a message at DEBUG level under the given key."""
+        self.log(logging.DEBUG, key, msg, *args)
+
+    def info(self, key, msg, *args):
+        """Log a message at INFO level under the given key."""
+        self.log(logging.INFO, key, msg, *args)
+
+    def warning(self, key, msg, *args):
+        """Log a message at WARNING level under the given key."""
+        self.log(logging.WARNING, key, msg, *args)
+
+    def log(self, level, key, msg, *args):
+        """
+        Log a message unless it is sampled out or over its key's cap.
+
+        :param int level: The logging level of the message.
+        :param tuple key: `(reason, user_id, path)` identifying the message.
+        :param str msg: The message, formatted with `args` only if emitted.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.sample_rate >= 1.0 and not self.rate_limit:
+            self.logger.log(level, msg, *args)
+            return
+
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None:
+                    expired.append((key, self._windows.pop(key)))
+                elif len(self._windows) >= self.max_keys:
+                    expired.append(self._windows.popitem(last=False))
+                window = self._windows[key] = [now, 0, 0, level]
+
+            limited = self.rate_limit and window[1] >= self.rate_limit
+            if not sampled or limited:
+                window[2] += 1
+                emit = False
+            else:
+                window[1] += 1
+                emit = True
+
+            if now - self._last_sweep >= self.interval:
+                expired.extend(self._sweep(now, key))
+
+        for expired_key, expired_window in expired:
+            self._summarize(expired_key, expired_window)
+        if emit:
+            self.logger.log(level, msg, *args)
+
+    def sweep(self):
+        """
+        Emit summaries for every window whose interval has elapsed.
+
+        This is cheap to call often: windows are only inspected once per
+        interval.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < self.interval:
+            return
+        with self._lock:
+            expired = self._sweep(now, None)
+        for key, window in expired:
+            self._summarize(key, window)
+
+    def flush(self):
+        """Close every window, emitting summaries for suppressed messages."""
+        with self._lock:
+            expired = list(self._windows.items())
+            self._windows.clear()
+        for key, window in expired:
+            self._summarize(key, window)
+
+    def _sweep(self, now, current_key):
+        """
+        Remove every expired window, other than the current key's.
+
+        Must be called with the lock held.
+        """
+        self._last_sweep = now
+        expired = [(key, window) for key, window in self._windows.items()
+                   if key != current_key and now - window[0] >= self.interval]
+        for key, _ in expired:
+            del self._windows[key]
+        return expired
+
+    def _summarize(self, key, window):
+        """Emit a summary line for a closed window, if it suppressed any."""
+        start, _, suppressed, level = window
+        if not suppressed:
+            return
+        reason, user_id, path = key
+        msg = ("Suppressed %d '%s' messages for user '%s' on '%s' in the "
+               "last %d seconds.")
+        self.logger.log(level, msg, suppressed, reason, user_id, path,
+                        time.monotonic() - start)
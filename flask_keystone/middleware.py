@@ -0,0 +1,261 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Extensions to the :mod:`keystonemiddleware` token validation path.
+
+By default the extension wraps the application in a plain
+:class:`keystonemiddleware.auth_token.AuthProtocol`. Features changing how
+tokens are validated, such as background token refresh or connection
+pooling, instead wrap it in a subclass generated by
+:func:`make_auth_protocol`, which overrides the :func:`fetch_token` and
+:func:`_create_session` hooks of the middleware.
+"""
+
+import json
+import time
+
+import webob.exc
+
+from keystoneauth1 import exceptions as ksa_exceptions
+from keystonemiddleware.auth_token import _exceptions as ksm_exceptions
+from oslo_log import log as logging
+
+from flask_keystone.exceptions import FlaskKeystoneServiceUnavailable
+
+
+LOG = logging.getLogger(__name__)
+
+#: Errors raised by keystoneauth and keystonemiddleware when Keystone
+#: could not be reached, as opposed to having rejected a token.
+UNAVAILABLE_ERRORS = (ksa_exceptions.ConnectFailure,
+                      ksa_exceptions.DiscoveryFailure,
+                      ksa_exceptions.RequestTimeout,
+                      ksm_exceptions.ServiceError)
+
+_UNAVAILABLE_BODY = json.dumps(
+    FlaskKeystoneServiceUnavailable().to_dict()).encode("utf-8")
+
+
+def keystone_unavailable(error):
+    """
+    Whether a validation error means Keystone could not be reached.
+
+    :param Exception error: Error raised by keystonemiddleware's
+                            `fetch_token`.
+    :rtype: bool
+
+    With `delay_auth_decision`, keystonemiddleware reports an unreachable
+    Keystone as an invalid token, only distinguished by its message.
+    """
+    if isinstance(error, (webob.exc.HTTPServiceUnavailable,
+                          UNAVAILABLE_ERRORS)):
+        return True
+    if isinstance(error, ksm_exceptions.InvalidToken):
+        return str(error).startswith("Keystone unavailable")
+    return False
+
+
+def make_auth_protocol(base):
+    """
+    Generate a subclass of :mod:`keystonemiddleware`'s AuthProtocol.
+
+    :param base: The AuthProtocol class to extend.
+    :returns: A subclass of `base`, with `token_cache`, `refresher`,
+              `breaker`, `revocations`, `http_pool`, `http_timeout` and
+              `identity` attributes, all None until configured.
+    :rtype: class
+
+    The class is generated when the extension is initialized, rather than
+    defined at import, so that the AuthProtocol in use at that time is the
+    one extended.
+    """
+    class AuthProtocol(base):
+        """
+        keystonemiddleware's AuthProtocol, with validated tokens cached.
+
+        :param app: The WSGI application to wrap.
+        :param dict conf: keystonemiddleware configuration overrides.
+
+        Note: This class is dynamically generated by
+        :func:`flask_keystone.middleware.make_auth_protocol`.
+        """
+        #: :class:`flask_keystone.token_cache.TokenCache` of validated tokens.
+        token_cache = None
+        #: :class:`flask_keystone.token_cache.TokenRefresher` refreshing them.
+        refresher = None
+        #: :class:`flask_keystone.circuit.CircuitBreaker` guarding Keystone.
+        breaker = None
+        #: Status returned for unknown tokens while the circuit is open.
+        reject_status = 503
+        #: :class:`flask_keystone.revocation.RevocationPoller` of events.
+        revocations = None
+        #: :class:`flask_keystone.http_pool.HTTPPool` connecting to Keystone.
+        #: Must be set on the class, as the session is created by __init__.
+        http_pool = None
+        #: Seconds before a request to Keystone times out.
+        http_timeout = None
+        #: :class:`keystoneauth1.adapter.Adapter` of Keystone, with which
+        #: tokens are refreshed.
+        identity = None
+
+        def _create_session(self, **kwargs):
+            """
+            Create the keystoneauth session used to reach Keystone.
+
+            :returns: The session, over the pooled connections if a pool is
+                      configured.
+            :rtype: :class:`keystoneauth1.session.Session`
+            """
+            if self.http_pool is not None:
+                kwargs.setdefault('session', self.http_pool.session)
+            if self.http_timeout is not None:
+                kwargs.setdefault('timeout', self.http_timeout)
+            return super(AuthProtocol, self)._create_session(**kwargs)
+
+        def fetch_token(self, token, allow_expired=False, **kwargs):
+            """
+            Retrieve the data of a token, from the cache if possible.
+
+            :param str token: The token id.
+            :param bool allow_expired: Whether expired tokens are accepted,
+                                       in which case the cache is bypassed.
+            :raises: InvalidToken if the token is rejected.
+            :returns: The token data.
+            :rtype: dict
+
+            Tokens served from the cache and due to be refreshed are handed
+            to the refresher, without waiting for the refresh to complete.
+            If Keystone cannot be reached, or the circuit breaker is open,
+            expired entries are served for as long as their stale grace
+            period lasts. Tokens revoked by a known revocation event are
+            rejected, even if keystonemiddleware's own cache accepts them.
+            """
+            cache = self.token_cache
+            revocations = self.revocations
+            if revocations is not None:
+                revocations.start()
+            if cache is None or allow_expired:
+                return self._validate(token, allow_expired=allow_expired,
+                                      **kwargs)
+
+            entry = cache.get(token)
+            if entry is not None:
+                refresher = self.refresher
+                if refresher is not None and entry.refresh_due(
+                        time.monotonic()):
+                    refresher.schedule(token)
+                return entry.data
+
+            try:
+                data = self._validate(token, **kwargs)
+            except Exception as e:
+                if self.breaker is None or not keystone_unavailable(e):
+                    raise
+                entry = cache.get(token, stale=True)
+                if entry is None:
+                    raise
+                self.breaker.served_stale += 1
+                return entry.data
+            entry = cache.set(token, data)
+            if revocations is not None and revocations.is_revoked(
+                    entry.access):
+                cache.invalidate(token)
+                raise ksm_exceptions.InvalidToken("Token has been revoked.")
+            return data
+
+        def _validate(self, token, **kwargs):
+            """
+            Validate a token through keystonemiddleware, behind the breaker.
+
+            :param str token: The token id.
+            :raises: InvalidToken if the token is rejected,
+                     HTTPServiceUnavailable if the circuit is open.
+            :returns: The token data.
+            :rtype: dict
+            """
+            breaker = self.breaker
+            if breaker is None:
+                return super(AuthProtocol, self).fetch_token(token, **kwargs)
+            if not breaker.allow():
+                self._reject()
+            try:
+                data = super(AuthProtocol, self).fetch_token(token, **kwargs)
+            except Exception as e:
+                if keystone_unavailable(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            breaker.record_success()
+            return data
+
+        def _reject(self):
+            """
+            Fail a validation at once, as the circuit is open.
+
+            :raises: InvalidToken if `reject_status` is 401, otherwise
+                     HTTPServiceUnavailable with a pre-serialized body.
+            """
+            if self.reject_status == 401:
+                raise ksm_exceptions.InvalidToken(
+                    "Keystone unavailable: the circuit is open")
+            raise webob.exc.HTTPServiceUnavailable(
+                body=_UNAVAILABLE_BODY,
+                content_type="application/json",
+                charset=None,
+                headers=[("Retry-After",
+                          "%d" % max(1, self.breaker.reset_timeout))]
+            )
+
+        def refresh_token(self, token):
+            """
+            Revalidate a token with Keystone, bypassing every cache.
+
+            :param str token: The token id.
+            :raises: InvalidToken if the token is no longer valid.
+
+            The token is revalidated through :attr:`identity`, and this
+            class's cache updated on success. A token Keystone rejects is
+            removed from it, so that the next request carrying it is
+            validated synchronously. While the circuit breaker is open, no
+            refresh is attempted.
+            """
+            breaker = self.breaker
+            if breaker is not None and not breaker.allow():
+                raise ksm_exceptions.ServiceError("The circuit is open.")
+            try:
+                data = self.identity.get(
+                    "/auth/tokens",
+                    headers={"X-Subject-Token": token},
+                    endpoint_filter={"version": (3, 0)},
+                    authenticated=True
+                ).json()
+            except UNAVAILABLE_ERRORS:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            except ksa_exceptions.NotFound:
+                if breaker is not None:
+                    breaker.record_success()
+                self.token_cache.invalidate(token)
+                raise ksm_exceptions.InvalidToken("Token is no longer valid.")
+            except Exception:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            if breaker is not None:
+                breaker.record_success()
+            self.token_cache.set(token, data)
+
+    return AuthProtocol
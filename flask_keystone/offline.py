@@ -0,0 +1,486 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline validation of signed (JWS) tokens.
+
+Validating a token with :mod:`keystonemiddleware` takes a request to
+Keystone, or at best a memcached lookup. Where the tokens presented to the
+service are JSON Web Signatures issued by a trusted token service, they can
+instead be verified in the worker, against keys read from a local keyset
+file, and the identity headers consumed by :class:`flask_keystone.UserBase`
+built straight from their claims:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   offline_validation_enabled = True
+   offline_keyset_file = /etc/service/keyset.json
+   offline_issuer = https://tokens.example.com
+   offline_audience = service
+
+The keyset file is a JSON Web Key Set. Symmetric (`oct`) keys, for the
+HS256, HS384 and HS512 algorithms, are always supported; RSA, EC and OKP
+keys (RS*, PS*, ES* and EdDSA) only when the :mod:`cryptography` package is
+installed:
+
+.. code-block:: json
+
+   {"keys": [{"kid": "2024-06", "kty": "oct", "k": "c2VjcmV0..."}]}
+
+The file is checked for changes at most every `offline_keyset_check_interval`
+seconds, and reloaded when it changes, so that keys may be rotated by
+replacing it. A file which cannot be loaded leaves the previous keys in use.
+
+Tokens must carry an `exp` claim, and their `nbf`, `iss` and `aud` claims
+are checked when present or configured. Identity headers are built from the
+following claims::
+
+    sub                    X-User-Id
+    user_name              X-User-Name
+    user_domain_id         X-User-Domain-Id
+    user_domain_name       X-User-Domain-Name
+    project_id             X-Project-Id
+    project_name           X-Project-Name
+    project_domain_id      X-Project-Domain-Id
+    project_domain_name    X-Project-Domain-Name
+    domain_id              X-Domain-Id
+    domain_name            X-Domain-Name
+    roles                  X-Roles (a list of role names)
+    is_admin_project       X-Is-Admin-Project
+
+Tokens which are not JWS, or are signed with a key which is not in the
+keyset, are handed to :mod:`keystonemiddleware` unless `offline_fallback`
+is disabled. Fernet tokens can't be validated offline: they do not carry
+the user's roles.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import math
+import os
+import threading
+import time
+
+from oslo_log import log as logging
+
+from flask_keystone.trusted import IDENTITY_HEADERS
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+        Ed25519PublicKey)
+    from cryptography.hazmat.primitives.asymmetric.utils import (
+        encode_dss_signature)
+except ImportError:  # pragma: no cover
+    hashes = None
+
+
+LOG = logging.getLogger(__name__)
+
+#: Identity headers, by the claim they are built from.
+CLAIM_HEADERS = (
+    ("sub", "HTTP_X_USER_ID"),
+    ("user_name", "HTTP_X_USER_NAME"),
+    ("user_domain_id", "HTTP_X_USER_DOMAIN_ID"),
+    ("user_domain_name", "HTTP_X_USER_DOMAIN_NAME"),
+    ("project_id", "HTTP_X_PROJECT_ID"),
+    ("project_name", "HTTP_X_PROJECT_NAME"),
+    ("project_domain_id", "HTTP_X_PROJECT_DOMAIN_ID"),
+    ("project_domain_name", "HTTP_X_PROJECT_DOMAIN_NAME"),
+    ("domain_id", "HTTP_X_DOMAIN_ID"),
+    ("domain_name", "HTTP_X_DOMAIN_NAME"),
+)
+
+_IDENTITY_ENVIRON = tuple(
+    "HTTP_" + header.upper().replace("-", "_") for header in IDENTITY_HEADERS
+)
+
+_HMAC_HASHES = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+_CURVES = {
+    "P-256": ("ES256", 32),
+    "P-384": ("ES384", 48),
+    "P-521": ("ES512", 66),
+}
+
+
+class InvalidToken(Exception):
+    """A token which can't be verified, or whose claims are not valid."""
+
+
+class UnknownKey(InvalidToken):
+    """A token signed with a key which is not in the keyset."""
+
+
+def _b64decode(value):
+    if isinstance(value, str):
+        value = value.encode("ascii")
+    return base64.urlsafe_b64decode(value + b"=" * (-len(value) % 4))
+
+
+def _b64int(value):
+    return int.from_bytes(_b64decode(value), "big")
+
+
+class _HMACKey(object):
+    """A symmetric key, verifying HS* signatures."""
+
+    def __init__(self, jwk):
+        self.secret = _b64decode(jwk["k"])
+        self.algorithms = frozenset(_HMAC_HASHES)
+
+    def verify(self, algorithm, message, signature):
+        expected = hmac.new(self.secret, message,
+                            _HMAC_HASHES[algorithm]).digest()
+        return hmac.compare_digest(expected, signature)
+
+
+class _PublicKey(object):
+    """An RSA, EC or OKP public key, verified with :mod:`cryptography`."""
+
+    def __init__(self, jwk):
+        kty = jwk["kty"]
+        if kty == "RSA":
+            self.key = rsa.RSAPublicNumbers(
+                _b64int(jwk["e"]), _b64int(jwk["n"])).public_key()
+            self.algorithms = frozenset(
+                prefix + size for prefix in ("RS", "PS")
+                for size in ("256", "384", "512")
+            )
+        elif kty == "EC":
+            algorithm, self.size = _CURVES[jwk["crv"]]
+            curve = {"ES256": ec.SECP256R1, "ES384": ec.SECP384R1,
+                     "ES512": ec.SECP521R1}[algorithm]()
+            self.key = ec.EllipticCurvePublicNumbers(
+                _b64int(jwk["x"]), _b64int(jwk["y"]), curve).public_key()
+            self.algorithms = frozenset([algorithm])
+        elif kty == "OKP" and jwk.get("crv") == "Ed25519":
+            self.key = Ed25519PublicKey.from_public_bytes(
+                _b64decode(jwk["x"]))
+            self.algorithms = frozenset(["EdDSA"])
+        else:
+            raise ValueError("Unsupported key type '%s'." % kty)
+
+    def verify(self, algorithm, message, signature):
+        try:
+            if algorithm == "EdDSA":
+                self.key.verify(signature, message)
+                return True
+            digest = getattr(hashes, "SHA" + algorithm[2:])()
+            if algorithm.startswith("RS"):
+                self.key.verify(signature, message, padding.PKCS1v15(),
+                                digest)
+            elif algorithm.startswith("PS"):
+                self.key.verify(signature, message, padding.PSS(
+                    mgf=padding.MGF1(digest),
+                    salt_length=digest.digest_size
+                ), digest)
+            else:
+                if len(signature) != 2 * self.size:
+                    return False
+                signature = encode_dss_signature(
+                    int.from_bytes(signature[:self.size], "big"),
+                    int.from_bytes(signature[self.size:], "big"))
+                self.key.verify(signature, message, ec.ECDSA(digest))
+        except InvalidSignature:
+            return False
+        return True
+
+
+def load_keyset(data):
+    """
+    Parse a JSON Web Key Set.
+
+    :param data: The JSON encoded keyset.
+    :type data: str OR bytes
+    :raises: ValueError if the keyset is not valid.
+    :returns: Mapping of key id to key. A single key without a `kid` is
+              stored under None.
+    :rtype: dict
+    """
+    try:
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        jwks = json.loads(data)
+        entries = jwks["keys"]
+    except (TypeError, KeyError, ValueError):
+        raise ValueError("Not a JSON Web Key Set.")
+
+    keys = {}
+    for jwk in entries:
+        if jwk.get("use", "sig") != "sig":
+            continue
+        try:
+            if jwk["kty"] == "oct":
+                key = _HMACKey(jwk)
+            elif hashes is None:
+                LOG.warning("Ignoring %s key '%s': the cryptography package "
+                            "is not installed." % (jwk["kty"],
+                                                   jwk.get("kid")))
+                continue
+            else:
+                key = _PublicKey(jwk)
+        except (KeyError, TypeError, ValueError, binascii.Error) as e:
+            raise ValueError("Invalid key '%s': %s" % (jwk.get("kid"), e))
+        if "alg" in jwk:
+            key.algorithms = key.algorithms & frozenset([jwk["alg"]])
+        keys[jwk.get("kid")] = key
+    return keys
+
+
+class Keyset(object):
+    """
+    Keys loaded from a keyset file, reloaded when the file changes.
+
+    :param str path: Path of the JSON Web Key Set file.
+    :param float check_interval: Minimum number of seconds between checks
+                                 of the file for changes. (default: 5)
+    :raises: ValueError if the file can't be loaded initially.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._stamp = self._stat()
+        self.keys = self._load()
+        self._checked = time.monotonic()
+
+    def get(self, kid):
+        """
+        Look a key up, reloading the keyset first if it changed.
+
+        :param str kid: Id of the key.
+        :returns: The key, or None if it is not in the keyset.
+        """
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.refresh()
+        return self.keys.get(kid)
+
+    def refresh(self):
+        """Reload the keyset file if it changed since it was last loaded."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                stamp = self._stat()
+            except OSError as e:
+                LOG.warning("Can't check keyset file %s: %s" % (self.path, e))
+                return
+            if stamp == self._stamp:
+                return
+            try:
+                self.keys = self._load()
+            except (OSError, ValueError) as e:
+                LOG.error("Keeping the current keys, as keyset file %s "
+                          "can't be loaded: %s" % (self.path, e))
+                return
+            self._stamp = stamp
+            self.reloads += 1
+            LOG.info("Reloaded %d keys from keyset file %s." % (
+                len(self.keys), self.path))
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            return load_keyset(f.read())
+
+
+def _timestamp(value):
+    """Parse a NumericDate claim, rejecting NaN and infinities."""
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("%r is not a finite date." % value)
+    return value
+
+
+def verify_token(token, keyset, issuer=None, audience=None, leeway=0.0,
+                 now=None):
+    """
+    Verify a JWS token and its claims.
+
+    :param str token: The token, in compact serialization.
+    :param keyset: Keys with which tokens may be signed.
+    :type keyset: :class:`Keyset`
+    :param str issuer: Required `iss` claim, if any.
+    :param str audience: Required `aud` claim, if any.
+    :param float leeway: Seconds of clock skew tolerated.
+    :param float now: Unix time at which the token is verified.
+                      (default: now)
+    :raises: :class:`UnknownKey` if the token isn't signed with a known key,
+             :class:`InvalidToken` if it is not otherwise valid.
+    :returns: The token's claims.
+    :rtype: dict
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64).decode("utf-8"))
+        algorithm = header["alg"]
+        signature = _b64decode(signature_b64)
+    except (AttributeError, KeyError, TypeError, ValueError,
+            binascii.Error):
+        raise UnknownKey("Not a JWS token.")
+
+    key = keyset.get(header.get("kid"))
+    if key is None or algorithm not in key.algorithms:
+        raise UnknownKey("Token signed with an unknown key.")
+    try:
+        message = ("%s.%s" % (header_b64, payload_b64)).encode("ascii")
+    except UnicodeEncodeError:
+        raise InvalidToken("Token payload is not base64url encoded.")
+    if not key.verify(algorithm, message, signature):
+        raise InvalidToken("Invalid token signature.")
+
+    try:
+        claims = json.loads(_b64decode(payload_b64).decode("utf-8"))
+        expires = _timestamp(claims["exp"])
+    except (KeyError, TypeError, ValueError, binascii.Error):
+        raise InvalidToken("Token without a valid exp claim.")
+    try:
+        not_before = _timestamp(claims.get("nbf", 0))
+    except (TypeError, ValueError):
+        raise InvalidToken("Token without a valid nbf claim.")
+
+    now = time.time() if now is None else now
+    if now > expires + leeway:
+        raise InvalidToken("Token expired.")
+    if now + leeway < not_before:
+        raise InvalidToken("Token not yet valid.")
+    if issuer and claims.get("iss") != issuer:
+        raise InvalidToken("Token issued by '%s'." % claims.get("iss"))
+    if audience:
+        aud = claims.get("aud")
+        if audience != aud and audience not in (
+                aud if isinstance(aud, list) else ()):
+            raise InvalidToken("Token not intended for this service.")
+    if not claims.get("sub"):
+        raise InvalidToken("Token without a subject.")
+    return claims
+
+
+def identity_environ(claims):
+    """
+    Build the WSGI environ identity headers of verified claims.
+
+    :param dict claims: Claims of a verified token.
+    :raises: :class:`InvalidToken` if its roles are not role names.
+    :rtype: dict
+    """
+    environ = {"HTTP_X_IDENTITY_STATUS": "Confirmed"}
+    for claim, key in CLAIM_HEADERS:
+        value = claims.get(claim)
+        if value is not None:
+            environ[key] = str(value)
+    roles = claims.get("roles")
+    if roles:
+        if isinstance(roles, list) and all(isinstance(role, str)
+                                           for role in roles):
+            roles = ",".join(roles)
+        elif not isinstance(roles, str):
+            raise InvalidToken("Token roles are not a list of names.")
+        environ["HTTP_X_ROLES"] = roles
+    if "is_admin_project" in claims:
+        environ["HTTP_X_IS_ADMIN_PROJECT"] = str(
+            bool(claims["is_admin_project"]))
+    return environ
+
+
+class OfflineTokenMiddleware(object):
+    """
+    WSGI middleware validating JWS tokens locally.
+
+    :param app: The WSGI application to wrap.
+    :param keyset: Keys with which tokens may be signed.
+    :type keyset: :class:`Keyset`
+    :param fallback: WSGI application (normally the application wrapped in
+                     :mod:`keystonemiddleware`) handling requests whose
+                     token is not a JWS signed with a known key, or None to
+                     treat them as invalid.
+    :param str issuer: Required `iss` claim, if any.
+    :param str audience: Required `aud` claim, if any.
+    :param float leeway: Seconds of clock skew tolerated. (default: 0)
+    """
+
+    def __init__(self, app, keyset, fallback=None, issuer=None,
+                 audience=None, leeway=0.0):
+        self.app = app
+        self.keyset = keyset
+        self.fallback = fallback
+        self.issuer = issuer
+        self.audience = audience
+        self.leeway = leeway
+        self.verified = 0
+        self.rejected = 0
+        self.delegated = 0
+
+    def __call__(self, environ, start_response):
+        token = environ.get("HTTP_X_AUTH_TOKEN")
+        if not token:
+            token = environ.get("HTTP_X_STORAGE_TOKEN")
+        if token is None and self.fallback is not None:
+            return self.fallback(environ, start_response)
+
+        identity = None
+        if token is not None:
+            try:
+                claims = verify_token(token, self.keyset,
+                                      issuer=self.issuer,
+                                      audience=self.audience,
+                                      leeway=self.leeway)
+                identity = identity_environ(claims)
+            except UnknownKey:
+                if self.fallback is not None:
+                    self.delegated += 1
+                    return self.fallback(environ, start_response)
+                self.rejected += 1
+            except InvalidToken as e:
+                LOG.info("Rejected token: %s" % e)
+                self.rejected += 1
+
+        for key in _IDENTITY_ENVIRON:
+            environ.pop(key, None)
+        if identity is None:
+            environ["HTTP_X_IDENTITY_STATUS"] = "Invalid"
+        else:
+            self.verified += 1
+            environ.update(identity)
+        return self.app(environ, start_response)
+
+    def stats(self):
+        """
+        Report the tokens validated so far.
+
+        :returns: Counts of tokens `verified` or `rejected` offline, of
+                  tokens `delegated` to the fallback, and of keyset
+                  `reloads`.
+        :rtype: dict
+        """
+        return {
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "delegated": self.delegated,
+            "reloads": self.keyset.reloads,
+        }
@@ -0,0 +1,427 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+OpenStack style policy files for the Flask Keystone Extension.
+
+Rather than mapping keystone roles onto configured roles, access can be
+described with a standard oslo.policy file (JSON or YAML):
+
+.. code-block:: yaml
+
+   "admin": "role:admin or role:cloud_admin"
+   "owner": "project_id:%(project_id)s"
+   "server:list": "rule:admin or rule:owner"
+   "server:delete": "rule:admin or (rule:owner and not role:readonly)"
+
+The following checks are understood, with the same semantics as
+:mod:`oslo_policy`:
+
+- `@` and the empty rule always pass, `!` never does.
+- `rule:<name>` evaluates another rule of the policy.
+- `role:<name>` passes if the user holds the keystone role (case
+  insensitive).
+- `<attribute>:<value>` compares an attribute of the user, such as
+  `user_id` or `project_id`, with the value. Values may reference the target
+  of the check, as in `%(project_id)s`. If the attribute is a literal, such
+  as `True` or `'member'`, it is compared with the value instead.
+- Checks are combined with `and`, `or`, `not` and parentheses. The legacy
+  list syntax (a list of lists of checks) is also accepted.
+
+Every rule is compiled into a predicate once, when the policy is loaded, and
+runs of role checks are folded into a single set intersection. Results are
+cached for the duration of a request, keyed on the rule and target, so
+policies that share sub-rules evaluate each of them only once.
+"""
+
+import ast
+import json
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _always(evaluation):
+    return True
+
+
+def _never(evaluation):
+    return False
+
+
+def _tokenize(source):
+    """
+    Split a rule into parentheses, operators and checks.
+
+    Tokens are separated by whitespace, and only parentheses at the start or
+    end of a token are significant, so that `%(project_id)s` is left intact.
+    """
+    tokens = []
+    for token in source.split():
+        clean = token.lstrip("(")
+        tokens.extend("(" * (len(token) - len(clean)))
+        token = clean.rstrip(")")
+        if token:
+            lowered = token.lower()
+            if lowered in ("and", "or", "not"):
+                tokens.append(lowered)
+            else:
+                tokens.append(("check", token))
+        tokens.extend(")" * (len(clean) - len(token)))
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser producing a tuple based syntax tree.
+
+    Grammar, from lowest to highest precedence::
+
+        expr := and_expr ("or" and_expr)*
+        and_expr := not_expr ("and" not_expr)*
+        not_expr := "not" not_expr | "(" expr ")" | CHECK
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            return ("true",)
+        node = self._or()
+        if self.position != len(self.tokens):
+            self._fail("unexpected %r" % (self.tokens[self.position],))
+        return node
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            self._fail("unexpected end of rule")
+        self.position += 1
+        return token
+
+    def _fail(self, reason):
+        raise ValueError("Invalid policy rule '%s': %s." % (
+            self.source, reason))
+
+    def _or(self):
+        children = [self._and()]
+        while self._peek() == "or":
+            self.position += 1
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def _and(self):
+        children = [self._not()]
+        while self._peek() == "and":
+            self.position += 1
+            children.append(self._not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def _not(self):
+        token = self._next()
+        if token == "not":
+            return ("not", self._not())
+        if token == "(":
+            node = self._or()
+            if self._next() != ")":
+                self._fail("expected ')'")
+            return node
+        if isinstance(token, tuple):
+            return _parse_check(token[1])
+        self._fail("unexpected %r" % (token,))
+
+
+def _parse_check(check):
+    """Parse a single check, such as `role:admin`, into a tree node."""
+    if check == "@":
+        return ("true",)
+    if check == "!":
+        return ("false",)
+    kind, sep, match = check.partition(":")
+    if not sep:
+        raise ValueError("Invalid policy check '%s'." % check)
+    if kind == "rule":
+        return ("rule", match)
+    if kind == "role":
+        return ("role", match)
+    return ("generic", kind, match)
+
+
+def parse_rule(rule):
+    """
+    Parse a policy rule into a syntax tree.
+
+    :param rule: The rule, as a string or in the legacy list syntax.
+    :type rule: str OR list
+    :raises: ValueError if the rule is not valid.
+    :returns: A tuple based syntax tree.
+    """
+    if isinstance(rule, str):
+        return _Parser(rule).parse()
+    if not rule:
+        return ("true",)
+    alternatives = []
+    for checks in rule:
+        if isinstance(checks, str):
+            checks = [checks]
+        nodes = [_parse_check(check) for check in checks]
+        alternatives.append(nodes[0] if len(nodes) == 1 else ("and", nodes))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return ("or", alternatives)
+
+
+def _format(match, target):
+    """Interpolate the target into a check's value, or None on failure."""
+    if "%(" not in match:
+        return match
+    try:
+        return match % target
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _lookup(credentials, kind):
+    """Resolve a dotted attribute of the credentials, or None if missing."""
+    value = credentials
+    for segment in kind.split("."):
+        if not isinstance(value, dict) or segment not in value:
+            return None
+        value = value[segment]
+    return value
+
+
+def _compile_generic(kind, match):
+    try:
+        literal = str(ast.literal_eval(kind))
+    except (ValueError, SyntaxError):
+        literal = None
+
+    if literal is not None:
+        def check(evaluation):
+            return _format(match, evaluation.target) == literal
+        return check
+
+    def check(evaluation):
+        value = _format(match, evaluation.target)
+        if value is None:
+            return False
+        actual = _lookup(evaluation.credentials, kind)
+        if actual is None:
+            return False
+        if isinstance(actual, (list, tuple, set, frozenset)):
+            return value in (str(item) for item in actual)
+        return value == str(actual)
+    return check
+
+
+def _compile_role(match):
+    if "%(" not in match:
+        role = match.lower()
+        return lambda evaluation: role in evaluation.roles
+
+    def check(evaluation):
+        role = _format(match, evaluation.target)
+        return role is not None and role.lower() in evaluation.roles
+    return check
+
+
+def _compile(node):
+    """
+    Compile a syntax tree into a predicate over an evaluation.
+
+    Static role checks under `and`/`or` are folded into a single set, so
+    that "role:a or role:b or role:c" costs one set intersection.
+    """
+    kind = node[0]
+    if kind == "true":
+        return _always
+    if kind == "false":
+        return _never
+    if kind == "rule":
+        name = node[1]
+        return lambda evaluation: evaluation.rule(name)
+    if kind == "role":
+        return _compile_role(node[1])
+    if kind == "generic":
+        return _compile_generic(node[1], node[2])
+    if kind == "not":
+        child = _compile(node[1])
+        return lambda evaluation: not child(evaluation)
+
+    roles = set()
+    others = []
+    for child in node[1]:
+        if child[0] == "role" and "%(" not in child[1]:
+            roles.add(child[1].lower())
+        else:
+            others.append(_compile(child))
+    roles = frozenset(roles)
+
+    if kind == "and":
+        if not roles:
+            return lambda evaluation: all(other(evaluation)
+                                          for other in others)
+
+        def all_of(evaluation):
+            return roles <= evaluation.roles and all(
+                other(evaluation) for other in others)
+        return all_of
+
+    if not roles:
+        return lambda evaluation: any(other(evaluation) for other in others)
+
+    def any_of(evaluation):
+        return not roles.isdisjoint(evaluation.roles) or any(
+            other(evaluation) for other in others)
+    return any_of
+
+
+def compile_rule(name, rule):
+    """
+    Compile a policy rule, denying access if it is not valid.
+
+    :param str name: The name of the rule, used for logging.
+    :param rule: The rule, as a string or in the legacy list syntax.
+    :returns: A function taking an evaluation and returning a bool.
+
+    Consistent with :mod:`oslo_policy`, a rule which cannot be parsed is
+    logged and never passes, rather than preventing the policy from loading.
+    """
+    try:
+        return _compile(parse_rule(rule))
+    except ValueError as e:
+        LOG.error("Failed to compile policy rule '%s': %s" % (name, e))
+        return _never
+
+
+def credentials_for(user):
+    """
+    Build the credentials policy checks are evaluated against.
+
+    :param user: The current user.
+    :type user: :class:`flask_keystone.UserBase`
+    :returns: The user's non-empty string attributes (`user_id`,
+              `project_id` and so on), and its keystone `roles`.
+    :rtype: dict
+    """
+    credentials = dict(
+        (key, value) for key, value in vars(user).items()
+        if value and isinstance(value, str) and not key.startswith("_")
+    )
+    credentials["roles"] = [role for role in user.roles if role]
+    return credentials
+
+
+class _Evaluation(object):
+    """
+    The state of a policy check for one set of credentials and target.
+
+    :param policy: The policy being evaluated.
+    :param dict credentials: As returned by :func:`credentials_for`.
+    :param dict target: The object of the check, such as the view arguments.
+    :param dict results: Cache of results for this credentials and target.
+    """
+
+    __slots__ = ("policy", "credentials", "target", "roles", "results")
+
+    def __init__(self, policy, credentials, target, results):
+        self.policy = policy
+        self.credentials = credentials
+        self.target = target
+        self.roles = frozenset(role.lower()
+                               for role in credentials.get("roles", ()))
+        self.results = results
+
+    def rule(self, name):
+        """Evaluate a named rule, reusing its result if already known."""
+        result = self.results.get(name)
+        if result is None:
+            # NOTE: mark the rule as failed while it is evaluated, so that a
+            # rule referencing itself is denied rather than recursing.
+            self.results[name] = False
+            predicate = self.policy.rules.get(name)
+            result = predicate is not None and predicate(self)
+            self.results[name] = result
+        return result
+
+
+class Policy(object):
+    """
+    A set of compiled policy rules.
+
+    :param dict rules: Mapping of rule name to rule.
+    :param str default_rule: Rule applied when enforcing a rule which is not
+                             defined. (default: "default")
+    """
+
+    def __init__(self, rules, default_rule="default"):
+        self.default_rule = default_rule
+        self.rules = dict(
+            (name, compile_rule(name, rule)) for name, rule in rules.items()
+        )
+
+    @classmethod
+    def from_file(cls, path, default_rule="default"):
+        """
+        Load a policy from a JSON or YAML file.
+
+        :param str path: Path to the policy file.
+        :param str default_rule: As for :class:`Policy`.
+        :rtype: :class:`Policy`
+        """
+        with open(path) as f:
+            data = f.read()
+        if path.endswith(".json"):
+            rules = json.loads(data)
+        else:
+            import yaml
+            rules = yaml.safe_load(data)
+        return cls(rules or {}, default_rule=default_rule)
+
+    def enforce(self, rule, credentials, target=None, cache=None):
+        """
+        Check a rule against a set of credentials.
+
+        :param str rule: Name of the rule to check.
+        :param dict credentials: As returned by :func:`credentials_for`.
+        :param dict target: The object of the check, such as the view
+                            arguments of the request.
+        :param dict cache: Results of earlier checks, as populated by this
+                           method. Only reuse a cache for the same
+                           credentials.
+        :returns: Whether or not the rule passes.
+        :rtype: bool
+        """
+        target = target or {}
+        results = {}
+        if cache is not None:
+            try:
+                key = tuple(sorted(target.items()))
+                results = cache.setdefault(key, {})
+            except TypeError:
+                pass
+
+        if rule not in self.rules:
+            rule = self.default_rule
+        return _Evaluation(self, credentials, target, results).rule(rule)
@@ -0,0 +1,286 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-demand profiling of requests in production.
+
+With `profiling_enabled`, the application (including
+:mod:`keystonemiddleware`, so that token validation is accounted for) is run
+under :mod:`cProfile` for:
+
+- a `profiling_sample_rate` fraction of all requests, and
+- requests carrying the `profiling_header` header, made by a user holding
+  the configured `profiling_role`.
+
+.. code-block:: ini
+
+   [flask_keystone]
+   profiling_enabled = True
+   profiling_role = admin
+   profiling_sample_rate = 0.001
+   profiling_buffer_size = 50
+
+The last `profiling_buffer_size` profiles are kept in memory, and listed
+at `profiling_endpoint` (`/_flask_keystone/profiles` by default), an
+endpoint only holders of `profiling_role` may access:
+
+.. code-block:: bash
+
+   curl -H "X-Auth-Token: $TOKEN" -H "X-Flask-Keystone-Profile: 1" \\
+       https://service/slow/endpoint
+   curl -H "X-Auth-Token: $TOKEN" https://service/_flask_keystone/profiles
+   curl -H "X-Auth-Token: $TOKEN" \\
+       "https://service/_flask_keystone/profiles/3?sort=tottime&limit=40"
+
+Sampled requests are profiled from outside of :mod:`keystonemiddleware`,
+so that token validation is accounted for. Requested profiles start once
+the token has been validated: the header is ignored on requests whose
+`X-Identity-Status` isn't "Confirmed", so that clients without valid
+credentials can't keep the profiler busy, and the profile is discarded
+unless its user turns out to hold `profiling_role`. Only one request is
+profiled at a time in each process; other requests are served normally
+meanwhile.
+"""
+
+import collections
+import cProfile
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+
+
+#: WSGI environ key set on requests whose profile may be kept.
+ALLOWED_KEY = "flask_keystone.profile_allowed"
+
+_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "time")
+
+# NOTE: set on requests already being profiled, so that the application
+# isn't profiled twice.
+_ACTIVE_KEY = "flask_keystone.profiling"
+
+
+class Profile(object):
+    """
+    The profile of a single request.
+
+    :param int profile_id: Sequence number of the profile in its process.
+    :param str trigger: "sampled" or "requested".
+    :param dict environ: WSGI environ of the request.
+    :param profiler: The :class:`cProfile.Profile` which ran the request.
+    :param float duration: Seconds the request took.
+    """
+
+    __slots__ = ("profile_id", "trigger", "method", "path", "user_id",
+                 "status", "timestamp", "duration", "_stats")
+
+    def __init__(self, profile_id, trigger, environ, profiler, duration,
+                 status=None):
+        self.profile_id = profile_id
+        self.trigger = trigger
+        self.method = environ.get("REQUEST_METHOD")
+        self.path = environ.get("PATH_INFO")
+        self.user_id = environ.get("HTTP_X_USER_ID")
+        self.status = status
+        self.timestamp = time.time()
+        self.duration = duration
+        profiler.create_stats()
+        self._stats = profiler.stats
+
+    def to_dict(self):
+        """
+        Summarize the profile.
+
+        :rtype: dict
+        """
+        return {
+            "id": self.profile_id,
+            "trigger": self.trigger,
+            "method": self.method,
+            "path": self.path,
+            "user_id": self.user_id,
+            "status": self.status,
+            "timestamp": self.timestamp,
+            "duration": self.duration,
+        }
+
+    def render(self, sort="cumulative", limit=30):
+        """
+        Format the profile as :mod:`pstats` does.
+
+        :param str sort: Column by which functions are sorted.
+        :param int limit: Number of functions listed.
+        :raises: ValueError if `sort` is not a known column.
+        :rtype: str
+        """
+        if sort not in _SORT_KEYS:
+            raise ValueError("Unknown sort key '%s'." % sort)
+        stream = io.StringIO()
+        stats = pstats.Stats(_Stats(self._stats), stream=stream)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+class _Stats(object):
+    """Stand-in profiler, as accepted by :class:`pstats.Stats`."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class RequestProfiler(object):
+    """
+    Profiles sampled and requested requests into a ring buffer.
+
+    :param float sample_rate: Fraction of requests profiled, between 0 and
+                              1. (default: 0)
+    :param str header: Header requesting a profile of its request.
+                       (default: "X-Flask-Keystone-Profile")
+    :param int capacity: Number of profiles kept. (default: 50)
+    """
+
+    def __init__(self, sample_rate=0.0, header="X-Flask-Keystone-Profile",
+                 capacity=50):
+        self.sample_rate = sample_rate
+        self.header = header
+        self.profiled = 0
+        self.discarded = 0
+        self.busy = 0
+        self._environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self._profiles = collections.deque(maxlen=capacity)
+        self._ids = itertools.count(1)
+        self._active = threading.Lock()
+
+    def wrap(self, wsgi_app):
+        """
+        Wrap a WSGI application so that a sample of its requests is profiled.
+
+        :param wsgi_app: The WSGI application to wrap, including the
+                         validation of tokens.
+        :returns: The wrapped application.
+        """
+        def profiled_app(environ, start_response):
+            if self.sample_rate and random.random() < self.sample_rate:
+                return self._profile(wsgi_app, environ, start_response,
+                                     "sampled")
+            return wsgi_app(environ, start_response)
+
+        return profiled_app
+
+    def wrap_validated(self, wsgi_app):
+        """
+        Wrap a WSGI application so that its requests may ask to be profiled.
+
+        :param wsgi_app: The WSGI application to wrap, which tokens have
+                         been validated for.
+        :returns: The wrapped application.
+        """
+        def profiled_app(environ, start_response):
+            confirmed = environ.get("HTTP_X_IDENTITY_STATUS") == "Confirmed"
+            profiling = _ACTIVE_KEY in environ
+            if confirmed and not profiling and self.requested(environ):
+                return self._profile(wsgi_app, environ, start_response,
+                                     "requested")
+            return wsgi_app(environ, start_response)
+
+        return profiled_app
+
+    def _profile(self, wsgi_app, environ, start_response, trigger):
+        """Run a request under the profiler, keeping its profile if due."""
+        # NOTE: a single profiler may be active at a time, on Python 3.12
+        # and later.
+        if not self._active.acquire(blocking=False):
+            self.busy += 1
+            return wsgi_app(environ, start_response)
+
+        environ[_ACTIVE_KEY] = trigger
+        status = []
+
+        def recording_start_response(value, headers, exc_info=None):
+            status.append(value)
+            return start_response(value, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                body = wsgi_app(environ, recording_start_response)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+        finally:
+            self._active.release()
+
+        if trigger == "requested" and not environ.get(ALLOWED_KEY):
+            self.discarded += 1
+            return body
+
+        self.profiled += 1
+        self._profiles.append(Profile(
+            next(self._ids), trigger, environ, profiler, duration,
+            status=int(status[0].split(" ", 1)[0]) if status else None
+        ))
+        return body
+
+    def requested(self, environ):
+        """
+        Tell whether a request asked to be profiled.
+
+        :param dict environ: WSGI environ of the request.
+        :rtype: bool
+        """
+        return self._environ_key in environ
+
+    def profiles(self):
+        """
+        List the profiles kept, oldest first.
+
+        :rtype: list(:class:`Profile`)
+        """
+        return list(self._profiles)
+
+    def get(self, profile_id):
+        """
+        Look a profile up.
+
+        :param int profile_id: The id of the profile.
+        :returns: The profile, or None if it is not kept anymore.
+        :rtype: :class:`Profile`
+        """
+        for profile in list(self._profiles):
+            if profile.profile_id == profile_id:
+                return profile
+        return None
+
+    def stats(self):
+        """
+        Report the requests profiled so far.
+
+        :returns: Counts of profiles kept (`profiled`), of requested
+                  profiles `discarded` as the user wasn't allowed them, of
+                  requests not profiled as another one was (`busy`), and the
+                  number of profiles currently `buffered`.
+        :rtype: dict
+        """
+        return {
+            "profiled": self.profiled,
+            "discarded": self.discarded,
+            "busy": self.busy,
+            "buffered": len(self._profiles),
+        }
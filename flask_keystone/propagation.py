@@ -0,0 +1,202 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Calls to other services on behalf of the current user.
+
+With `propagation_enabled`, the extension provides an :class:`IdentityClient`
+as `FlaskKeystone.client`, whose requests carry the token of the request
+being served, so that views no longer build their own sessions and copy
+tokens by hand:
+
+.. code-block:: python
+
+   @app.route("/servers/<server_id>/volumes")
+   def list_volumes(server_id):
+       response = keystone.client.get(VOLUMES_URL,
+                                      params={"server": server_id})
+       return response.json()
+
+.. code-block:: ini
+
+   [flask_keystone]
+   propagation_enabled = True
+   propagation_pool_size = 20
+   propagation_timeout = 10
+   propagation_service_token = True
+   propagation_signing_key = a-long-random-secret
+
+Every call in a process goes through a single :class:`HTTPPool` of
+keep-alive connections, replaced after a fork, so that fan-out calls don't
+pay for a new TCP and TLS handshake each.
+
+- `X-Auth-Token` is the token of the request being served, if any.
+- With `propagation_service_token`, `X-Service-Token` is a token of the
+  service itself, obtained with the `keystone_authtoken` credentials of
+  :mod:`keystonemiddleware`, and cached until it expires.
+- With `propagation_signing_key`, the identity headers of the request being
+  served, as validated by this service, are forwarded as well, signed for
+  the method and path of each call as
+  :func:`flask_keystone.trusted.sign_headers` does. A downstream service in
+  trusted-header mode, sharing that key, then takes the caller's identity
+  from them rather than validating the token again. Downstream services
+  validating tokens with :mod:`keystonemiddleware` ignore these headers;
+  giving them the `memcached_servers` and `memcache_secret_key` of this
+  service lets them find the token already validated instead.
+
+The headers are built once per request served, however many calls it
+makes; only their signature is computed for each call. Outside of a
+request, calls carry no identity unless given headers.
+"""
+
+from urllib.parse import unquote, urlsplit
+
+import flask
+
+from flask_keystone.trusted import (IDENTITY_HEADERS, SIGNATURE_HEADER,
+                                    sign_headers)
+
+
+#: WSGI environ key under which the headers of a request's calls are kept.
+HEADERS_KEY = "flask_keystone.propagation.headers"
+
+# NOTE: the service catalog is left out, as it can be larger than the rest
+# of the request, and downstream services have their own.
+_FORWARDED = tuple(
+    ("HTTP_" + header.upper().replace("-", "_"), header)
+    for header in IDENTITY_HEADERS if header != "X-Service-Catalog"
+)
+
+
+class IdentityClient(object):
+    """
+    HTTP client propagating the identity of the request being served.
+
+    :param pool: The pool requests are made through.
+    :type pool: :class:`flask_keystone.http_pool.HTTPPool`
+    :param float timeout: Seconds before a request times out, unless
+                          given. (default: None, never)
+    :param service_token: Callable returning a token of the service, sent
+                          as `X-Service-Token`. (default: None, not sent)
+    :param signing_key: Key shared with downstream services in
+                        trusted-header mode, with which identity headers
+                        are signed. (default: None, not forwarded)
+    :type signing_key: str OR bytes
+    """
+
+    def __init__(self, pool, timeout=None, service_token=None,
+                 signing_key=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.service_token = service_token
+        self.signing_key = signing_key
+        self.forwarded = 0
+        self.signed = 0
+
+    def identity_headers(self, environ=None):
+        """
+        Build the headers propagating the identity of a request.
+
+        :param dict environ: The WSGI environ of the request.
+                             (default: that of the request being served,
+                             if any)
+        :returns: The headers, cached in `environ` for later calls. They
+                  are signed by :func:`request`, for each call.
+        :rtype: dict
+        """
+        if environ is None:
+            if flask.has_request_context():
+                environ = flask.request.environ
+            else:
+                environ = {}
+        headers = environ.get(HEADERS_KEY)
+        if headers is not None:
+            return headers
+
+        headers = {}
+        if self.signing_key is not None:
+            for key, header in _FORWARDED:
+                if key in environ:
+                    headers[header] = environ[key]
+        token = environ.get("HTTP_X_AUTH_TOKEN")
+        if token:
+            headers["X-Auth-Token"] = token
+        if self.service_token is not None:
+            headers["X-Service-Token"] = self.service_token()
+        environ[HEADERS_KEY] = headers
+        return headers
+
+    def request(self, method, url, **kwargs):
+        """
+        Make a request on behalf of the current user.
+
+        :param str method: The HTTP method.
+        :param str url: The URL requested.
+        :param kwargs: Passed to :func:`requests.Session.request`. Headers
+                       given take precedence over the identity headers.
+        :rtype: :class:`requests.Response`
+        """
+        identity = self.identity_headers()
+        headers = dict(identity)
+        if self.signing_key is not None and any(
+                header in identity for _, header in _FORWARDED):
+            path = unquote(urlsplit(url).path) or "/"
+            headers[SIGNATURE_HEADER] = sign_headers(self.signing_key,
+                                                     identity, method, path)
+            self.signed += 1
+        headers.update(kwargs.pop("headers", None) or {})
+        if "X-Auth-Token" in identity:
+            self.forwarded += 1
+        kwargs.setdefault("timeout", self.timeout)
+        return self.pool.session.request(method, url, headers=headers,
+                                         **kwargs)
+
+    def get(self, url, **kwargs):
+        """Make a GET request on behalf of the current user."""
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Make a HEAD request on behalf of the current user."""
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Make a POST request on behalf of the current user."""
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """Make a PUT request on behalf of the current user."""
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        """Make a PATCH request on behalf of the current user."""
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """Make a DELETE request on behalf of the current user."""
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self):
+        """
+        Report the calls made by the client.
+
+        :returns: The counters of its pool (see :func:`HTTPPool.stats`),
+                  and:
+
+                  - `forwarded`: requests carrying the caller's token.
+                  - `signed`: requests carrying signed identity headers.
+        :rtype: dict
+        """
+        stats = self.pool.stats()
+        stats["forwarded"] = self.forwarded
+        stats["signed"] = self.signed
+        return stats
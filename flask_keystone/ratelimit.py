@@ -0,0 +1,160 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process, per-identity rate limiting for the Flask Keystone Extension.
+
+When `rate_limit_enabled` is set, every confirmed request is charged against a
+token bucket keyed on an attribute of the current User (`user_id` or
+`project_id`). Buckets refill at `rate_limit_rate` requests per second up to
+`rate_limit_burst` requests, and users holding a configured role listed in
+`rate_limit_role_quotas` receive that role's rate instead (the burst is scaled
+by the same factor). Buckets are keyed on the quota as well, so that users of
+a project with different quotas don't share a bucket, whose quota would
+otherwise be that of whichever user came first.
+
+.. code-block:: ini
+
+   [flask_keystone]
+   roles = admin_role_1:admin,support_role_1:support
+   rate_limit_enabled = True
+   rate_limit_key = project_id
+   rate_limit_rate = 10
+   rate_limit_burst = 20
+   rate_limit_role_quotas = support:50,admin:100
+
+Buckets are spread over a fixed number of shards, each guarded by its own
+lock, so that concurrent requests for different identities rarely contend.
+Each shard holds a bounded number of buckets and evicts the least recently
+used identity when full.
+
+Note that charging a request requires the User's attributes, so enabling
+rate limiting instantiates the User for every confirmed request.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TokenBucket(object):
+    """
+    A classic token bucket.
+
+    :param float rate: Tokens added per second.
+    :param float capacity: Maximum number of tokens held by the bucket.
+    :param float now: Monotonic timestamp of the bucket's creation.
+
+    Buckets are not thread safe on their own; :class:`RateLimiter` only
+    touches a bucket while holding the lock of the shard that owns it.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now, amount=1):
+        """
+        Refill the bucket, then try to take `amount` tokens from it.
+
+        :param float now: Current monotonic timestamp.
+        :param float amount: Number of tokens required.
+        :returns: Whether or not the tokens were available.
+        :rtype: bool
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+
+class RateLimiter(object):
+    """
+    Sharded collection of per-identity token buckets.
+
+    :param float rate: Default requests per second for an identity.
+    :param int burst: Default number of requests allowed in a burst.
+    :param dict role_quotas: Mapping of configured role to requests per
+                             second. The highest quota held by a user wins.
+    :param str key: User attribute buckets are keyed on, along with the
+                    user's quota. (default: "user_id")
+    :param int shards: Number of independently locked shards. (default: 16)
+    :param int max_keys: Maximum number of buckets kept across all shards.
+                         (default: 65536)
+    """
+
+    def __init__(self, rate, burst, role_quotas=None, key="user_id",
+                 shards=16, max_keys=65536):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.key = key
+        self.role_quotas = sorted(
+            ((float(quota), role)
+             for role, quota in (role_quotas or {}).items()),
+            reverse=True
+        )
+        self._shard_count = shards
+        self._shard_size = max(1, max_keys // shards)
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def _quota_for(self, user):
+        """
+        Resolve the (rate, burst) quota applying to a user.
+
+        Role quotas are held sorted from most to least generous, so the
+        first configured role the user holds is the best one available.
+        """
+        for rate, role in self.role_quotas:
+            if user.has_role(role):
+                if not self.rate:
+                    return rate, self.burst
+                return rate, self.burst * rate / self.rate
+        return self.rate, self.burst
+
+    def allow(self, user):
+        """
+        Charge one request to the bucket of a user.
+
+        :param user: The current user.
+        :type user: :class:`flask_keystone.UserBase`
+        :returns: Whether or not the request is within the user's quota.
+        :rtype: bool
+        """
+        ident = getattr(user, self.key, None)
+        if not ident:
+            return True
+
+        rate, burst = self._quota_for(user)
+        ident = (ident, rate)
+        index = hash(ident) % self._shard_count
+        shard = self._shards[index]
+        now = time.monotonic()
+        with self._locks[index]:
+            bucket = shard.get(ident)
+            if bucket is None:
+                bucket = shard[ident] = TokenBucket(rate, burst, now)
+                if len(shard) > self._shard_size:
+                    shard.popitem(last=False)
+            else:
+                shard.move_to_end(ident)
+            return bucket.consume(now)
@@ -0,0 +1,479 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Invalidation of cached tokens from Keystone revocation events.
+
+Tokens held by the in-process token cache stay valid until their entry
+expires, even if they are revoked in the meantime. With
+`revocation_enabled`, a background thread polls Keystone's revocation
+events (`/v3/OS-REVOKE/events`) every `revocation_poll_interval` seconds,
+and removes every cached token an event revokes:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   revocation_enabled = True
+   revocation_poll_interval = 10
+
+Events are indexed by user, project and audit id, so that each cached token
+is only compared with the events which could revoke it. Tokens which are
+validated while an event is still indexed are checked against it too, which
+covers tokens served from keystonemiddleware's own cache.
+
+Events may also be pushed, with :func:`RevocationPoller.push`, and the
+source of events replaced, for instance by a :class:`LocalRevocationFeed`
+in tests:
+
+.. code-block:: python
+
+   feed = LocalRevocationFeed()
+   key = FlaskKeystone(revocation_feed=feed)
+   key.init_app(app)
+
+   feed.revoke(user_id="a_user_id")
+   key.revocations.poll()
+
+The polling thread is started by the first token validated in each process,
+so that it is safe to initialize the extension before a pre-fork server
+spawns its workers.
+"""
+
+import datetime
+import os
+import threading
+
+from oslo_log import log as logging
+from oslo_utils import timeutils
+
+
+LOG = logging.getLogger(__name__)
+
+#: Event fields which tokens are indexed on.
+INDEXED_FIELDS = ("user_id", "project_id", "audit_id", "audit_chain_id")
+
+_IGNORED_FIELDS = frozenset(["issued_before", "revoked_at", "expires_at",
+                             "links"])
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _parse_time(value):
+    """Parse an ISO 8601 timestamp into an aware datetime, or None."""
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    else:
+        try:
+            parsed = timeutils.parse_isotime(value)
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def _format_time(value):
+    return value.astimezone(datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _token_values(auth_ref, field):
+    """The values of a token an event's field is compared with."""
+    if field == "user_id":
+        return (auth_ref.user_id,)
+    if field == "project_id":
+        return (auth_ref.project_id,)
+    if field == "audit_id":
+        return (auth_ref.audit_id,)
+    if field == "audit_chain_id":
+        return (auth_ref.audit_chain_id or auth_ref.audit_id,)
+    if field == "domain_id":
+        return (auth_ref.user_domain_id, auth_ref.project_domain_id,
+                getattr(auth_ref, "domain_id", None))
+    if field == "role_id":
+        return tuple(auth_ref.role_ids or ())
+    if field == "trust_id":
+        return (getattr(auth_ref, "trust_id", None),)
+    return None
+
+
+class RevocationEvent(object):
+    """
+    A Keystone revocation event.
+
+    :param dict fields: The non-empty identifying fields of the event, such
+                        as `user_id` or `audit_id`.
+    :param issued_before: Only tokens issued at or before this time are
+                          revoked.
+    :type issued_before: :class:`datetime.datetime`
+    :param revoked_at: When the event was recorded.
+    :type revoked_at: :class:`datetime.datetime`
+
+    A token is revoked by an event if it was issued before the event, and
+    matches every identifying field of the event. Fields which cannot be
+    compared with a token, such as `consumer_id`, are assumed to match, so
+    that such events err on the side of revalidating tokens.
+    """
+
+    __slots__ = ("fields", "issued_before", "revoked_at")
+
+    def __init__(self, fields, issued_before=None, revoked_at=None):
+        self.fields = fields
+        self.issued_before = issued_before
+        self.revoked_at = revoked_at or issued_before or _utcnow()
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build an event from its Keystone representation.
+
+        :param dict data: The event, as returned by Keystone.
+        :rtype: :class:`RevocationEvent`
+        """
+        fields = dict((key, value) for key, value in data.items()
+                      if value and key not in _IGNORED_FIELDS)
+        return cls(fields,
+                   issued_before=_parse_time(data.get("issued_before")),
+                   revoked_at=_parse_time(data.get("revoked_at")))
+
+    @property
+    def key(self):
+        """A hashable identity of the event, used to ignore duplicates."""
+        return (tuple(sorted(self.fields.items())), self.issued_before)
+
+    def matches(self, auth_ref):
+        """
+        Whether the event revokes a token.
+
+        :param auth_ref: The token.
+        :type auth_ref: :class:`keystoneauth1.access.AccessInfo`
+        :rtype: bool
+        """
+        if self.issued_before is not None:
+            issued = auth_ref.issued
+            if issued is not None and issued > self.issued_before:
+                return False
+        for field, value in self.fields.items():
+            values = _token_values(auth_ref, field)
+            if values is not None and value not in values:
+                return False
+        return True
+
+
+class RevocationIndex(object):
+    """
+    Revocation events, indexed by the fields tokens are looked up on.
+
+    :param float retention: Seconds after which an event is forgotten.
+                            (default: 3600)
+    """
+
+    def __init__(self, retention=3600.0):
+        self.retention = retention
+        self._keys = set()
+        self._indexes = dict((field, {}) for field in INDEXED_FIELDS)
+        self._unindexed = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, events):
+        """
+        Index events.
+
+        :param events: The events.
+        :type events: list(:class:`RevocationEvent`)
+        :returns: The events which were not already indexed.
+        :rtype: list(:class:`RevocationEvent`)
+        """
+        added = []
+        with self._lock:
+            for event in events:
+                key = event.key
+                if key in self._keys:
+                    continue
+                self._keys.add(key)
+                self._insert(event)
+                added.append(event)
+        return added
+
+    def _insert(self, event):
+        for field in INDEXED_FIELDS:
+            value = event.fields.get(field)
+            if value is not None:
+                self._indexes[field].setdefault(value, []).append(event)
+                return
+        self._unindexed.append(event)
+
+    def _candidates(self, auth_ref):
+        candidates = list(self._unindexed)
+        for field, index in self._indexes.items():
+            if index:
+                for value in _token_values(auth_ref, field):
+                    candidates.extend(index.get(value, ()))
+        return candidates
+
+    def matches(self, auth_ref):
+        """
+        Whether any indexed event revokes a token.
+
+        :param auth_ref: The token, or None if it could not be parsed.
+        :type auth_ref: :class:`keystoneauth1.access.AccessInfo`
+        :rtype: bool
+        """
+        if auth_ref is None or not self._keys:
+            return False
+        with self._lock:
+            candidates = self._candidates(auth_ref)
+        return any(event.matches(auth_ref) for event in candidates)
+
+    def prune(self, now=None):
+        """
+        Forget events older than the retention period.
+
+        :param now: Current time. (default: now)
+        :type now: :class:`datetime.datetime`
+        :returns: The number of events forgotten.
+        :rtype: int
+        """
+        cutoff = (now or _utcnow()) - datetime.timedelta(
+            seconds=self.retention)
+        with self._lock:
+            events = [event for index in self._indexes.values()
+                      for bucket in index.values() for event in bucket]
+            events.extend(self._unindexed)
+            kept = [event for event in events if event.revoked_at >= cutoff]
+            if len(kept) == len(events):
+                return 0
+            self._keys = set(event.key for event in kept)
+            self._indexes = dict((field, {}) for field in INDEXED_FIELDS)
+            self._unindexed = []
+            for event in kept:
+                self._insert(event)
+        return len(events) - len(kept)
+
+
+class KeystoneRevocationFeed(object):
+    """
+    Revocation events read from Keystone's OS-REVOKE API.
+
+    :param adapter: keystoneauth adapter of the identity service,
+                    authenticated with credentials allowed to list
+                    revocation events.
+    :type adapter: :class:`keystoneauth1.adapter.Adapter`
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def events(self, since=None):
+        """
+        List the events recorded since a given time.
+
+        :param since: Only list events recorded after this time.
+        :type since: :class:`datetime.datetime`
+        :returns: The events, as returned by Keystone.
+        :rtype: list(dict)
+        """
+        params = {}
+        if since is not None:
+            params["since"] = _format_time(since)
+        response = self.adapter.get("/OS-REVOKE/events", params=params,
+                                    endpoint_filter={"version": (3, 0)},
+                                    authenticated=True)
+        return response.json().get("events", [])
+
+
+class LocalRevocationFeed(object):
+    """
+    In-memory stand-in for Keystone's revocation events.
+
+    Events are recorded with :func:`revoke`, and listed by
+    :func:`events` as Keystone would.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+
+    def revoke(self, issued_before=None, **fields):
+        """
+        Record a revocation event.
+
+        :param issued_before: Only revoke tokens issued at or before this
+                              time. (default: now)
+        :type issued_before: :class:`datetime.datetime`
+        :param fields: Identifying fields of the event, such as `user_id`,
+                       `project_id` or `audit_id`.
+        :returns: The event, as Keystone would return it.
+        :rtype: dict
+        """
+        now = _utcnow()
+        event = dict(fields)
+        event["issued_before"] = _format_time(issued_before or now)
+        event["revoked_at"] = _format_time(now)
+        with self._lock:
+            self._events.append(event)
+        return event
+
+    def events(self, since=None):
+        """
+        List the events recorded since a given time.
+
+        :param since: Only list events recorded after this time.
+        :type since: :class:`datetime.datetime`
+        :rtype: list(dict)
+        """
+        with self._lock:
+            events = list(self._events)
+        if since is None:
+            return events
+        return [event for event in events
+                if _parse_time(event["revoked_at"]) > since]
+
+
+class RevocationPoller(object):
+    """
+    Background poll of revocation events, invalidating cached tokens.
+
+    :param feed: Source of events, with an `events(since)` method, such as
+                 :class:`KeystoneRevocationFeed`.
+    :param cache: The cache revoked tokens are removed from.
+    :type cache: :class:`flask_keystone.token_cache.TokenCache`
+    :param float interval: Seconds between polls. (default: 10)
+    :param float retention: Seconds events are kept indexed for, which
+                            should cover the lifetime of cached entries.
+                            (default: 3600)
+    """
+
+    def __init__(self, feed, cache, interval=10.0, retention=3600.0):
+        self.feed = feed
+        self.cache = cache
+        self.interval = interval
+        self.index = RevocationIndex(retention=retention)
+        self.polls = 0
+        self.failed = 0
+        self.invalidated = 0
+        self._since = _utcnow() - datetime.timedelta(seconds=retention)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """
+        Start polling in the background, unless already started.
+
+        The thread is replaced if the process has forked since it started.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name="flask-keystone-revocation"
+            )
+            self._thread.daemon = True
+            self._pid = pid
+            self._thread.start()
+
+    def stop(self):
+        """Stop the polling thread, and wait for it to exit."""
+        with self._lock:
+            thread, self._thread, self._pid = self._thread, None, None
+            self._stop.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def poll(self):
+        """
+        Fetch the events recorded since the last poll, and apply them.
+
+        :returns: The number of cached tokens invalidated.
+        :rtype: int
+        """
+        events = [RevocationEvent.from_dict(data)
+                  for data in self.feed.events(self._since)]
+        self.polls += 1
+        if events:
+            self._since = max(self._since,
+                              max(event.revoked_at for event in events))
+        return self.push(events)
+
+    def push(self, events):
+        """
+        Apply revocation events, such as those pushed by a message queue.
+
+        :param events: The events, as :class:`RevocationEvent` or as
+                       returned by Keystone.
+        :type events: list
+        :returns: The number of cached tokens invalidated.
+        :rtype: int
+        """
+        events = [event if isinstance(event, RevocationEvent)
+                  else RevocationEvent.from_dict(event) for event in events]
+        added = self.index.add(events)
+        self.index.prune()
+        if not added:
+            return 0
+        batch = RevocationIndex()
+        batch.add(added)
+        count = self.cache.invalidate_where(
+            lambda entry: batch.matches(entry.access))
+        self.invalidated += count
+        if count:
+            LOG.info("Invalidated %d cached tokens from %d revocation "
+                     "events." % (count, len(added)))
+        return count
+
+    def is_revoked(self, auth_ref):
+        """
+        Whether a known event revokes a token.
+
+        :param auth_ref: The token.
+        :type auth_ref: :class:`keystoneauth1.access.AccessInfo`
+        :rtype: bool
+        """
+        return self.index.matches(auth_ref)
+
+    def stats(self):
+        """
+        Report the activity of the poller.
+
+        :returns: Counts of `polls` made, polls which `failed`, `events`
+                  currently indexed, and cached tokens `invalidated`.
+        :rtype: dict
+        """
+        return {
+            "polls": self.polls,
+            "failed": self.failed,
+            "events": len(self.index),
+            "invalidated": self.invalidated,
+        }
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.failed += 1
+                LOG.warning("Failed to poll revocation events: %s" % e)
@@ -0,0 +1,499 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compiled configured roles and boolean role expressions.
+
+Each configured role is assigned a bit in a :class:`RoleMap`, and each
+keystone role maps to the mask of configured roles it grants. A user's
+keystone roles are then reduced to a single integer mask once per request,
+after which any role check is a bitwise test.
+
+Role expressions combine configured roles with `and`, `or`, `not` and
+parentheses (`&`, `|` and `!` are accepted as well):
+
+.. code-block:: python
+
+   @app.route("/invoices")
+   @key.requires_role("admin or (support and billing)")
+   def invoices():
+       ...
+
+Expressions are parsed when the route is decorated, so syntax errors are
+raised at import time, and are compiled against the RoleMap the first time
+they are evaluated. Unknown configured roles never match, and an expression
+negating one (such as a misspelt "admin and not suspended") never matches
+at all, rather than silently dropping the restriction.
+
+Keystone roles may also be given as glob patterns, such as `rax_managed:*`
+or `ticketing:*:admin`, to grant a configured role to a whole family of
+keystone roles. Patterns which are a plain prefix followed by `*` are
+compiled into a prefix trie, and the others into a single regular
+expression per configured role. As a user's mask is memoized per "X-Roles"
+value, for the most recently seen values, patterns are only matched the
+first time a combination of keystone roles is seen.
+"""
+
+import fnmatch
+import re
+import threading
+
+from collections import OrderedDict
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+_MAX_CACHED_EXPRESSIONS = 1024
+_MAX_CACHED_HEADERS = 1024
+
+_TOKEN_RE = re.compile(r"\s*(?:([()])|(\|\||\||&&|&|!)|([^\s()|&!]+))")
+_EXPRESSION_RE = re.compile(r"[\s()|&!]")
+_PATTERN_RE = re.compile(r"[*?[]")
+_WHITESPACE_RE = re.compile(r"\s")
+_OPERATORS = {
+    "||": "or", "|": "or", "or": "or",
+    "&&": "and", "&": "and", "and": "and",
+    "!": "not", "not": "not",
+}
+
+
+def is_expression(value):
+    """
+    Determine whether a string is a role expression rather than a role.
+
+    :param str value: The string to test.
+    :rtype: bool
+    """
+    return bool(_EXPRESSION_RE.search(value))
+
+
+def is_pattern(value):
+    """
+    Determine whether a keystone role is a glob pattern.
+
+    :param str value: The keystone role to test.
+    :rtype: bool
+    """
+    return bool(_PATTERN_RE.search(value))
+
+
+def parse_roles(value, vocabulary=None):
+    """
+    Parse an "X-Roles" header into a set of keystone roles.
+
+    :param str value: Comma separated keystone roles.
+    :param dict vocabulary: Known keystone role names, each mapped to
+                            itself, whose copy is used in place of the name
+                            parsed from the header.
+    :returns: The roles, stripped of whitespace, without empty or duplicate
+              entries.
+    :rtype: frozenset(str)
+    """
+    names = value.split(",")
+    if _WHITESPACE_RE.search(value):
+        names = [name.strip() for name in names]
+    if vocabulary:
+        get = vocabulary.get
+        names = [get(name, name) for name in names]
+    roles = frozenset(names)
+    if "" in roles:
+        roles = roles.difference(("",))
+    return roles
+
+
+def _tokenize(source):
+    """Split an expression into parentheses, operators and role names."""
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN_RE.match(source, position)
+        paren, operator, name = match.groups()
+        if paren:
+            tokens.append(paren)
+        elif operator:
+            tokens.append(_OPERATORS[operator])
+        else:
+            tokens.append(_OPERATORS.get(name, ("name", name)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser producing a tuple based syntax tree.
+
+    Grammar, from lowest to highest precedence::
+
+        expr := and_expr ("or" and_expr)*
+        and_expr := not_expr ("and" not_expr)*
+        not_expr := "not" not_expr | "(" expr ")" | NAME
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.position = 0
+
+    def parse(self):
+        if not self.tokens:
+            self._fail("empty expression")
+        node = self._or()
+        if self.position != len(self.tokens):
+            self._fail("unexpected %r" % (self.tokens[self.position],))
+        return node
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            self._fail("unexpected end of expression")
+        self.position += 1
+        return token
+
+    def _fail(self, reason):
+        raise ValueError("Invalid role expression '%s': %s." % (
+            self.source, reason))
+
+    def _or(self):
+        children = [self._and()]
+        while self._peek() == "or":
+            self.position += 1
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def _and(self):
+        children = [self._not()]
+        while self._peek() == "and":
+            self.position += 1
+            children.append(self._not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def _not(self):
+        token = self._next()
+        if token == "not":
+            return ("not", self._not())
+        if token == "(":
+            node = self._or()
+            if self._next() != ")":
+                self._fail("expected ')'")
+            return node
+        if isinstance(token, tuple):
+            return token
+        self._fail("unexpected %r" % (token,))
+
+
+def _names(node, negated=False):
+    """
+    Yield the role names referenced by a syntax tree.
+
+    :param bool negated: Only yield the names under a `not`.
+    """
+    if node[0] == "name":
+        if not negated:
+            yield node[1]
+    elif node[0] == "not":
+        for name in _names(node[1]):
+            yield name
+    else:
+        for child in node[1]:
+            for name in _names(child, negated):
+                yield name
+
+
+def _never(mask):
+    return False
+
+
+def _compile(node, bits):
+    """
+    Compile a syntax tree into a predicate over a role mask.
+
+    Runs of plain role names under `and`/`or` are folded into a single
+    mask, so that "a or b or c" costs one bitwise test.
+    """
+    kind = node[0]
+    if kind == "name":
+        bit = bits.get(node[1], 0)
+        if not bit:
+            return _never
+        return lambda mask: mask & bit != 0
+
+    if kind == "not":
+        child = _compile(node[1], bits)
+        return lambda mask: not child(mask)
+
+    combined = 0
+    others = []
+    for child in node[1]:
+        if child[0] == "name":
+            bit = bits.get(child[1], 0)
+            if not bit and kind == "and":
+                return _never
+            combined |= bit
+        else:
+            others.append(_compile(child, bits))
+
+    if kind == "and":
+        if not others:
+            return lambda mask: mask & combined == combined
+
+        def all_of(mask):
+            return mask & combined == combined and all(
+                other(mask) for other in others)
+        return all_of
+
+    if not others:
+        if not combined:
+            return _never
+        return lambda mask: mask & combined != 0
+
+    def any_of(mask):
+        return mask & combined != 0 or any(other(mask) for other in others)
+    return any_of
+
+
+class RoleExpression(object):
+    """
+    A parsed boolean expression over configured roles.
+
+    :param str source: The expression, e.g. "admin or (support and billing)".
+    :raises: ValueError if the expression is not valid.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tree = _Parser(source).parse()
+        self.roles = frozenset(_names(self.tree))
+        self.negated = frozenset(_names(self.tree, negated=True))
+        self._bound = None
+
+    @classmethod
+    def any_of(cls, roles):
+        """
+        Build an expression matching any of several roles or expressions.
+
+        :param roles: Configured roles, or role expressions.
+        :type roles: list(str)
+        :rtype: :class:`RoleExpression`
+        """
+        return cls(" or ".join("(%s)" % role for role in roles))
+
+    def evaluate(self, role_map, mask):
+        """
+        Evaluate this expression against a role mask.
+
+        :param role_map: The role map the mask was computed with.
+        :type role_map: :class:`RoleMap`
+        :param int mask: The mask of configured roles held by a user.
+        :rtype: bool
+        """
+        bound = self._bound
+        if bound is None or bound[0] is not role_map:
+            bound = self._bound = (role_map, role_map.compile_tree(self))
+        return bound[1](mask)
+
+    def __repr__(self):
+        return "RoleExpression(%r)" % self.source
+
+    def __str__(self):
+        return self.source
+
+
+class PatternMatcher(object):
+    """
+    Glob patterns of keystone roles, compiled into a single matcher.
+
+    :param patterns: (pattern, mask) pairs, where mask is the mask of
+                     configured roles granted by keystone roles matching the
+                     pattern.
+
+    Prefix patterns ("prefix*") are stored in a character trie, walked once
+    per keystone role. Other patterns are translated with :mod:`fnmatch`
+    and joined into one regular expression per mask. Matching is case
+    sensitive.
+    """
+
+    def __init__(self, patterns):
+        self.trie = {}
+        globs = {}
+        for pattern, mask in patterns:
+            prefix = pattern[:-1]
+            if pattern.endswith("*") and not is_pattern(prefix):
+                node = self.trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                # NOTE: the empty string is never a character of a role, so
+                # it holds the mask of the pattern ending at this node.
+                node[""] = node.get("", 0) | mask
+            else:
+                globs.setdefault(mask, []).append(fnmatch.translate(pattern))
+        self.regexes = [(re.compile("|".join(translated)).match, mask)
+                        for mask, translated in sorted(globs.items())]
+
+    def mask_for(self, keystone_role):
+        """
+        Compute the mask granted by the patterns a keystone role matches.
+
+        :param str keystone_role: A keystone role name.
+        :rtype: int
+        """
+        node = self.trie
+        mask = node.get("", 0)
+        for char in keystone_role:
+            node = node.get(char)
+            if node is None:
+                break
+            mask |= node.get("", 0)
+        for match, granted in self.regexes:
+            if not mask & granted == granted and match(keystone_role):
+                mask |= granted
+        return mask
+
+
+class RoleMap(object):
+    """
+    Configured roles compiled into bit masks.
+
+    :param dict roles: Mapping of configured role to the keystone roles
+                       (or glob patterns of keystone roles) granting it, as
+                       produced by :func:`FlaskKeystone._parse_roles`.
+    """
+
+    def __init__(self, roles):
+        self.roles = roles
+        self.bits = {}
+        self.keystone_masks = {}
+        patterns = {}
+        for index, flask_role in enumerate(sorted(roles)):
+            bit = 1 << index
+            self.bits[flask_role] = bit
+            for keystone_role in roles[flask_role]:
+                if is_pattern(keystone_role):
+                    patterns[keystone_role] = (
+                        patterns.get(keystone_role, 0) | bit
+                    )
+                else:
+                    self.keystone_masks[keystone_role] = (
+                        self.keystone_masks.get(keystone_role, 0) | bit
+                    )
+        self.patterns = None
+        if patterns:
+            self.patterns = PatternMatcher(sorted(patterns.items()))
+        self.vocabulary = dict((name, name) for name in self.keystone_masks)
+        self._expressions = {}
+        self._headers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mask_for(self, keystone_roles):
+        """
+        Reduce keystone roles to the mask of configured roles they grant.
+
+        :param keystone_roles: Keystone role names held by a user.
+        :rtype: int
+        """
+        mask = 0
+        get = self.keystone_masks.get
+        if self.patterns is None:
+            for keystone_role in keystone_roles:
+                mask |= get(keystone_role, 0)
+            return mask
+        match = self.patterns.mask_for
+        for keystone_role in keystone_roles:
+            mask |= get(keystone_role, 0) | match(keystone_role)
+        return mask
+
+    def lookup(self, value):
+        """
+        Parse an "X-Roles" header, and reduce it to a mask.
+
+        :param str value: Comma separated keystone roles.
+        :returns: The keystone roles, as parsed by :func:`parse_roles`, and
+                  the mask of configured roles they grant.
+        :rtype: tuple(frozenset(str), int)
+
+        Results are memoized for the 1024 most recently used header values,
+        as the same combinations of keystone roles are seen over and over
+        again: the role sets are immutable, so they are shared by every user
+        carrying the header. Configured keystone role names are shared with
+        the role map itself, rather than interned, so that role names sent
+        by clients are only kept alive while a header holding them is
+        memoized.
+        """
+        with self._lock:
+            entry = self._headers.get(value)
+            if entry is not None:
+                self._headers.move_to_end(value)
+                return entry
+        roles = parse_roles(value, self.vocabulary)
+        entry = (roles, self.mask_for(roles))
+        with self._lock:
+            self._headers[value] = entry
+            while len(self._headers) > _MAX_CACHED_HEADERS:
+                self._headers.popitem(last=False)
+        return entry
+
+    def mask_for_header(self, value):
+        """
+        Reduce an "X-Roles" header to the mask of configured roles.
+
+        :param str value: Comma separated keystone roles.
+        :rtype: int
+        """
+        return self.lookup(value)[1]
+
+    def roles_for(self, mask):
+        """
+        Expand a mask into the set of configured roles it holds.
+
+        :param int mask: A mask returned by :func:`mask_for`.
+        :rtype: frozenset(str)
+        """
+        return frozenset(role for role, bit in self.bits.items()
+                         if mask & bit)
+
+    def expression(self, source):
+        """
+        Parse a role expression, reusing previously parsed expressions.
+
+        :param str source: The role expression.
+        :rtype: :class:`RoleExpression`
+        """
+        expression = self._expressions.get(source)
+        if expression is None:
+            expression = RoleExpression(source)
+            if len(self._expressions) < _MAX_CACHED_EXPRESSIONS:
+                self._expressions[source] = expression
+        return expression
+
+    def compile_tree(self, expression):
+        """
+        Compile a parsed expression into a predicate over role masks.
+
+        :param expression: The expression to compile.
+        :type expression: :class:`RoleExpression`
+        :returns: A function taking a mask and returning a bool.
+        """
+        unknown = expression.roles.difference(self.bits)
+        if unknown:
+            msg = "Role expression '%s' references unconfigured roles: %s"
+            LOG.warning(msg % (expression.source, ", ".join(sorted(unknown))))
+            if not expression.negated.isdisjoint(unknown):
+                return _never
+        return _compile(expression.tree, self.bits)
@@ -0,0 +1,202 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact, picklable snapshots of a request's identity.
+
+The User class is generated by :class:`FlaskKeystone` for each application,
+so its instances can't be pickled, and they are tied to the request they
+were created from. To hand an identity over to a background job, such as a
+Celery task or a thread pool job, take a snapshot of it instead:
+
+.. code-block:: python
+
+   @app.route("/reports", methods=["POST"])
+   def create_report():
+       build_report.delay(current_user.snapshot())
+
+   @celery.task
+   def build_report(identity):
+       if identity.is_admin():
+           ...
+
+A snapshot is an immutable tuple of the identity attributes of the user
+(not its tokens, which are kept out of job queues), its keystone roles, the
+configured roles it was granted, and the names of every configured role. It
+pickles into a few hundred bytes, and has the same `has_role`, `is_<role>`,
+`in_project` and `in_domain` methods as the User it was taken from,
+evaluated against the configured roles granted when the snapshot was taken:
+the worker needs neither the request headers nor the extension's
+configuration.
+"""
+
+import collections
+
+from flask_keystone.roles import is_expression, RoleExpression, RoleMap
+
+
+_MAX_CACHED_ROLE_MAPS = 256
+
+#: Identity attributes copied from the User into a snapshot.
+FIELDS = (
+    "identity_status",
+    "user_id", "user_name", "user_domain_id", "user_domain_name",
+    "project_id", "project_name", "project_domain_id", "project_domain_name",
+    "domain_id", "domain_name", "is_admin_project",
+)
+
+_role_maps = {}
+_masks = {}
+
+
+def _role_map(configured, granted):
+    """
+    Build a role map of the configured roles, and the mask of those granted.
+
+    Both are memoized, as the snapshots of a service share the same
+    configured roles, and few combinations of granted roles.
+    """
+    entry = _masks.get((configured, granted))
+    if entry is None:
+        role_map = _role_maps.get(configured)
+        if role_map is None:
+            role_map = RoleMap(dict((role, ()) for role in configured))
+            if len(_role_maps) < _MAX_CACHED_ROLE_MAPS:
+                _role_maps[configured] = role_map
+        mask = 0
+        for role in granted:
+            mask |= role_map.bits.get(role, 0)
+        entry = (role_map, mask)
+        if len(_masks) < _MAX_CACHED_ROLE_MAPS:
+            _masks[(configured, granted)] = entry
+    return entry
+
+
+class IdentitySnapshot(collections.namedtuple(
+        "IdentitySnapshot", FIELDS + ("roles", "granted", "configured"))):
+    """
+    An immutable snapshot of a User, or of the anonymous user.
+
+    Every attribute listed in :data:`FIELDS` is a str or None, `roles` is
+    the frozenset of keystone roles the user held, `granted` the frozenset
+    of configured roles they granted, and `configured` the frozenset of
+    every configured role.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        Take a snapshot of a user.
+
+        :param user: The user, such as :obj:`flask_keystone.current_user`.
+        :type user: :class:`flask_keystone.UserBase` OR
+                    :class:`flask_keystone.AnonymousBase`
+        :rtype: :class:`IdentitySnapshot`
+        """
+        values = dict((field, getattr(user, field, None) or None)
+                      for field in FIELDS)
+        values["project_id"] = values["project_id"] or getattr(
+            user, "tenant_id", None) or None
+        if user.anonymous:
+            granted = frozenset()
+        else:
+            granted = user.role_map.roles_for(user.role_mask)
+        return cls(roles=frozenset(user.roles), granted=granted,
+                   configured=frozenset(user.role_map.bits), **values)
+
+    @property
+    def anonymous(self):
+        """Whether or not the snapshot is of an anonymous user."""
+        return not self.user_id
+
+    @property
+    def project_ids(self):
+        """The project ids the identity was scoped to."""
+        return frozenset(filter(None, (self.project_id,)))
+
+    @property
+    def domain_ids(self):
+        """The domain ids the identity was scoped to."""
+        return frozenset(filter(None, (self.domain_id,)))
+
+    def has_role(self, role):
+        """
+        Determine if the identity was granted a configured role.
+
+        :param role: A configured role, or a role expression.
+        :type role: str OR :class:`flask_keystone.roles.RoleExpression`
+        :returns: Whether or not the identity has the role. Roles which
+                  were not configured are never held.
+        :rtype: bool
+        """
+        if role in self.granted:
+            return True
+        if role in self.configured:
+            return False
+        if isinstance(role, RoleExpression):
+            role = role.source
+        elif not (isinstance(role, str) and is_expression(role)):
+            return False
+        role_map, mask = _role_map(self.configured, self.granted)
+        return role_map.expression(role).evaluate(role_map, mask)
+
+    def _has_keystone_role(self, role):
+        """
+        Determine whether a keystone role was held by the identity.
+
+        :param str role: The keystone role.
+        :rtype: bool
+        """
+        return role in self.roles
+
+    def in_project(self, project_id):
+        """
+        Determine whether the identity was scoped to a project.
+
+        :param str project_id: The project id to test.
+        :rtype: bool
+        """
+        return bool(project_id) and project_id == self.project_id
+
+    def in_domain(self, domain_id):
+        """
+        Determine whether the identity was scoped to a domain.
+
+        :param str domain_id: The domain id to test.
+        :rtype: bool
+        """
+        return domain_id in self.domain_ids
+
+    def __getattr__(self, name):
+        # NOTE: as on the User, there are no is_<role> methods for roles
+        # which are not configured.
+        role = name[3:]
+        if name.startswith("is_") and role in self.configured:
+            return lambda: role in self.granted
+        raise AttributeError(name)
+
+    def __reduce__(self):
+        # NOTE: sets are pickled as sorted tuples, which are smaller.
+        values = tuple(self[:-3]) + (tuple(sorted(self.roles)),
+                                     tuple(sorted(self.granted)),
+                                     tuple(sorted(self.configured)))
+        return (_restore, values)
+
+
+def _restore(*values):
+    """Rebuild a pickled :class:`IdentitySnapshot`."""
+    return IdentitySnapshot(*values[:-3], roles=frozenset(values[-3]),
+                            granted=frozenset(values[-2]),
+                            configured=frozenset(values[-1]))
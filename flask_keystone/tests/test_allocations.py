@@ -0,0 +1,57 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for the allocation profiling harness.
+"""
+
+from unittest import mock
+
+from oslo_config import fixture
+
+from testtools import TestCase
+
+from flask_keystone.benchmarks import allocations
+
+
+class TestAllocations(TestCase):
+
+    def setUp(self):
+        super(TestAllocations, self).setUp()
+        self.useFixture(fixture.Config())
+
+    def test_run(self):
+        results = allocations.run(requests=5, warmup=1)
+        self.assertEqual(sorted(results),
+                         ["anonymous", "confirmed", "rejected"])
+        self.assertIn("UserBase.__init__", results["confirmed"])
+        self.assertIn("before_request", results["anonymous"])
+        self.assertIn("handle_exception", results["rejected"])
+        self.assertNotIn("UserBase.__init__", results["rejected"],
+                         "Rejected requests should never build a User.")
+
+    def test_run_without_reset_peak(self):
+        with mock.patch.object(allocations, "_reset_peak", None):
+            results = allocations.run(requests=5, warmup=1)
+        for peak, retained, _ in results["confirmed"].values():
+            self.assertGreaterEqual(peak, retained)
+
+    def test_check(self):
+        results = {"confirmed": {"before_request": (100.0, 0.0, 0.0)}}
+        self.assertEqual(allocations.check(
+            results, {"before_request": 200}), [])
+        self.assertEqual(allocations.check(
+            results, {"before_request": 50}), [
+            "confirmed: before_request allocated 100 bytes per request "
+            "(limit 50)"
+        ])
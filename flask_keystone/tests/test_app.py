@@ -11,23 +11,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gc
 import json
+import os
+import tempfile
+import threading
+
+import fixtures
 from oslo_config import fixture
 
 from testtools import TestCase
+from unittest import mock, skipIf
 
+from keystoneauth1 import exceptions as ksa_exceptions
 from keystoneauth1 import fixture as ksa_fixture
+from keystoneauth1 import loading as ksa_loading
+from keystonemiddleware import auth_token
 from keystonemiddleware import fixture as ksm_fixture
+from keystonemiddleware.auth_token import _exceptions as ksm_exceptions
 
-from flask import jsonify
+from flask import Flask, jsonify
 
+import flask_keystone
 from flask_keystone import (current_user, FlaskKeystone)
 from flask_keystone.exceptions import (FlaskKeystoneUnauthorized,
                                        FlaskKeystoneForbidden)
+from flask_keystone import trusted
+from flask_keystone.config import RAX_OPTS
+from flask_keystone.revocation import LocalRevocationFeed
 
+from flask_keystone.tests import test_offline
 from flask_keystone.tests.test_fixtures.fake_app import create_app
 
 
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    contextvars = None
+
+
 class TestFlaskKeystone(TestCase):
     """
     TODO(rtrox): Add a docstring here.
@@ -150,6 +172,66 @@ class TestFlaskKeystone(TestCase):
             """
             return "This shouldn't succeed."
 
+        @self.app.route("/requires_admin_and_not_support")
+        @self.key.requires_role("admin and not support")
+        def requires_admin_and_not_support():
+            """
+            Simple test route to test role expressions.
+
+            The token carries "admin" but not "support", so this succeeds.
+            """
+            return str(current_user.is_admin())
+
+        @self.app.route("/requires_support_and_admin")
+        @self.key.requires_role("support and (admin or unconfiguredrole)")
+        def requires_support_and_admin():
+            """
+            Simple test route to test role expressions.
+
+            The token lacks the "support" role, so this should return a 403.
+            """
+            return "This shouldn't succeed."
+
+        @self.app.route("/projects/<project_id>")
+        @self.key.requires_project()
+        def requires_project(project_id):
+            """
+            Simple test route to test project scoped access control.
+
+            Returns the project id when the token is scoped to it.
+            """
+            return project_id
+
+        @self.app.route("/domains/<domain_id>")
+        @self.key.requires_project(domain_arg="domain_id")
+        def requires_domain(domain_id):
+            """
+            Simple test route to test domain scoped access control.
+
+            The token is scoped to a project, so this should return a 403.
+            """
+            return domain_id
+
+        @self.app.route("/admin/projects/<project_id>")
+        @self.key.requires_project(override_role="admin")
+        def requires_project_or_admin(project_id):
+            """
+            Simple test route to test the project scope override role.
+
+            The token carries the "admin" role, so any project is accepted.
+            """
+            return project_id
+
+        @self.app.route("/support/projects/<project_id>")
+        @self.key.requires_project(override_role="support")
+        def requires_project_or_support(project_id):
+            """
+            Simple test route to test the project scope override role.
+
+            The token lacks the "support" role, so only its own project works.
+            """
+            return project_id
+
     def tearDown(self):
         """
         TODO(russ7612): add docstring.
@@ -220,6 +302,102 @@ class TestFlaskKeystone(TestCase):
         self.assertEqual(result.data.decode('utf-8'), "auser",
                          "Did not receive the expected successful response.")
 
+    @skipIf(contextvars is None, "contextvars requires Python 3.7")
+    def test_user_follows_copied_context(self):
+        """
+        Test that the user is visible from copied contexts, and is cleared
+        once the request is over.
+        """
+        @self.app.route("/copied_context")
+        def copied_context():
+            return contextvars.copy_context().run(
+                lambda: current_user.user_id
+            )
+
+        result = self.c.get(
+            "/copied_context",
+            headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.data.decode('utf-8'), "auser")
+        self.assertIsNone(flask_keystone._identity.get(),
+                          "The user should not outlive its request.")
+
+    def test_user_survives_nested_context(self):
+        """
+        Test that a nested request context leaves the user of the outer
+        request in place.
+        """
+        @self.app.route("/nested_context")
+        def nested_context():
+            with self.app.test_request_context("/inner"):
+                pass
+            return current_user.user_id
+
+        result = self.c.get(
+            "/nested_context",
+            headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.data.decode('utf-8'), "auser")
+        self.assertIsNone(flask_keystone._identity.get(),
+                          "The user should not outlive its request.")
+
+    def test_log_summaries_swept_after_request(self):
+        """
+        Test that suppressed message summaries are swept after requests.
+        """
+        with mock.patch.object(self.key.auth_logger, "sweep") as sweep:
+            self.c.get("/user_id", headers={"X-Auth-Token": self.token_id})
+        sweep.assert_called_once_with()
+
+    def test_thread_local_fallback(self):
+        """
+        Test that the stand-in used without contextvars is thread-local.
+        """
+        var = flask_keystone._ThreadLocalVar("test", default=None)
+        token = var.set("main")
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(var.get()))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+        self.assertEqual(var.get(), "main")
+        var.reset(var.set("nested"))
+        self.assertEqual(var.get(), "main")
+        var.reset(token)
+        self.assertIsNone(var.get())
+
+    def test_user_is_lazy(self):
+        """
+        Test that the User is not instantiated for endpoints not using it.
+        """
+        @self.app.route("/no_user")
+        def no_user():
+            return "Success."
+
+        with mock.patch.object(self.key, "User") as user_model:
+            result = self.c.get(
+                "/no_user",
+                headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.status_code, 200, "Bad response code. "
+                                                  "Expected 200, got %s" %
+                                                  result.status_code)
+        user_model.assert_not_called()
+
+    def test_warmup(self):
+        """
+        Test that warmup compiles role expressions and freezes the heap.
+        """
+        self.addCleanup(gc.unfreeze)
+        self.key.warmup(self.app)
+
+        self.assertGreater(gc.get_freeze_count(), 0)
+        for expression in self.key._role_expressions:
+            self.assertIs(expression._bound[0], self.key.User.role_map)
+
+        result = self.c.get(
+            "/requires_admin_and_not_support",
+            headers={"X-Auth-Token": self.token_id}
+        )
+        self.assertEqual(result.data.decode('utf-8'), "True")
+
     def test_bad_token(self):
         """
         Test that a missing token correctly generates a
@@ -322,6 +500,90 @@ class TestFlaskKeystone(TestCase):
         expected = FlaskKeystoneForbidden().to_dict()
         self.assert_json_equal(json_response, expected)
 
+    def test_role_expression(self):
+        """
+        Test that a satisfied role expression returns successfully.
+        """
+        result = self.c.get(
+            "/requires_admin_and_not_support",
+            headers={"X-Auth-Token": self.token_id}
+        )
+        self.assertEqual(result.data.decode('utf-8'), "True",
+                         "Did not receive the expected response"
+                         "from the server.")
+
+    def test_role_expression_failure(self):
+        """
+        Test that an unsatisfied role expression returns a 403.
+        """
+        result = self.c.get(
+            "/requires_support_and_admin",
+            headers={"X-Auth-Token": self.token_id}
+        )
+        json_response = json.loads(result.data.decode('utf-8'))
+        expected = FlaskKeystoneForbidden().to_dict()
+        self.assert_json_equal(json_response, expected)
+
+    def test_invalid_role_expression(self):
+        """
+        Test that an invalid role expression is rejected when decorating.
+        """
+        self.assertRaises(ValueError, self.key.requires_role, "admin and")
+
+    def test_requires_project_own_project(self):
+        """
+        Test that requires_project allows access to the token's own project.
+        """
+        result = self.c.get(
+            "/projects/atenant",
+            headers={"X-Auth-Token": self.token_id}
+        )
+        self.assertEqual(result.status_code, 200, "Bad response code. "
+                                                  "Expected 200, got %d" %
+                                                  result.status_code)
+        self.assertEqual(result.data.decode('utf-8'), "atenant")
+
+    def test_requires_project_other_project(self):
+        """
+        Test that requires_project returns a 403 for a foreign project.
+        """
+        for path in ("/projects/another", "/support/projects/another"):
+            result = self.c.get(
+                path,
+                headers={"X-Auth-Token": self.token_id}
+            )
+            json_response = json.loads(result.data.decode('utf-8'))
+            expected = FlaskKeystoneForbidden().to_dict()
+            self.assert_json_equal(json_response, expected)
+
+    def test_requires_project_domain(self):
+        """
+        Test that a project-scoped token is refused a domain-scoped route.
+        """
+        token = ksa_fixture.V3Token(user_id="auser", project_id="atenant",
+                                    project_domain_id="adomain")
+        token.add_role(name="admin_role_1")
+        result = self.c.get(
+            "/domains/adomain",
+            headers={"X-Auth-Token": self.auth_token_fixture.add_token(token)}
+        )
+        self.assertEqual(result.status_code, 403, "Bad response code. "
+                                                  "Expected 403, got %d" %
+                                                  result.status_code)
+
+    def test_requires_project_override_role(self):
+        """
+        Test that the override role grants access to any project.
+        """
+        result = self.c.get(
+            "/admin/projects/another",
+            headers={"X-Auth-Token": self.token_id}
+        )
+        self.assertEqual(result.status_code, 200, "Bad response code. "
+                                                  "Expected 200, got %d" %
+                                                  result.status_code)
+        self.assertEqual(result.data.decode('utf-8'), "another")
+
 
 class TestFlaskKeystoneAnonymousUser(TestCase):
     """
@@ -562,6 +824,25 @@ class TestFlaskKeystoneAnonymousUser(TestCase):
         expected = {"admin": True}
         self.assert_json_equal(json_response, expected)
 
+    def test_anonymous_user_is_shared_and_frozen(self):
+        """
+        Test that anonymous requests share a single, immutable user.
+        """
+        users = []
+
+        @self.app.route("/anonymous_identity")
+        def anonymous_identity():
+            users.append(current_user._get_current_object())
+            return "Success."
+
+        self.c.get("/anonymous_identity")
+        self.c.get("/anonymous_identity")
+        self.assertIs(users[0], users[1],
+                      "Anonymous users should be shared between requests.")
+        self.assertIs(users[0], self.key.Anonymous.instance)
+        self.assertRaises(AttributeError, setattr, users[0], "user_id", "a")
+        self.assertRaises(AttributeError, delattr, users[0], "user_id")
+
     def test_all_roles_should_be_false(self):
         """
         Check that all helper functions return False as expected on an Anon.
@@ -577,3 +858,904 @@ class TestFlaskKeystoneAnonymousUser(TestCase):
             self.assertEqual(v, False, "A role check returned True when it "
                                        "shouldn't have. Check: %s, Value: %s" %
                                        (k, v))
+
+
+class TestFlaskKeystoneRateLimit(TestCase):
+    """
+    Test that per-identity rate limiting is applied by before_request.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneRateLimit, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True
+        )
+        self.app = create_app()
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin"},
+            rate_limit_enabled=True,
+            rate_limit_rate=0.001,
+            rate_limit_burst=2
+        )
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token_id = self.auth_token_fixture.add_token(
+            TestFlaskKeystone.create_token(["admin_role_1"])
+        )
+
+        @self.app.route("/user_id")
+        def user_id():
+            return current_user.user_id
+
+    def test_rate_limited(self):
+        """
+        Test that requests beyond the burst receive a 429.
+        """
+        codes = [self.c.get("/user_id",
+                            headers={"X-Auth-Token": self.token_id}
+                            ).status_code
+                 for _ in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+
+
+class TestFlaskKeystoneAudit(TestCase):
+    """
+    Test that auth decisions are written to the audit stream.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneAudit, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True
+        )
+        self.app = create_app()
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin", "support_role_1": "support"},
+            audit_enabled=True,
+            audit_flush_interval=0.01
+        )
+        self.key.init_app(self.app)
+        self.events = []
+        self.key.audit.logger = mock.Mock()
+        self.key.audit.logger.info.side_effect = (
+            lambda msg: self.events.extend(
+                json.loads(line) for line in msg.split("\n")
+            )
+        )
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token_id = self.auth_token_fixture.add_token(
+            TestFlaskKeystone.create_token(["admin_role_1"])
+        )
+
+        @self.app.route("/requires_support")
+        @self.key.requires_role("support")
+        def requires_support_role():
+            return "This shouldn't succeed."
+
+    def tearDown(self):
+        self.key.audit.close()
+        super(TestFlaskKeystoneAudit, self).tearDown()
+
+    def test_forbidden_is_audited(self):
+        """
+        Test that a failed role check is audited after authentication.
+        """
+        self.c.get("/requires_support",
+                   headers={"X-Auth-Token": self.token_id})
+        self.key.audit.flush()
+
+        self.assertEqual(
+            [(e["outcome"], e["user_id"], e["required"]) for e in self.events],
+            [("authenticated", "auser", None),
+             ("forbidden", "auser", "support")]
+        )
+        self.assertIsNotNone(self.events[1]["latency"])
+
+
+class TestFlaskKeystonePolicy(TestCase):
+    """
+    Test that endpoints can be gated by rules from a policy file.
+    """
+    def setUp(self):
+        super(TestFlaskKeystonePolicy, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True
+        )
+        self.app = create_app()
+
+        policy_dir = self.useFixture(fixtures.TempDir()).path
+        policy_file = os.path.join(policy_dir, "policy.json")
+        with open(policy_file, "w") as f:
+            json.dump({
+                "default": "!",
+                "admin": "role:admin_role_1",
+                "owner": "project_id:%(project_id)s",
+                "project:get": "rule:admin or rule:owner",
+                "project:delete": "rule:owner and role:support_role_1",
+            }, f)
+
+        self.key = FlaskKeystone()
+        self.conf.config(group="flask_keystone", policy_file=policy_file)
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token_id = self.auth_token_fixture.add_token(
+            TestFlaskKeystone.create_token(["member"])
+        )
+
+        @self.app.route("/projects/<project_id>", methods=["GET"])
+        @self.key.requires_policy("project:get")
+        def get_project(project_id):
+            return project_id
+
+        @self.app.route("/projects/<project_id>", methods=["DELETE"])
+        @self.key.requires_policy("project:delete")
+        def delete_project(project_id):
+            return project_id
+
+        @self.app.route("/undefined")
+        @self.key.requires_policy("undefined")
+        def undefined():
+            return "This shouldn't succeed."
+
+    def test_policy_owner(self):
+        """
+        Test that a rule passes for the owner of the target project.
+        """
+        result = self.c.get("/projects/atenant",
+                            headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data.decode('utf-8'), "atenant")
+
+    def test_policy_forbidden(self):
+        """
+        Test that failed rules and undefined rules return a 403.
+        """
+        for method, path in [("GET", "/projects/othertenant"),
+                             ("DELETE", "/projects/atenant"),
+                             ("GET", "/undefined")]:
+            result = self.c.open(path, method=method,
+                                 headers={"X-Auth-Token": self.token_id})
+            json_response = json.loads(result.data.decode('utf-8'))
+            self.assertEqual(json_response,
+                             FlaskKeystoneForbidden().to_dict(), path)
+
+    def test_policy_results_are_cached(self):
+        """
+        Test that rules are evaluated once per request and target.
+        """
+        owner = mock.Mock(return_value=True)
+        self.key.policy.rules["owner"] = owner
+
+        @self.app.route("/projects/<project_id>/twice")
+        def twice(project_id):
+            target = {"project_id": project_id}
+            allowed = self.key.enforce("project:get", target)
+            return str(allowed and self.key.enforce("owner", target))
+
+        for _ in range(2):
+            result = self.c.get("/projects/atenant/twice",
+                                headers={"X-Auth-Token": self.token_id})
+            self.assertEqual(result.data.decode('utf-8'), "True")
+        self.assertEqual(owner.call_count, 2,
+                         "owner should be evaluated once per request.")
+
+
+class TestFlaskKeystoneTokenRefresh(TestCase):
+    """
+    Test that cached tokens are refreshed in the background.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneTokenRefresh, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(
+            ksa_loading.get_auth_plugin_conf_options("password"),
+            group="keystone_authtoken"
+        )
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True,
+            token_cache_time=300,
+            auth_type="password",
+            auth_url="https://identity.example.com/v3",
+            username="aservice",
+            password="secret"
+        )
+        self.app = create_app()
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            token_refresh_enabled=True,
+            token_refresh_window=300
+        )
+        self.key.init_app(self.app)
+        self.middleware = self.app.wsgi_app
+        self.addCleanup(self.middleware.refresher.shutdown)
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token = TestFlaskKeystone.create_token(["admin_role_1"])
+        self.token_id = self.auth_token_fixture.add_token(self.token)
+
+        @self.app.route("/user_id")
+        def user_id():
+            return current_user.user_id
+
+    def test_token_is_refreshed(self):
+        """
+        Test that a token due for refresh is served from the cache and
+        revalidated once in the background.
+        """
+        get = self.middleware.identity.get = mock.Mock(
+            return_value=mock.Mock(json=mock.Mock(return_value=self.token))
+        )
+
+        for _ in range(3):
+            result = self.c.get("/user_id",
+                                headers={"X-Auth-Token": self.token_id})
+            self.assertEqual(result.data.decode('utf-8'), "auser")
+        self.middleware.refresher.shutdown()
+
+        self.assertIs(self.key.token_cache, self.middleware.token_cache)
+        self.assertEqual(len(self.key.token_cache), 1)
+        self.assertEqual(get.call_args[1]["headers"],
+                         {"X-Subject-Token": self.token_id})
+        self.assertLessEqual(get.call_count, 2)
+
+    def test_rejected_token_is_invalidated(self):
+        """
+        Test that a token Keystone no longer accepts leaves the cache.
+        """
+        self.c.get("/user_id", headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(len(self.key.token_cache), 1)
+        self.middleware.identity.get = mock.Mock(
+            side_effect=ksa_exceptions.NotFound()
+        )
+        self.assertRaises(ksm_exceptions.InvalidToken,
+                          self.middleware.refresh_token, self.token_id)
+        self.assertEqual(len(self.key.token_cache), 0)
+
+    def test_stats(self):
+        """
+        Test that the refresher's counters are reported by stats.
+        """
+        self.assertEqual(self.key.stats(), {"token_refresh": {
+            "refreshed": 0, "failed": 0, "skipped": 0, "pending": 0
+        }})
+
+
+class TestFlaskKeystoneConnectionPool(TestCase):
+    """
+    Test that tokens are validated over the extension's connection pool.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneConnectionPool, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True
+        )
+        self.app = create_app()
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            keystone_pool_enabled=True,
+            keystone_pool_size=4,
+            keystone_timeout=2.5
+        )
+        self.key.init_app(self.app)
+        self.middleware = self.app.wsgi_app
+
+    def test_pooled_session(self):
+        """
+        Test that keystonemiddleware's session uses the pool.
+        """
+        session = self.middleware._session
+        self.assertIs(session.session, self.key.http_pool.session)
+        self.assertEqual(session.timeout, 2.5)
+        self.assertIsNone(self.key.token_cache)
+        adapter = session.session.get_adapter("https://identity")
+        self.assertIs(adapter, self.key.http_pool.adapter)
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+    def test_stats(self):
+        """
+        Test that the pool's counters are reported by stats.
+        """
+        stats = self.key.stats()
+        self.assertEqual(list(stats), ["http_pool"])
+        self.assertEqual(stats["http_pool"]["requests"], 0)
+        self.assertEqual(stats["http_pool"]["saturated"], 0)
+
+
+class TestFlaskKeystoneCircuitBreaker(TestCase):
+    """
+    Test that validation stops calling Keystone while it is unreachable.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneCircuitBreaker, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True,
+            token_cache_time=300,
+            www_authenticate_uri="https://identity.example.com"
+        )
+        # NOTE: create_app wraps the application in its own, plain,
+        # middleware, which would fail on its own during the outage.
+        self.app = Flask("test_app")
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            circuit_breaker_enabled=True,
+            circuit_breaker_threshold=1
+        )
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token_id = self.auth_token_fixture.add_token(
+            TestFlaskKeystone.create_token(["admin_role_1"])
+        )
+
+        @self.app.route("/user_id")
+        def user_id():
+            return current_user.user_id
+
+    def _keystone_down(self):
+        error = ksm_exceptions.InvalidToken("Keystone unavailable: down")
+        patcher = mock.patch.object(auth_token.AuthProtocol, "fetch_token",
+                                    side_effect=error)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_outage(self):
+        """
+        Test that known tokens are served stale and others fail fast.
+        """
+        result = self.c.get("/user_id",
+                            headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.status_code, 200)
+
+        fetch_token = self._keystone_down()
+        entry = self.key.token_cache._entries[self.token_id]
+        entry.expires = 0
+
+        result = self.c.get("/user_id",
+                            headers={"X-Auth-Token": self.token_id})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(fetch_token.call_count, 1)
+        self.assertEqual(self.key.breaker.state, "open")
+
+        result = self.c.get("/user_id", headers={"X-Auth-Token": "unknown"})
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(result.json["code"], 503)
+        self.assertEqual(result.headers["Retry-After"], "30")
+        self.assertEqual(fetch_token.call_count, 1,
+                         "keystone should not be called while open.")
+
+        stats = self.key.stats()["circuit_breaker"]
+        self.assertEqual(stats["served_stale"], 1)
+        self.assertEqual(stats["rejected"], 1)
+
+    def test_probe_closes_circuit(self):
+        """
+        Test that a probe which reaches Keystone closes the circuit.
+        """
+        fetch_token = self._keystone_down()
+        result = self.c.get("/user_id", headers={"X-Auth-Token": "unknown"})
+        self.assertEqual(result.status_code, 401)
+        self.assertEqual(self.key.breaker.state, "open")
+
+        fetch_token.side_effect = ksm_exceptions.InvalidToken("rejected")
+        self.key.breaker._opened_at -= 3600
+        result = self.c.get("/user_id", headers={"X-Auth-Token": "unknown"})
+        self.assertEqual(result.status_code, 401)
+        self.assertEqual(self.key.breaker.state, "closed")
+
+
+class TestFlaskKeystoneRevocation(TestCase):
+    """
+    Test that revoked tokens are removed from the in-process cache.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneRevocation, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.conf.config(
+            group="keystone_authtoken",
+            delay_auth_decision=True,
+            token_cache_time=300,
+            www_authenticate_uri="https://identity.example.com"
+        )
+        self.app = Flask("test_app")
+
+        self.feed = LocalRevocationFeed()
+        self.key = FlaskKeystone(revocation_feed=self.feed)
+        self.conf.config(
+            group="flask_keystone",
+            revocation_enabled=True,
+            revocation_poll_interval=3600
+        )
+        self.key.init_app(self.app)
+        self.addCleanup(self.key.revocations.stop)
+        self.c = self.app.test_client()
+
+        self.auth_token_fixture = self.useFixture(
+            ksm_fixture.AuthTokenFixture()
+        )
+        self.token_id = self.auth_token_fixture.add_token(
+            TestFlaskKeystone.create_token(["admin_role_1"])
+        )
+
+        @self.app.route("/user_id")
+        def user_id():
+            return current_user.user_id
+
+    def test_revoked_token(self):
+        """
+        Test that a revoked token is rejected, though Keystone's cache
+        still accepts it.
+        """
+        headers = {"X-Auth-Token": self.token_id}
+        self.assertEqual(self.c.get("/user_id", headers=headers).status_code,
+                         200)
+        self.assertEqual(len(self.key.token_cache), 1)
+
+        self.feed.revoke(user_id="auser")
+        self.key.revocations.poll()
+        self.assertEqual(len(self.key.token_cache), 0)
+
+        self.assertEqual(self.c.get("/user_id", headers=headers).status_code,
+                         401)
+        self.assertEqual(self.key.stats()["revocation"]["invalidated"], 1)
+
+    def test_keystone_feed(self):
+        """
+        Test that events are read with the service's own credentials.
+        """
+        self.conf.register_opts(
+            ksa_loading.get_auth_plugin_conf_options("password"),
+            group="keystone_authtoken"
+        )
+        self.conf.config(
+            group="keystone_authtoken",
+            auth_type="password",
+            auth_url="https://identity.example.com/v3",
+            username="aservice",
+            password="secret"
+        )
+        key = FlaskKeystone()
+        key.init_app(Flask("other_app"))
+        adapter = key.revocations.feed.adapter
+        self.assertEqual(adapter.auth.auth_url,
+                         "https://identity.example.com/v3")
+        self.assertEqual(adapter.service_type, "identity")
+
+    def test_keystone_feed_needs_credentials(self):
+        """
+        Test that events can't be read from Keystone without credentials.
+        """
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
+
+
+class TestFlaskKeystoneTrustedHeaders(TestCase):
+    """
+    Test that signed identity headers are trusted in place of tokens.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneTrustedHeaders, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.app = Flask("test_app")
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin"},
+            trusted_headers_enabled=True,
+            trusted_headers_key="secret"
+        )
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        @self.app.route("/admin")
+        @self.key.requires_role("admin")
+        def admin():
+            return current_user.user_id
+
+    def test_signed_headers(self):
+        """
+        Test that a signed identity is used without validating a token.
+        """
+        headers = {
+            "X-Identity-Status": "Confirmed",
+            "X-User-Id": "auser",
+            "X-Roles": "admin_role_1",
+        }
+        headers["X-Identity-Signature"] = trusted.sign_headers(
+            "secret", headers, "GET", "/admin")
+        result = self.c.get("/admin", headers=headers)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data.decode("utf-8"), "auser")
+        self.assertNotIsInstance(self.app.wsgi_app, auth_token.AuthProtocol)
+
+    def test_unsigned_headers(self):
+        """
+        Test that an unsigned identity is rejected.
+        """
+        result = self.c.get("/admin", headers={
+            "X-Identity-Status": "Confirmed",
+            "X-User-Id": "auser",
+            "X-Roles": "admin_role_1",
+        })
+        self.assertEqual(result.status_code, 401)
+        self.assertEqual(self.key.stats()["trusted_headers"]["unsigned"], 1)
+
+    def test_key_required(self):
+        """
+        Test that trusted-header mode requires a key.
+        """
+        self.conf.config(group="flask_keystone", trusted_headers_key=None)
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
+
+
+class TestFlaskKeystoneProfiling(TestCase):
+    """
+    Test that requests are profiled on demand.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneProfiling, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.app = Flask("test_app")
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin", "support_role_1": "support"},
+            trusted_headers_enabled=True,
+            trusted_headers_key="secret",
+            profiling_enabled=True,
+            profiling_role="admin"
+        )
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        @self.app.route("/work")
+        def work():
+            return "done"
+
+    def _headers(self, role, path, profile=False):
+        headers = {
+            "X-Identity-Status": "Confirmed",
+            "X-User-Id": "auser",
+            "X-Roles": role,
+        }
+        headers["X-Identity-Signature"] = trusted.sign_headers(
+            "secret", headers, "GET", path)
+        if profile:
+            headers["X-Flask-Keystone-Profile"] = "1"
+        return headers
+
+    def test_requested_profile(self):
+        """
+        Test that a privileged user's requested profile is kept and served.
+        """
+        result = self.c.get("/work", headers=self._headers(
+            "admin_role_1", "/work", profile=True))
+        self.assertEqual(result.status_code, 200)
+
+        result = self.c.get("/_flask_keystone/profiles",
+                            headers=self._headers("admin_role_1",
+                                                  "/_flask_keystone/profiles"))
+        self.assertEqual(result.status_code, 200)
+        profiles = result.get_json()
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]["path"], "/work")
+        self.assertEqual(profiles[0]["trigger"], "requested")
+        self.assertEqual(profiles[0]["status"], 200)
+
+        path = "/_flask_keystone/profiles/%d" % profiles[0]["id"]
+        result = self.c.get(path + "?sort=tottime",
+                            headers=self._headers("admin_role_1", path))
+        self.assertEqual(result.status_code, 200)
+        self.assertIn("function calls", result.data.decode("utf-8"))
+
+    def test_anonymous_profile_ignored(self):
+        """
+        Test that requests without credentials are never profiled.
+        """
+        self.c.get("/work", headers={"X-Flask-Keystone-Profile": "1"})
+        stats = self.key.stats()["profiling"]
+        self.assertEqual(stats["profiled"], 0)
+        self.assertEqual(stats["discarded"], 0)
+
+    def test_invalid_credentials_profile_ignored(self):
+        """
+        Test that requests with invalid credentials are never profiled.
+        """
+        headers = self._headers("admin_role_1", "/work", profile=True)
+        headers["X-Identity-Signature"] = "0:garbage"
+        headers["X-Auth-Token"] = "garbage"
+        self.c.get("/work", headers=headers)
+        stats = self.key.stats()["profiling"]
+        self.assertEqual(stats["profiled"], 0)
+        self.assertEqual(stats["discarded"], 0)
+
+    def test_unprivileged_profile_discarded(self):
+        """
+        Test that profiles requested by other users are not kept.
+        """
+        self.c.get("/work", headers=self._headers("support_role_1", "/work",
+                                                  profile=True))
+        self.assertEqual(self.key.stats()["profiling"]["discarded"], 1)
+        self.assertEqual(self.key.profiler.profiles(), [])
+
+        result = self.c.get("/_flask_keystone/profiles",
+                            headers=self._headers("support_role_1",
+                                                  "/_flask_keystone/profiles"))
+        self.assertEqual(result.status_code, 403)
+
+    def test_unknown_profile(self):
+        """
+        Test that a profile which is not kept is not found.
+        """
+        path = "/_flask_keystone/profiles/42"
+        result = self.c.get(path, headers=self._headers("admin_role_1", path))
+        self.assertEqual(result.status_code, 404)
+
+    def test_role_required(self):
+        """
+        Test that profiling requires a configured role.
+        """
+        self.conf.config(group="flask_keystone", profiling_role="nobody")
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
+
+
+class TestFlaskKeystoneOfflineValidation(TestCase):
+    """
+    Test that JWS tokens are validated without Keystone.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneOfflineValidation, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.app = Flask("test_app")
+
+        fd, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            f.write(test_offline.keyset_json())
+        self.addCleanup(os.remove, path)
+
+        self.key = FlaskKeystone()
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin"},
+            offline_validation_enabled=True,
+            offline_keyset_file=path,
+            offline_fallback=False
+        )
+        self.key.init_app(self.app)
+        self.c = self.app.test_client()
+
+        @self.app.route("/admin")
+        @self.key.requires_role("admin")
+        def admin():
+            return current_user.user_id
+
+    def test_valid_token(self):
+        """
+        Test that a JWS token signed with a known key is accepted.
+        """
+        token = test_offline.make_token(test_offline.claims())
+        result = self.c.get("/admin", headers={"X-Auth-Token": token})
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data.decode("utf-8"), "auser")
+        self.assertEqual(
+            self.key.stats()["offline_validation"]["verified"], 1)
+
+    def test_invalid_token(self):
+        """
+        Test that other tokens are rejected without a fallback.
+        """
+        result = self.c.get("/admin", headers={"X-Auth-Token": "fernet"})
+        self.assertEqual(result.status_code, 401)
+
+    def test_keyset_required(self):
+        """
+        Test that offline validation requires a keyset file.
+        """
+        self.conf.config(group="flask_keystone", offline_keyset_file=None)
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
+
+
+class TestFlaskKeystoneRolePatterns(TestCase):
+    """
+    Test that keystone role patterns grant configured roles.
+    """
+    def setUp(self):
+        super(TestFlaskKeystoneRolePatterns, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin"},
+            role_patterns=["rax_managed:*=managed", "ticketing:*:admin=admin"]
+        )
+
+    def test_parse_role_patterns(self):
+        """
+        Test that patterns are merged into the configured roles.
+        """
+        key = FlaskKeystone()
+        key.init_app(Flask("test_app"))
+        self.assertEqual(key.roles, {
+            "admin": set(["admin_role_1", "ticketing:*:admin"]),
+            "managed": set(["rax_managed:*"]),
+        })
+
+        app = Flask("other_app")
+        with app.test_request_context("/", headers={
+                "X-Roles": "ticketing:eu:admin,rax_managed:ops"}):
+            user = key.User(flask_keystone.request)
+            self.assertTrue(user.is_admin())
+            self.assertTrue(user.has_role("managed"))
+
+    def test_invalid_role_pattern(self):
+        """
+        Test that a pattern without a configured role is rejected.
+        """
+        self.conf.config(group="flask_keystone", role_patterns=["rax:*"])
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("test_app"))
+
+
+class TestFlaskKeystonePropagation(TestCase):
+    """
+    Test that the client propagates the identity of the current user.
+    """
+    def setUp(self):
+        super(TestFlaskKeystonePropagation, self).setUp()
+        self.conf = self.useFixture(fixture.Config())
+        self.conf.register_opts(RAX_OPTS, group="flask_keystone")
+        self.conf.config(
+            group="flask_keystone",
+            roles={"admin_role_1": "admin"},
+            trusted_headers_enabled=True,
+            trusted_headers_key="secret",
+            propagation_enabled=True,
+            propagation_timeout=3.0,
+            propagation_signing_key="secret"
+        )
+        self.app = Flask("test_app")
+        self.key = FlaskKeystone()
+        self.key.init_app(self.app)
+
+        @self.app.route("/fanout")
+        def fanout():
+            for _ in range(2):
+                self.key.client.get("http://downstream/")
+            return "ok"
+
+        self.headers = {
+            "X-Identity-Status": "Confirmed",
+            "X-User-Id": "auser",
+            "X-Roles": "admin_role_1",
+            "X-Auth-Token": "user-token",
+        }
+        self.headers["X-Identity-Signature"] = trusted.sign_headers(
+            "secret", self.headers, "GET", "/fanout")
+
+    def _fanout(self):
+        session = self.key.client.pool.session
+        with mock.patch.object(session, "request") as request:
+            result = self.app.test_client().get("/fanout",
+                                                headers=self.headers)
+        self.assertEqual(result.status_code, 200)
+        return request
+
+    def test_identity_propagated(self):
+        """
+        Test that a downstream service trusts the forwarded identity.
+        """
+        request = self._fanout()
+        self.assertEqual(request.call_count, 2)
+        headers = request.call_args[1]["headers"]
+        self.assertEqual(request.call_args[1]["timeout"], 3.0)
+        self.assertEqual(headers["X-Auth-Token"], "user-token")
+
+        downstream = Flask("downstream_app")
+        FlaskKeystone().init_app(downstream)
+
+        @downstream.route("/")
+        def whoami():
+            return current_user.user_id
+
+        result = downstream.test_client().get("/", headers=headers)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.data.decode("utf-8"), "auser")
+
+        stats = self.key.stats()["propagation"]
+        self.assertEqual(stats["forwarded"], 2)
+        self.assertEqual(stats["signed"], 2)
+
+    def test_disabled(self):
+        """
+        Test that no client is provided unless enabled.
+        """
+        self.conf.config(group="flask_keystone", propagation_enabled=False)
+        key = FlaskKeystone()
+        key.init_app(Flask("other_app"))
+        self.assertIsNone(key.client)
+        self.assertNotIn("propagation", key.stats())
+
+    def test_service_token(self):
+        """
+        Test that the service's own token is sent as X-Service-Token.
+        """
+        self.conf.register_opts(
+            ksa_loading.get_auth_plugin_conf_options("password"),
+            group="keystone_authtoken"
+        )
+        self.conf.config(group="keystone_authtoken",
+                         auth_type="password",
+                         auth_url="https://identity.example.com/v3",
+                         username="aservice",
+                         password="secret")
+        self.conf.config(group="flask_keystone",
+                         trusted_headers_enabled=False,
+                         propagation_service_token=True)
+        key = FlaskKeystone()
+        with mock.patch("keystoneauth1.adapter.Adapter.get_token",
+                        return_value="service-token"):
+            key.init_app(Flask("other_app"))
+            self.assertEqual(key.client.identity_headers(),
+                             {"X-Service-Token": "service-token"})
+
+    def test_service_token_needs_credentials(self):
+        """
+        Test that service tokens can't be sent in trusted-header mode, or
+        without keystone_authtoken credentials.
+        """
+        self.conf.config(group="flask_keystone",
+                         propagation_service_token=True)
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
+        self.conf.config(group="flask_keystone",
+                         trusted_headers_enabled=False)
+        self.assertRaises(ValueError, FlaskKeystone().init_app,
+                          Flask("other_app"))
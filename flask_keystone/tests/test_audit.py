@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for audit.AuditLogger.
+"""
+
+import json
+import threading
+
+from unittest import TestCase
+
+from flask_keystone.audit import AuditLogger
+
+
+class FakeLogger(object):
+    """Logger capturing the lines written to it."""
+
+    def __init__(self, gate=None):
+        self.lines = []
+        self.warnings = []
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def info(self, msg):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.lines.extend(msg.split("\n"))
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+
+class TestAuditLogger(TestCase):
+
+    def test_events_are_written(self):
+        logger = FakeLogger()
+        audit = AuditLogger(logger=logger, flush_interval=0.01)
+        audit.record("forbidden", user_id="auser", project_id="atenant",
+                     method="GET", endpoint="/admin", required="admin",
+                     latency=0.5)
+        audit.record("authorized", user_id="buser")
+        audit.close()
+
+        events = [json.loads(line) for line in logger.lines]
+        self.assertEqual(len(events), 2, "Both events should be written.")
+        self.assertEqual(events[0], {
+            "outcome": "forbidden",
+            "user_id": "auser",
+            "project_id": "atenant",
+            "method": "GET",
+            "endpoint": "/admin",
+            "required": "admin",
+            "latency": 0.5
+        })
+        self.assertEqual(audit.written, 2)
+        self.assertEqual(audit.dropped, 0)
+
+    def test_events_are_dropped_when_full(self):
+        gate = threading.Event()
+        logger = FakeLogger(gate=gate)
+        audit = AuditLogger(logger=logger, queue_size=1, flush_interval=0)
+        audit.record("authenticated")
+        logger.entered.wait(5)
+
+        audit.record("authenticated")
+        audit.record("authenticated")
+        self.assertEqual(audit.dropped, 1,
+                         "The third event should not fit in the queue.")
+
+        gate.set()
+        audit.flush()
+        audit.close()
+        self.assertEqual(audit.written, 2)
+        self.assertEqual(len(logger.warnings), 1,
+                         "Dropped events should be reported.")
@@ -0,0 +1,69 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for circuit.CircuitBreaker.
+"""
+
+from unittest import mock
+from unittest import TestCase
+
+from flask_keystone.circuit import CircuitBreaker
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.clock = mock.patch("flask_keystone.circuit.time.monotonic",
+                                return_value=1000.0)
+        self.now = self.clock.start()
+        self.addCleanup(self.clock.stop)
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats(), {
+            "state": "open", "failures": 2, "opened": 1, "rejected": 1,
+            "served_stale": 0,
+        })
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_probe(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now.return_value = 1030.0
+        self.assertTrue(self.breaker.allow(), "a probe should be allowed.")
+        self.assertFalse(self.breaker.allow(),
+                         "only one probe should be allowed at a time.")
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now.return_value = 1030.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.opened, 2)
@@ -74,6 +74,20 @@ class TestHandleException(TestCase):
             "title": "Unauthorized"
         }
 
+    def test_handle_exception_cached_body(self):
+        """
+        Test that a repeated exception reuses its serialized body.
+        """
+        with self.app.test_request_context("/"):
+            first = exceptions.handle_exception(
+                exceptions.FlaskKeystoneForbidden())
+            second = exceptions.handle_exception(
+                exceptions.FlaskKeystoneForbidden())
+
+        self.assertEqual(second.status_code, 403)
+        self.assertEqual(second.mimetype, "application/json")
+        self.assertEqual(first.get_data(), second.get_data())
+
 
 class TestExceptions(TestCase):
     """
@@ -143,3 +157,21 @@ class TestExceptions(TestCase):
             "message": ("The provided credentials were accepted, but were "
                         "not sufficient to access this resource.")
         }, "Error message did not match.")
+
+    def test_too_many_requests_exception(self):
+        """Test the response details of the TooManyRequests exception."""
+        err = exceptions.FlaskKeystoneTooManyRequests()
+        self.assertEqual(err.to_dict(), {
+            "code": 429,
+            "title": "Too Many Requests",
+            "message": "Too many requests have been made, please retry later."
+        }, "Error message did not match.")
+
+    def test_service_unavailable_exception(self):
+        """Test the response details of the ServiceUnavailable exception."""
+        err = exceptions.FlaskKeystoneServiceUnavailable()
+        self.assertEqual(err.to_dict(), {
+            "code": 503,
+            "title": "Service Unavailable",
+            "message": "The identity service is temporarily unavailable."
+        }, "Error message did not match.")
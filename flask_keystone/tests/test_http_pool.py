@@ -0,0 +1,134 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for http_pool.HTTPPool.
+"""
+
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from unittest import TestCase
+
+import requests
+
+from flask_keystone.http_pool import HTTPPool, RetryBudget
+
+
+# NOTE: http.server.ThreadingHTTPServer only exists on Python 3.7 and later.
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.server.gate is not None:
+            self.server.gate.wait(5)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPPool(TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.connections = set()
+        self.server.gate = None
+        self.url = "http://127.0.0.1:%d/" % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_connections_are_reused(self):
+        pool = HTTPPool(pool_size=2)
+        for _ in range(5):
+            self.assertEqual(pool.session.get(self.url).text, "ok")
+
+        self.assertEqual(len(self.server.connections), 1)
+        stats = pool.stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["saturated"], 0)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_saturation_is_counted(self):
+        # NOTE: the server holds both requests until the second has found
+        # the pool saturated.
+        self.server.gate = threading.Event()
+        pool = HTTPPool(pool_size=1)
+        threads = [threading.Thread(target=pool.session.get,
+                                    args=(self.url,), kwargs={"timeout": 5})
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        while pool.in_flight < 2:
+            threading.Event().wait(0.01)
+        self.server.gate.set()
+        for thread in threads:
+            thread.join()
+
+        stats = pool.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["peak_in_flight"], 2)
+        self.assertEqual(stats["saturated"], 1)
+
+    def test_connections_forgotten_after_fork(self):
+        pool = HTTPPool()
+        pool.session.get(self.url)
+        with mock.patch("flask_keystone.http_pool.os.getpid",
+                        return_value=-1):
+            pool.session.get(self.url)
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_retries_within_budget(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:%d/" % sock.getsockname()[1]
+        sock.close()
+
+        pool = HTTPPool(retries=5, retry_budget=0.0001)
+        with mock.patch.object(pool.budget, "spend",
+                               wraps=pool.budget.spend) as spend:
+            self.assertRaises(requests.ConnectionError,
+                              pool.session.get, url)
+        self.assertEqual(spend.call_count, 2)
+        self.assertEqual(pool.stats()["retry_budget_exhausted"], 1)
+
+
+class TestRetryBudget(TestCase):
+
+    def test_spend(self):
+        with mock.patch("flask_keystone.http_pool.time.monotonic",
+                        return_value=10.0):
+            budget = RetryBudget(2.0)
+            self.assertTrue(budget.spend())
+            self.assertTrue(budget.spend())
+            self.assertFalse(budget.spend())
+        self.assertEqual(budget.exhausted, 1)
+
+    def test_zero_rate(self):
+        budget = RetryBudget(0)
+        self.assertFalse(budget.spend())
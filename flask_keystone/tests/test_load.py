@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for the flask-keystone-bench load benchmark.
+"""
+
+import os
+import unittest
+
+from oslo_config import fixture
+
+from testtools import TestCase
+
+from flask_keystone.benchmarks import load
+
+
+class TestLoad(TestCase):
+
+    def setUp(self):
+        super(TestLoad, self).setUp()
+        self.useFixture(fixture.Config())
+
+    def test_run_threads(self):
+        results = load.run(requests=40, concurrency=2, warmup=4,
+                           many_roles=20)
+        self.assertEqual(results["total"]["requests"], 40)
+        self.assertEqual(
+            sorted(results),
+            sorted(load.KINDS + ("total",)),
+            "each kind of request should be reported."
+        )
+        self.assertEqual(results["valid"]["statuses"], {200: results[
+            "valid"]["requests"]})
+        for figures in results.values():
+            self.assertLessEqual(figures["p50"], figures["p99"])
+
+    def test_run_trusted(self):
+        results = load.run(requests=20, concurrency=1, warmup=0,
+                           mode="trusted", mix={"many_roles": 1})
+        self.assertEqual(results["many_roles"]["statuses"], {200: 20})
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_run_processes(self):
+        results = load.run(requests=20, concurrency=2, warmup=0,
+                           model="processes")
+        self.assertEqual(results["total"]["requests"], 20)
+
+    def test_parse_mix(self):
+        self.assertEqual(load.parse_mix("valid=3,anonymous=1"),
+                         {"valid": 3.0, "anonymous": 1.0})
+        self.assertRaises(ValueError, load.parse_mix, "expired=1")
+        self.assertRaises(ValueError, load.parse_mix, "valid=0")
+
+    def test_plan(self):
+        plan = load._plan({"valid": 3, "anonymous": 1}, 1000, seed=7)
+        self.assertEqual(plan, load._plan({"valid": 3, "anonymous": 1},
+                                          1000, seed=7))
+        self.assertEqual(set(plan), set(["valid", "anonymous"]))
+        self.assertGreater(plan.count("valid"), 600)
+        self.assertEqual(load._plan({"valid": 1, "anonymous": 0}, 50, 1),
+                         ["valid"] * 50)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(load.percentile(values, 0.50), 50)
+        self.assertEqual(load.percentile(values, 0.99), 99)
+        self.assertIsNone(load.percentile([], 0.5))
@@ -0,0 +1,118 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for log_sampling.SampledLogger.
+"""
+
+import logging
+
+from unittest import mock
+from unittest import TestCase
+
+from flask_keystone.log_sampling import SampledLogger
+
+
+KEY = ("rbac", "auser", "/admin")
+
+
+class TestSampledLogger(TestCase):
+
+    def setUp(self):
+        self.logger = mock.Mock()
+        self.logger.isEnabledFor.return_value = True
+        self.now = 0
+        self.clock = mock.patch(
+            "flask_keystone.log_sampling.time.monotonic",
+            side_effect=lambda: self.now
+        )
+        self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def messages(self):
+        return [c[0][1] % c[0][2:] for c in self.logger.log.call_args_list]
+
+    def test_passthrough(self):
+        sampled = SampledLogger(self.logger)
+        for _ in range(3):
+            sampled.info(KEY, "Rejected %s", "auser")
+        self.assertEqual(self.messages(), ["Rejected auser"] * 3)
+
+    def test_disabled_level_is_skipped(self):
+        self.logger.isEnabledFor.return_value = False
+        sampled = SampledLogger(self.logger, rate_limit=1)
+        sampled.info(KEY, "Rejected %s", "auser")
+        self.logger.log.assert_not_called()
+
+    def test_rate_limit_and_summary(self):
+        sampled = SampledLogger(self.logger, rate_limit=2, interval=60)
+        for _ in range(5):
+            sampled.info(KEY, "Rejected %s", "auser")
+        sampled.info(("rbac", "buser", "/admin"), "Rejected %s", "buser")
+        self.assertEqual(self.messages(), [
+            "Rejected auser", "Rejected auser", "Rejected buser"])
+
+        self.now = 61
+        sampled.info(KEY, "Rejected %s", "auser")
+        self.assertEqual(self.messages()[3:], [
+            "Suppressed 3 'rbac' messages for user 'auser' on '/admin' in "
+            "the last 61 seconds.",
+            "Rejected auser"
+        ])
+        self.assertEqual(self.logger.log.call_args[0][0], logging.INFO)
+
+    def test_summary_without_later_messages(self):
+        sampled = SampledLogger(self.logger, rate_limit=1, interval=60)
+        for _ in range(3):
+            sampled.info(KEY, "Rejected %s", "auser")
+
+        self.now = 30
+        sampled.sweep()
+        self.assertEqual(self.messages(), ["Rejected auser"])
+
+        self.now = 61
+        sampled.sweep()
+        self.assertEqual(self.messages(), [
+            "Rejected auser",
+            "Suppressed 2 'rbac' messages for user 'auser' on '/admin' in "
+            "the last 61 seconds."
+        ])
+        sampled.flush()
+        self.assertEqual(len(self.messages()), 2,
+                         "a window should only be summarized once.")
+
+    def test_oldest_window_evicted(self):
+        sampled = SampledLogger(self.logger, rate_limit=1, max_keys=2)
+        for user in ("auser", "buser", "auser", "cuser"):
+            sampled.info(("rbac", user, "/admin"), "Rejected %s", user)
+        self.assertEqual(self.messages(), [
+            "Rejected auser", "Rejected buser",
+            "Suppressed 1 'rbac' messages for user 'auser' on '/admin' in "
+            "the last 0 seconds.",
+            "Rejected cuser"
+        ])
+
+    def test_sampling(self):
+        sampled = SampledLogger(self.logger, sample_rate=0.5)
+        with mock.patch("flask_keystone.log_sampling.random.random",
+                        side_effect=[0.1, 0.9, 0.4, 0.6]):
+            for _ in range(4):
+                sampled.info(KEY, "Rejected %s", "auser")
+        self.assertEqual(len(self.messages()), 2)
+
+        sampled.flush()
+        self.assertEqual(self.messages()[-1],
+                         "Suppressed 2 'rbac' messages for user 'auser' on "
+                         "'/admin' in the last 0 seconds.")
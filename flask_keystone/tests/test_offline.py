@@ -0,0 +1,257 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for offline validation of JWS tokens.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import time
+
+from unittest import TestCase
+
+from flask_keystone import offline
+
+
+SECRET = b"a-shared-secret"
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def make_token(claims, secret=SECRET, kid="k1", alg="HS256"):
+    """Sign claims into a compact HS256 JWS."""
+    header = _b64(json.dumps({"alg": alg, "kid": kid}).encode("utf-8"))
+    payload = _b64(json.dumps(claims).encode("utf-8"))
+    message = ("%s.%s" % (header, payload)).encode("ascii")
+    signature = hmac.new(secret, message, hashlib.sha256).digest()
+    return "%s.%s.%s" % (header, payload, _b64(signature))
+
+
+def keyset_json(secret=SECRET, kid="k1"):
+    return json.dumps({"keys": [
+        {"kid": kid, "kty": "oct", "k": _b64(secret)},
+    ]})
+
+
+def claims(**extra):
+    values = {"sub": "auser", "exp": time.time() + 60,
+              "project_id": "atenant", "roles": ["admin_role_1"]}
+    values.update(extra)
+    return values
+
+
+class _Keyset(object):
+    reloads = 0
+
+    def __init__(self, data):
+        self.keys = offline.load_keyset(data)
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+
+class TestVerifyToken(TestCase):
+
+    def setUp(self):
+        self.keyset = _Keyset(keyset_json())
+
+    def test_valid(self):
+        verified = offline.verify_token(make_token(claims()), self.keyset)
+        self.assertEqual(verified["sub"], "auser")
+
+    def test_bad_signature(self):
+        token = make_token(claims(), secret=b"another-secret")
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset)
+
+    def test_non_ascii_payload(self):
+        header, _, signature = make_token(claims()).split(".")
+        token = "%s.%s.%s" % (header, "\u00e9t\u00e9", signature)
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset)
+
+    def test_unknown_key(self):
+        self.assertRaises(offline.UnknownKey, offline.verify_token,
+                          make_token(claims(), kid="k2"), self.keyset)
+        self.assertRaises(offline.UnknownKey, offline.verify_token,
+                          "gAAAAABfernet-token", self.keyset)
+
+    def test_algorithm_not_allowed(self):
+        self.assertRaises(offline.UnknownKey, offline.verify_token,
+                          make_token(claims(), alg="none"), self.keyset)
+
+    def test_expired(self):
+        token = make_token(claims(exp=time.time() - 10))
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset)
+        self.assertEqual(
+            offline.verify_token(token, self.keyset, leeway=30)["sub"],
+            "auser"
+        )
+
+    def test_expiry_required(self):
+        values = claims()
+        del values["exp"]
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          make_token(values), self.keyset)
+
+    def test_not_yet_valid(self):
+        token = make_token(claims(nbf=time.time() + 30))
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset)
+
+    def test_malformed_dates(self):
+        for values in (claims(nbf="soon"), claims(nbf=[1]),
+                       claims(exp=float("nan")), claims(exp=float("inf")),
+                       claims(nbf=float("nan"))):
+            self.assertRaises(offline.InvalidToken, offline.verify_token,
+                              make_token(values), self.keyset)
+
+    def test_issuer_and_audience(self):
+        token = make_token(claims(iss="https://tokens", aud=["a", "b"]))
+        offline.verify_token(token, self.keyset, issuer="https://tokens",
+                             audience="b")
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset, issuer="https://other")
+        self.assertRaises(offline.InvalidToken, offline.verify_token,
+                          token, self.keyset, audience="c")
+
+    def test_identity_environ(self):
+        environ = offline.identity_environ(claims(is_admin_project=False))
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Confirmed")
+        self.assertEqual(environ["HTTP_X_USER_ID"], "auser")
+        self.assertEqual(environ["HTTP_X_PROJECT_ID"], "atenant")
+        self.assertEqual(environ["HTTP_X_ROLES"], "admin_role_1")
+        self.assertEqual(environ["HTTP_X_IS_ADMIN_PROJECT"], "False")
+
+    def test_identity_environ_invalid_roles(self):
+        for roles in ([1, 2], {"admin_role_1": True}, 1):
+            self.assertRaises(offline.InvalidToken, offline.identity_environ,
+                              claims(roles=roles))
+
+    def test_keyset_bytes(self):
+        keys = offline.load_keyset(keyset_json().encode("utf-8"))
+        self.assertEqual(list(keys), ["k1"])
+
+    def test_invalid_keyset(self):
+        self.assertRaises(ValueError, offline.load_keyset, "[]")
+        self.assertRaises(ValueError, offline.load_keyset,
+                          '{"keys": [{"kty": "oct"}]}')
+
+
+class TestKeyset(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self._write(keyset_json())
+
+    def _write(self, data):
+        with open(self.path, "w") as f:
+            f.write(data)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns,
+                                stat.st_mtime_ns + 10 ** 9))
+
+    def test_reload(self):
+        keyset = offline.Keyset(self.path, check_interval=0)
+        self.assertIsNotNone(keyset.get("k1"))
+
+        self._write(keyset_json(kid="k2"))
+        self.assertIsNone(keyset.get("k1"))
+        self.assertIsNotNone(keyset.get("k2"))
+        self.assertEqual(keyset.reloads, 1)
+
+    def test_invalid_reload_keeps_keys(self):
+        keyset = offline.Keyset(self.path, check_interval=0)
+        self._write("not json")
+        self.assertIsNotNone(keyset.get("k1"))
+        self.assertEqual(keyset.reloads, 0)
+
+    def test_check_interval(self):
+        keyset = offline.Keyset(self.path, check_interval=3600)
+        self._write(keyset_json(kid="k2"))
+        self.assertIsNotNone(keyset.get("k1"))
+
+
+class TestOfflineTokenMiddleware(TestCase):
+
+    def setUp(self):
+        self.keyset = _Keyset(keyset_json())
+        self.seen = []
+
+    def _app(self, environ, start_response):
+        self.seen.append(("app", dict(environ)))
+        return []
+
+    def _fallback(self, environ, start_response):
+        self.seen.append(("fallback", dict(environ)))
+        return []
+
+    def test_verified(self):
+        middleware = offline.OfflineTokenMiddleware(
+            self._app, self.keyset, fallback=self._fallback)
+        middleware({"HTTP_X_AUTH_TOKEN": make_token(claims()),
+                    "HTTP_X_SERVICE_ROLES": "forged"}, None)
+        target, environ = self.seen[0]
+        self.assertEqual(target, "app")
+        self.assertEqual(environ["HTTP_X_USER_ID"], "auser")
+        self.assertNotIn("HTTP_X_SERVICE_ROLES", environ)
+        self.assertEqual(middleware.stats()["verified"], 1)
+
+    def test_unknown_key_delegated(self):
+        middleware = offline.OfflineTokenMiddleware(
+            self._app, self.keyset, fallback=self._fallback)
+        middleware({"HTTP_X_AUTH_TOKEN": "a-fernet-token"}, None)
+        middleware({}, None)
+        self.assertEqual([target for target, _ in self.seen],
+                         ["fallback", "fallback"])
+        self.assertEqual(middleware.stats()["delegated"], 1)
+
+    def test_invalid_rejected(self):
+        middleware = offline.OfflineTokenMiddleware(
+            self._app, self.keyset, fallback=self._fallback)
+        token = make_token(claims(exp=time.time() - 10))
+        middleware({"HTTP_X_AUTH_TOKEN": token,
+                    "HTTP_X_USER_ID": "forged"}, None)
+        target, environ = self.seen[0]
+        self.assertEqual(target, "app")
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        self.assertNotIn("HTTP_X_USER_ID", environ)
+        self.assertEqual(middleware.stats()["rejected"], 1)
+
+    def test_malformed_claims_rejected(self):
+        middleware = offline.OfflineTokenMiddleware(
+            self._app, self.keyset, fallback=self._fallback)
+        for values in (claims(nbf="soon"), claims(roles=[1, 2])):
+            middleware({"HTTP_X_AUTH_TOKEN": make_token(values)}, None)
+        for target, environ in self.seen:
+            self.assertEqual(target, "app")
+            self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        self.assertEqual(middleware.stats()["rejected"], 2)
+
+    def test_without_fallback(self):
+        middleware = offline.OfflineTokenMiddleware(self._app, self.keyset)
+        middleware({"HTTP_X_AUTH_TOKEN": "a-fernet-token"}, None)
+        middleware({}, None)
+        for target, environ in self.seen:
+            self.assertEqual(target, "app")
+            self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
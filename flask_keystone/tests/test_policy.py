@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for policy.Policy.
+"""
+
+from unittest import TestCase
+
+from flask_keystone.policy import parse_rule, Policy
+
+
+CREDENTIALS = {
+    "user_id": "auser",
+    "project_id": "atenant",
+    "roles": ["Member", "support_role_1"],
+}
+
+
+class TestParseRule(TestCase):
+
+    def test_precedence(self):
+        self.assertEqual(
+            parse_rule("role:a or not role:b and (rule:c)"),
+            ("or", [("role", "a"),
+                    ("and", [("not", ("role", "b")), ("rule", "c")])])
+        )
+
+    def test_target_reference(self):
+        self.assertEqual(parse_rule("(project_id:%(project_id)s)"),
+                         ("generic", "project_id", "%(project_id)s"))
+
+    def test_constants(self):
+        self.assertEqual(parse_rule(""), ("true",))
+        self.assertEqual(parse_rule("@"), ("true",))
+        self.assertEqual(parse_rule("!"), ("false",))
+
+    def test_list_syntax(self):
+        self.assertEqual(
+            parse_rule([["role:a", "role:b"], ["rule:c"]]),
+            ("or", [("and", [("role", "a"), ("role", "b")]),
+                    ("rule", "c")])
+        )
+
+    def test_invalid_rules(self):
+        for rule in ["role:a and", "(role:a", "role:a)", "admin"]:
+            self.assertRaises(ValueError, parse_rule, rule)
+
+
+class TestPolicy(TestCase):
+
+    def setUp(self):
+        self.policy = Policy({
+            "default": "role:admin",
+            "member": "role:member",
+            "owner": "project_id:%(project_id)s",
+            "support_or_admin": "role:support_role_1 or role:admin",
+            "member_owner": "rule:member and rule:owner",
+            "literal": "'atenant':%(project_id)s",
+            "broken": "role:member and",
+            "loop": "rule:loop or rule:member_owner and rule:loop",
+        })
+
+    def enforce(self, rule, target=None, cache=None):
+        return self.policy.enforce(rule, CREDENTIALS, target, cache)
+
+    def test_roles_are_case_insensitive(self):
+        self.assertTrue(self.enforce("member"))
+        self.assertTrue(self.enforce("support_or_admin"))
+
+    def test_target(self):
+        self.assertTrue(self.enforce("owner", {"project_id": "atenant"}))
+        self.assertFalse(self.enforce("owner", {"project_id": "other"}))
+        self.assertFalse(self.enforce("owner"),
+                         "missing target attributes should not match.")
+        self.assertTrue(self.enforce("literal", {"project_id": "atenant"}))
+
+    def test_rule_references(self):
+        self.assertTrue(self.enforce("member_owner",
+                                     {"project_id": "atenant"}))
+        self.assertFalse(self.enforce("loop", {"project_id": "atenant"}))
+
+    def test_default_rule(self):
+        self.assertFalse(self.enforce("undefined"))
+        self.assertFalse(Policy({}).enforce("undefined", CREDENTIALS))
+
+    def test_broken_rule_is_denied(self):
+        self.assertFalse(self.enforce("broken"))
+
+    def test_cache(self):
+        cache = {}
+        target = {"project_id": "atenant"}
+        self.assertTrue(self.enforce("member_owner", target, cache))
+        self.assertEqual(cache[(("project_id", "atenant"),)],
+                         {"member_owner": True, "member": True,
+                          "owner": True})
+        self.policy.rules["member_owner"] = None
+        self.assertTrue(self.enforce("member_owner", target, cache),
+                        "cached results should be reused.")
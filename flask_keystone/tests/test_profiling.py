@@ -0,0 +1,99 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for profiling.RequestProfiler.
+"""
+
+from unittest import TestCase
+
+from flask_keystone.profiling import ALLOWED_KEY, RequestProfiler
+
+
+def _app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"ok"]
+
+
+def _call(app, **environ):
+    environ.setdefault("REQUEST_METHOD", "GET")
+    environ.setdefault("PATH_INFO", "/")
+    return b"".join(app(environ, lambda status, headers, exc_info=None: None))
+
+
+class TestRequestProfiler(TestCase):
+
+    def test_sampled(self):
+        profiler = RequestProfiler(sample_rate=1.0, capacity=2)
+        app = profiler.wrap(_app)
+        for _ in range(3):
+            self.assertEqual(_call(app), b"ok")
+
+        profiles = profiler.profiles()
+        self.assertEqual([profile.profile_id for profile in profiles], [2, 3])
+        self.assertEqual(profiles[0].trigger, "sampled")
+        self.assertEqual(profiles[0].status, 200)
+        self.assertEqual(profiler.stats()["profiled"], 3)
+        self.assertEqual(profiler.stats()["buffered"], 2)
+        self.assertIsNone(profiler.get(1))
+
+    def test_not_sampled(self):
+        profiler = RequestProfiler()
+        _call(profiler.wrap(_app))
+        self.assertEqual(profiler.profiles(), [])
+
+    def test_requested(self):
+        profiler = RequestProfiler()
+        app = profiler.wrap_validated(_app)
+        _call(app, HTTP_X_FLASK_KEYSTONE_PROFILE="1",
+              HTTP_X_IDENTITY_STATUS="Confirmed")
+        _call(app, HTTP_X_FLASK_KEYSTONE_PROFILE="1",
+              HTTP_X_IDENTITY_STATUS="Confirmed", **{ALLOWED_KEY: True})
+
+        self.assertEqual(profiler.stats()["discarded"], 1)
+        self.assertEqual(len(profiler.profiles()), 1)
+        self.assertEqual(profiler.profiles()[0].trigger, "requested")
+
+    def test_requested_without_credentials(self):
+        profiler = RequestProfiler()
+        app = profiler.wrap_validated(_app)
+        self.assertEqual(_call(app, HTTP_X_FLASK_KEYSTONE_PROFILE="1"),
+                         b"ok")
+        self.assertEqual(_call(app, HTTP_X_FLASK_KEYSTONE_PROFILE="1",
+                               HTTP_X_AUTH_TOKEN="garbage",
+                               HTTP_X_IDENTITY_STATUS="Invalid"), b"ok")
+        self.assertEqual(profiler.stats(), {
+            "profiled": 0, "discarded": 0, "busy": 0, "buffered": 0})
+
+    def test_requested_while_sampled(self):
+        profiler = RequestProfiler(sample_rate=1.0)
+        app = profiler.wrap(profiler.wrap_validated(_app))
+        _call(app, HTTP_X_FLASK_KEYSTONE_PROFILE="1",
+              HTTP_X_IDENTITY_STATUS="Confirmed")
+        self.assertEqual(profiler.stats()["profiled"], 1)
+        self.assertEqual(profiler.stats()["busy"], 0)
+        self.assertEqual(profiler.profiles()[0].trigger, "sampled")
+
+    def test_one_profile_at_a_time(self):
+        profiler = RequestProfiler(sample_rate=1.0)
+        profiler._active.acquire()
+        self.assertEqual(_call(profiler.wrap(_app)), b"ok")
+        self.assertEqual(profiler.stats()["busy"], 1)
+
+    def test_render(self):
+        profiler = RequestProfiler(sample_rate=1.0)
+        _call(profiler.wrap(_app))
+        profile = profiler.profiles()[0]
+        self.assertIn("_app", profile.render(limit=5))
+        self.assertIn("_app", profile.render(sort="tottime"))
+        self.assertRaises(ValueError, profile.render, sort="name; rm")
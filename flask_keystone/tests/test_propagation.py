@@ -0,0 +1,157 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for propagation.IdentityClient.
+"""
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from unittest import TestCase
+
+from flask import Flask
+
+from flask_keystone.http_pool import HTTPPool
+from flask_keystone.propagation import IdentityClient
+from flask_keystone.trusted import sign_headers
+
+
+IDENTITY_ENVIRON = {
+    "HTTP_X_AUTH_TOKEN": "user-token",
+    "HTTP_X_IDENTITY_STATUS": "Confirmed",
+    "HTTP_X_USER_ID": "auser",
+    "HTTP_X_ROLES": "admin_role_1",
+    "HTTP_X_SERVICE_CATALOG": "[]",
+}
+
+
+# NOTE: http.server.ThreadingHTTPServer only exists on Python 3.7 and later.
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        body = json.dumps(dict(self.headers.items())).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIdentityClient(TestCase):
+
+    def setUp(self):
+        self.server = _Server(("127.0.0.1", 0), _Handler)
+        self.server.connections = set()
+        self.url = "http://127.0.0.1:%d/servers" % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.app = Flask("test_app")
+
+    def _context(self, environ=IDENTITY_ENVIRON):
+        return self.app.test_request_context(environ_base=dict(environ))
+
+    def test_token_forwarded(self):
+        client = IdentityClient(HTTPPool())
+        with self._context():
+            headers = client.get(self.url).json()
+
+        self.assertEqual(headers["X-Auth-Token"], "user-token")
+        self.assertNotIn("X-User-Id", headers)
+        self.assertNotIn("X-Identity-Signature", headers)
+        self.assertEqual(client.stats()["forwarded"], 1)
+        self.assertEqual(client.stats()["signed"], 0)
+
+    def test_connections_are_reused(self):
+        client = IdentityClient(HTTPPool())
+        for _ in range(3):
+            with self._context():
+                client.get(self.url)
+
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(client.stats()["requests"], 3)
+        self.assertEqual(client.stats()["connections"], 1)
+
+    def test_signed_identity(self):
+        client = IdentityClient(HTTPPool(), signing_key="secret")
+        with self._context():
+            headers = client.get(self.url).json()
+
+        self.assertEqual(headers["X-User-Id"], "auser")
+        self.assertEqual(headers["X-Roles"], "admin_role_1")
+        self.assertNotIn("X-Service-Catalog", headers)
+        timestamp = headers["X-Identity-Signature"].split(":")[0]
+        self.assertEqual(headers["X-Identity-Signature"],
+                         sign_headers("secret", headers, "GET", "/servers",
+                                      int(timestamp)))
+        self.assertEqual(client.stats()["signed"], 1)
+
+    def test_signed_per_call(self):
+        client = IdentityClient(HTTPPool(), signing_key="secret")
+        with self._context():
+            headers = client.get(self.url + "/a%20b?limit=1").json()
+
+        timestamp = headers["X-Identity-Signature"].split(":")[0]
+        self.assertEqual(headers["X-Identity-Signature"],
+                         sign_headers("secret", headers, "GET",
+                                      "/servers/a b", int(timestamp)))
+
+    def test_headers_built_once_per_request(self):
+        service_token = mock.Mock(return_value="service-token")
+        client = IdentityClient(HTTPPool(), service_token=service_token)
+        with self._context():
+            for _ in range(3):
+                headers = client.get(self.url).json()
+
+        self.assertEqual(headers["X-Service-Token"], "service-token")
+        self.assertEqual(service_token.call_count, 1)
+
+    def test_given_headers_take_precedence(self):
+        client = IdentityClient(HTTPPool())
+        with self._context():
+            headers = client.get(self.url, headers={
+                "X-Auth-Token": "other-token"}).json()
+
+        self.assertEqual(headers["X-Auth-Token"], "other-token")
+
+    def test_outside_request(self):
+        client = IdentityClient(HTTPPool(), signing_key="secret")
+        headers = client.get(self.url).json()
+
+        self.assertNotIn("X-Auth-Token", headers)
+        self.assertNotIn("X-Identity-Signature", headers)
+        self.assertEqual(client.stats()["forwarded"], 0)
+
+    def test_timeout(self):
+        pool = HTTPPool()
+        client = IdentityClient(pool, timeout=2.5)
+        with mock.patch.object(pool.session, "request") as request:
+            client.get(self.url)
+            client.get(self.url, timeout=1)
+
+        self.assertEqual(request.call_args_list[0][1]["timeout"], 2.5)
+        self.assertEqual(request.call_args_list[1][1]["timeout"], 1)
@@ -0,0 +1,107 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for ratelimit.TokenBucket and ratelimit.RateLimiter.
+"""
+
+from unittest import mock
+from unittest import TestCase
+
+from flask_keystone.ratelimit import RateLimiter, TokenBucket
+
+
+class FakeUser(object):
+    """Minimal stand-in for a generated User class."""
+
+    def __init__(self, user_id, project_id="123456", roles=()):
+        self.user_id = user_id
+        self.project_id = project_id
+        self.configured_roles = set(roles)
+
+    def has_role(self, role):
+        return role in self.configured_roles
+
+
+class TestTokenBucket(TestCase):
+
+    def test_consume_until_empty(self):
+        bucket = TokenBucket(rate=1, capacity=2, now=0)
+        self.assertTrue(bucket.consume(0), "first token should be available.")
+        self.assertTrue(bucket.consume(0), "second token should be available.")
+        self.assertFalse(bucket.consume(0), "bucket should be empty.")
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=2, capacity=2, now=0)
+        bucket.consume(0)
+        bucket.consume(0)
+        self.assertTrue(bucket.consume(0.5),
+                        "bucket should refill at 2 tokens per second.")
+        self.assertFalse(bucket.consume(0.5), "bucket should be empty.")
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=10, capacity=1, now=0)
+        self.assertTrue(bucket.consume(100))
+        self.assertFalse(bucket.consume(100),
+                         "bucket should never exceed its capacity.")
+
+
+class TestRateLimiter(TestCase):
+
+    def setUp(self):
+        self.clock = mock.patch("flask_keystone.ratelimit.time.monotonic",
+                                return_value=0)
+        self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def test_limits_each_identity_separately(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.allow(FakeUser("alice")))
+        self.assertFalse(limiter.allow(FakeUser("alice")),
+                         "alice should have exhausted her quota.")
+        self.assertTrue(limiter.allow(FakeUser("bob")),
+                        "bob should not share alice's bucket.")
+
+    def test_keyed_on_project(self):
+        limiter = RateLimiter(rate=1, burst=1, key="project_id")
+        self.assertTrue(limiter.allow(FakeUser("alice")))
+        self.assertFalse(limiter.allow(FakeUser("bob")),
+                         "alice and bob share a project quota.")
+
+    def test_project_quota_follows_roles(self):
+        limiter = RateLimiter(rate=1, burst=1, key="project_id",
+                              role_quotas={"admin": "5"})
+        self.assertTrue(limiter.allow(FakeUser("alice")))
+        admin = FakeUser("admin", roles=["admin"])
+        allowed = [limiter.allow(admin) for _ in range(6)]
+        self.assertEqual(allowed.count(True), 5,
+                         "admin should not get alice's quota.")
+        self.assertFalse(limiter.allow(FakeUser("bob")),
+                         "bob should share alice's bucket.")
+
+    def test_role_quota(self):
+        limiter = RateLimiter(rate=1, burst=1,
+                              role_quotas={"admin": "5", "support": "2"})
+        admin = FakeUser("admin", roles=["support", "admin"])
+        allowed = [limiter.allow(admin) for _ in range(6)]
+        self.assertEqual(allowed.count(True), 5,
+                         "admin should receive the most generous quota.")
+
+    def test_eviction(self):
+        limiter = RateLimiter(rate=1, burst=1, shards=1, max_keys=1)
+        self.assertTrue(limiter.allow(FakeUser("alice")))
+        self.assertTrue(limiter.allow(FakeUser("bob")))
+        self.assertTrue(limiter.allow(FakeUser("alice")),
+                        "alice's bucket should have been evicted.")
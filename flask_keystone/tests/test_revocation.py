@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for the revocation module.
+"""
+
+import datetime
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from keystoneauth1 import access
+from keystoneauth1 import fixture as ksa_fixture
+
+from flask_keystone.revocation import (KeystoneRevocationFeed,
+                                       LocalRevocationFeed, RevocationEvent,
+                                       RevocationIndex, RevocationPoller)
+from flask_keystone.token_cache import TokenCache
+
+
+def make_token(user_id="auser", project_id="aproject", **kwargs):
+    return ksa_fixture.V3Token(user_id=user_id, project_id=project_id,
+                               **kwargs)
+
+
+class TestRevocationEvent(TestCase):
+
+    def test_matches_every_field(self):
+        token = access.create(body=make_token())
+        event = RevocationEvent.from_dict({"user_id": "auser",
+                                           "project_id": "aproject"})
+        self.assertTrue(event.matches(token))
+        event = RevocationEvent.from_dict({"user_id": "auser",
+                                           "project_id": "other"})
+        self.assertFalse(event.matches(token))
+
+    def test_audit_id(self):
+        token = access.create(body=make_token())
+        event = RevocationEvent.from_dict({"audit_id": token.audit_id})
+        self.assertTrue(event.matches(token))
+        event = RevocationEvent.from_dict({"audit_chain_id": "other"})
+        self.assertFalse(event.matches(token))
+
+    def test_tokens_issued_later_are_not_revoked(self):
+        token = access.create(body=make_token())
+        before = token.issued - datetime.timedelta(seconds=1)
+        event = RevocationEvent.from_dict({
+            "user_id": "auser",
+            "issued_before": before.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        })
+        self.assertFalse(event.matches(token))
+
+    def test_unknown_fields_match(self):
+        token = access.create(body=make_token())
+        event = RevocationEvent.from_dict({"consumer_id": "aconsumer"})
+        self.assertTrue(event.matches(token))
+
+
+class TestRevocationIndex(TestCase):
+
+    def test_matches(self):
+        index = RevocationIndex()
+        added = index.add([RevocationEvent({"user_id": "auser"}),
+                           RevocationEvent({"user_id": "auser"})])
+        self.assertEqual(len(added), 1, "duplicates should be ignored.")
+        self.assertTrue(index.matches(access.create(body=make_token())))
+        self.assertFalse(index.matches(access.create(
+            body=make_token(user_id="other"))))
+        self.assertFalse(index.matches(None))
+
+    def test_prune(self):
+        index = RevocationIndex(retention=60)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        index.add([
+            RevocationEvent({"user_id": "old"},
+                            revoked_at=now - datetime.timedelta(minutes=5)),
+            RevocationEvent({"user_id": "new"}, revoked_at=now),
+        ])
+        self.assertEqual(index.prune(now), 1)
+        self.assertEqual(len(index), 1)
+        self.assertTrue(index.matches(access.create(
+            body=make_token(user_id="new"))))
+
+
+class TestRevocationPoller(TestCase):
+
+    def setUp(self):
+        self.cache = TokenCache()
+        self.cache.set("a", make_token(user_id="a"))
+        self.cache.set("b", make_token(user_id="b", project_id="shared"))
+        self.cache.set("c", make_token(user_id="c", project_id="shared"))
+        self.feed = LocalRevocationFeed()
+        self.poller = RevocationPoller(self.feed, self.cache)
+        self.addCleanup(self.poller.stop)
+
+    def test_poll_invalidates_matching_tokens(self):
+        self.feed.revoke(project_id="shared")
+        self.assertEqual(self.poller.poll(), 2)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNone(self.cache.get("c"))
+
+        self.assertEqual(self.poller.poll(), 0,
+                         "events should only be applied once.")
+        self.assertEqual(self.poller.stats(), {
+            "polls": 2, "failed": 0, "events": 1, "invalidated": 2,
+        })
+
+    def test_push(self):
+        self.assertEqual(self.poller.push([{"user_id": "a"}]), 1)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertTrue(self.poller.is_revoked(
+            access.create(body=make_token(user_id="a"))))
+
+    def test_background_poll(self):
+        self.poller.interval = 0.01
+        self.feed.revoke(user_id="a")
+        self.poller.start()
+        thread = self.poller._thread
+        self.poller.start()
+        self.assertIs(self.poller._thread, thread,
+                      "only one thread should be started per process.")
+        for _ in range(500):
+            if self.cache.get("a") is None:
+                break
+            threading.Event().wait(0.01)
+        self.poller.stop()
+        self.assertIsNone(self.cache.get("a"))
+
+
+class TestKeystoneRevocationFeed(TestCase):
+
+    def test_events(self):
+        adapter = mock.Mock()
+        adapter.get.return_value.json.return_value = {
+            "events": [{"user_id": "auser"}]
+        }
+        feed = KeystoneRevocationFeed(adapter)
+        since = datetime.datetime(2020, 1, 2, 3, 4, 5,
+                                  tzinfo=datetime.timezone.utc)
+        self.assertEqual(feed.events(since), [{"user_id": "auser"}])
+        adapter.get.assert_called_once_with(
+            "/OS-REVOKE/events",
+            params={"since": "2020-01-02T03:04:05.000000Z"},
+            endpoint_filter={"version": (3, 0)},
+            authenticated=True
+        )
@@ -0,0 +1,197 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for roles.RoleMap and roles.RoleExpression.
+"""
+
+from unittest import mock
+from unittest import TestCase
+
+from flask_keystone.roles import (is_expression, is_pattern, parse_roles,
+                                  RoleExpression, RoleMap)
+
+
+class TestRoleMap(TestCase):
+
+    def setUp(self):
+        self.role_map = RoleMap({
+            "admin": ["admin_role_1", "shared_role"],
+            "billing": ["billing_role_1"],
+            "support": ["support_role_1", "shared_role"],
+        })
+
+    def test_mask_for(self):
+        mask = self.role_map.mask_for(["shared_role", "unknown_role"])
+        self.assertEqual(self.role_map.roles_for(mask),
+                         frozenset(["admin", "support"]))
+        self.assertEqual(self.role_map.mask_for([]), 0)
+
+    def test_expression_is_cached(self):
+        self.assertIs(self.role_map.expression("admin or support"),
+                      self.role_map.expression("admin or support"))
+
+    def test_evaluate(self):
+        cases = [
+            ("admin", ["admin_role_1"], True),
+            ("admin and support", ["admin_role_1"], False),
+            ("admin and support", ["shared_role"], True),
+            ("admin && !billing", ["admin_role_1"], True),
+            ("admin and not billing", ["admin_role_1", "billing_role_1"],
+             False),
+            ("billing or (admin and support)", ["shared_role"], True),
+            ("billing | (admin & support)", ["admin_role_1"], False),
+            ("not (admin or support)", ["billing_role_1"], True),
+        ]
+        for source, keystone_roles, expected in cases:
+            mask = self.role_map.mask_for(keystone_roles)
+            result = self.role_map.expression(source).evaluate(
+                self.role_map, mask)
+            self.assertEqual(result, expected,
+                             "%s with %s" % (source, keystone_roles))
+
+    def test_unconfigured_roles_never_match(self):
+        mask = self.role_map.mask_for(["admin_role_1"])
+        for source, expected in [("unconfigured", False),
+                                 ("admin and unconfigured", False),
+                                 ("admin or unconfigured", True),
+                                 ("not unconfigured", False),
+                                 ("admin and not unconfigured", False),
+                                 ("admin or not unconfigured", False),
+                                 ("admin and not support", True)]:
+            expression = RoleExpression(source)
+            self.assertEqual(expression.evaluate(self.role_map, mask),
+                             expected, source)
+
+
+class TestParseRoles(TestCase):
+
+    def test_parse_roles(self):
+        self.assertEqual(parse_roles("a, b,,a ,\tc"),
+                         frozenset(["a", "b", "c"]))
+        self.assertEqual(parse_roles(""), frozenset())
+        self.assertEqual(parse_roles(" , "), frozenset())
+
+    def test_vocabulary(self):
+        name = "".join(["known_", "role"])
+        roles = parse_roles("known_role,other_role", {name: name})
+        self.assertIs([role for role in roles if role == name][0], name)
+
+    def test_large_headers(self):
+        header = ",".join("role_%d" % (i % 500) for i in range(1000))
+        self.assertEqual(len(parse_roles(header)), 500)
+
+
+class TestRolePatterns(TestCase):
+
+    def setUp(self):
+        self.role_map = RoleMap({
+            "admin": ["admin_role_1", "ticketing:admin:*"],
+            "managed": ["rax_managed:*"],
+            "support": ["ticketing:*:support", "support_role_?"],
+        })
+
+    def test_is_pattern(self):
+        self.assertTrue(is_pattern("rax_managed:*"))
+        self.assertTrue(is_pattern("role_[ab]"))
+        self.assertFalse(is_pattern("rax_managed:admin"))
+
+    def test_prefix(self):
+        roles_for = self.role_map.roles_for
+        mask_for = self.role_map.mask_for
+        self.assertEqual(roles_for(mask_for(["rax_managed:ops"])),
+                         frozenset(["managed"]))
+        self.assertEqual(roles_for(mask_for(["ticketing:admin:eu"])),
+                         frozenset(["admin"]))
+        self.assertEqual(mask_for(["rax_managed"]), 0)
+        self.assertEqual(mask_for(["RAX_MANAGED:ops"]), 0)
+
+    def test_glob(self):
+        roles_for = self.role_map.roles_for
+        mask_for = self.role_map.mask_for
+        self.assertEqual(roles_for(mask_for(["ticketing:eu:support"])),
+                         frozenset(["support"]))
+        self.assertEqual(roles_for(mask_for(["support_role_1"])),
+                         frozenset(["support"]))
+        self.assertEqual(mask_for(["support_role_10"]), 0)
+        self.assertEqual(
+            roles_for(mask_for(["admin_role_1", "ticketing:x:support"])),
+            frozenset(["admin", "support"])
+        )
+
+    def test_exact_names_still_match(self):
+        self.assertTrue(self.role_map.mask_for(["admin_role_1"]))
+
+    def test_lookup(self):
+        header = "admin_role_1, rax_managed:a,unknown"
+        roles, mask = self.role_map.lookup(header)
+        self.assertEqual(roles, frozenset(["admin_role_1", "rax_managed:a",
+                                           "unknown"]))
+        self.assertEqual(self.role_map.roles_for(mask),
+                         frozenset(["admin", "managed"]))
+        self.assertIs(self.role_map.lookup(header)[0], roles)
+        configured = [role for role in roles if role == "admin_role_1"][0]
+        self.assertIs(configured, self.role_map.vocabulary["admin_role_1"])
+
+    def test_mask_for_header_is_memoized(self):
+        with mock.patch.object(self.role_map, "mask_for",
+                               wraps=self.role_map.mask_for) as mask_for:
+            first = self.role_map.mask_for_header("rax_managed:a,other")
+            second = self.role_map.mask_for_header("rax_managed:a,other")
+        self.assertEqual(first, second)
+        self.assertEqual(first, self.role_map.bits["managed"])
+        self.assertEqual(mask_for.call_count, 1)
+
+    def test_lookup_evicts_least_recently_used(self):
+        with mock.patch("flask_keystone.roles._MAX_CACHED_HEADERS", 2):
+            roles = self.role_map.lookup("admin_role_1")[0]
+            self.role_map.lookup("role_a")
+            self.role_map.lookup("admin_role_1")
+            self.role_map.lookup("role_b")
+        self.assertEqual(list(self.role_map._headers),
+                         ["admin_role_1", "role_b"])
+        self.assertIs(self.role_map.lookup("admin_role_1")[0], roles)
+
+    def test_many_patterns(self):
+        role_map = RoleMap({
+            "role_%d" % i: ["family_%d:*" % i, "glob_%d:*:x" % i]
+            for i in range(300)
+        })
+        mask = role_map.mask_for(["family_7:a", "glob_250:b:x"])
+        self.assertEqual(role_map.roles_for(mask),
+                         frozenset(["role_7", "role_250"]))
+
+
+class TestRoleExpression(TestCase):
+
+    def test_is_expression(self):
+        self.assertFalse(is_expression("admin"))
+        self.assertTrue(is_expression("admin or support"))
+        self.assertTrue(is_expression("!admin"))
+
+    def test_roles(self):
+        expression = RoleExpression("admin or (support and not billing)")
+        self.assertEqual(expression.roles,
+                         frozenset(["admin", "support", "billing"]))
+
+    def test_any_of(self):
+        expression = RoleExpression.any_of(["admin", "support and billing"])
+        self.assertEqual(expression.tree, (
+            "or", [("name", "admin"),
+                   ("and", [("name", "support"), ("name", "billing")])]
+        ))
+
+    def test_invalid_expressions(self):
+        for source in ["", "admin and", "(admin", "admin)", "admin support",
+                       "or admin"]:
+            self.assertRaises(ValueError, RoleExpression, source)
@@ -0,0 +1,30 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for the role handling benchmark.
+"""
+
+from testtools import TestCase
+
+from flask_keystone.benchmarks import roles
+
+
+class TestRolesBenchmark(TestCase):
+
+    def test_run(self):
+        results = roles.run(requests=5)
+        self.assertEqual(sorted(results), list(roles.SIZES))
+        for figures in results.values():
+            self.assertEqual(sorted(figures),
+                             ["has_role", "keystone_role", "parse", "user"])
@@ -0,0 +1,128 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for snapshot.IdentitySnapshot.
+"""
+
+import pickle
+
+from unittest import mock
+from unittest import TestCase
+
+from flask_keystone.anonymous import AnonymousBase
+from flask_keystone.snapshot import IdentitySnapshot
+from flask_keystone.tests.test_fixtures.request import build_mock_request
+from flask_keystone.user import UserBase
+
+
+class TestIdentitySnapshot(TestCase):
+
+    def setUp(self):
+        roles = {
+            "admin": set(["admin_role_1"]),
+            "billing": set(["billing_role_1"]),
+            "support": set(["support_role_1"]),
+        }
+
+        class User(UserBase):
+            pass
+
+        User.generate_has_role_function(roles)
+        User.generate_is_role_functions(roles)
+        self.user = User(build_mock_request(headers=[
+            ("X-Identity-Status", "Confirmed"),
+            ("X-User-Id", "auser"),
+            ("X-Project-Id", "123456"),
+            ("X-Project-Domain-Id", "default"),
+            ("X-Auth-Token", "secret-token"),
+            ("X-Roles", "admin_role_1,support_role_1,Member"),
+        ]))
+
+    def test_from_user(self):
+        snapshot = self.user.snapshot()
+        self.assertIsInstance(snapshot, IdentitySnapshot)
+        self.assertEqual(snapshot.user_id, "auser")
+        self.assertEqual(snapshot.project_id, "123456")
+        self.assertEqual(snapshot.granted, frozenset(["admin", "support"]))
+        self.assertEqual(snapshot.roles, frozenset(
+            ["admin_role_1", "support_role_1", "Member"]))
+        self.assertFalse(snapshot.anonymous)
+        self.assertNotIn("secret-token", snapshot,
+                         "tokens should not be part of a snapshot.")
+
+    def test_roles(self):
+        snapshot = self.user.snapshot()
+        self.assertTrue(snapshot.has_role("admin"))
+        self.assertFalse(snapshot.has_role("billing"))
+        self.assertFalse(snapshot.has_role("unconfigured"))
+        self.assertTrue(snapshot.is_support())
+        self.assertFalse(snapshot.is_billing())
+        self.assertRaises(AttributeError, getattr, snapshot,
+                          "is_unconfigured")
+        self.assertTrue(snapshot._has_keystone_role("Member"))
+
+    def test_role_expressions(self):
+        snapshot = self.user.snapshot()
+        for source in ("admin and support", "billing or admin",
+                       "not billing", "admin and not (billing or other)"):
+            self.assertEqual(snapshot.has_role(source),
+                             self.user.has_role(source), source)
+        self.assertFalse(snapshot.has_role("admin and billing"))
+
+    def test_role_expressions_are_cached(self):
+        snapshot = self.user.snapshot()
+        snapshot.has_role("admin and not billing")
+        with mock.patch("flask_keystone.roles.RoleExpression") as parse:
+            self.assertTrue(snapshot.has_role("admin and not billing"))
+            self.assertTrue(pickle.loads(pickle.dumps(snapshot)).has_role(
+                "admin and not billing"))
+        parse.assert_not_called()
+
+    def test_scope(self):
+        snapshot = self.user.snapshot()
+        self.assertTrue(snapshot.in_project("123456"))
+        self.assertFalse(snapshot.in_project(None))
+        self.assertFalse(snapshot.in_domain("default"),
+                         "a project-scoped identity is not domain-scoped.")
+        domain_scoped = UserBase(build_mock_request(headers=[
+            ("X-User-Id", "auser"),
+            ("X-Domain-Id", "default"),
+        ])).snapshot()
+        self.assertTrue(domain_scoped.in_domain("default"))
+
+    def test_pickle(self):
+        snapshot = self.user.snapshot()
+        data = pickle.dumps(snapshot)
+        self.assertLess(len(data), 400)
+        restored = pickle.loads(data)
+        self.assertEqual(restored, snapshot)
+        self.assertTrue(restored.is_admin())
+
+    def test_immutable(self):
+        snapshot = self.user.snapshot()
+        self.assertRaises(AttributeError, setattr, snapshot, "user_id", "x")
+        self.assertRaises(AttributeError, setattr, snapshot, "other", "x")
+
+    def test_anonymous(self):
+        class Anonymous(AnonymousBase):
+            pass
+
+        Anonymous.generate_is_role_functions({"admin": set(["admin_role_1"])})
+        snapshot = Anonymous().snapshot()
+        self.assertTrue(snapshot.anonymous)
+        self.assertIsNone(snapshot.user_id)
+        self.assertFalse(snapshot.has_role("admin"))
+        self.assertFalse(snapshot.is_admin())
+        self.assertRaises(AttributeError, getattr, snapshot, "is_support")
+        self.assertFalse(pickle.loads(pickle.dumps(snapshot)).in_project(""))
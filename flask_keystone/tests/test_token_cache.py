@@ -0,0 +1,120 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for token_cache.TokenCache and token_cache.TokenRefresher.
+"""
+
+import datetime
+import threading
+
+from unittest import mock
+from unittest import TestCase
+
+from keystoneauth1 import fixture as ksa_fixture
+
+from flask_keystone.token_cache import TokenCache, TokenRefresher
+
+
+def make_token(lifetime=3600):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expires = now + datetime.timedelta(seconds=lifetime)
+    return ksa_fixture.v2.Token(user_id="auser", tenant_id="atenant",
+                                expires=expires)
+
+
+class TestTokenCache(TestCase):
+
+    def setUp(self):
+        self.clock = mock.patch("flask_keystone.token_cache.time.monotonic",
+                                return_value=1000.0)
+        self.now = self.clock.start()
+
+    def tearDown(self):
+        self.clock.stop()
+
+    def test_entries_expire(self):
+        cache = TokenCache(ttl=300, refresh_window=30)
+        cache.set("token", make_token())
+        self.assertIsNotNone(cache.get("token"))
+        self.now.return_value = 1300.0
+        self.assertIsNone(cache.get("token"), "entry should have expired.")
+        self.assertEqual(len(cache), 0)
+
+    def test_refresh_due(self):
+        cache = TokenCache(ttl=300, refresh_window=30)
+        entry = cache.set("token", make_token())
+        self.assertFalse(entry.refresh_due(1269.0))
+        self.assertTrue(entry.refresh_due(1270.0))
+
+    def test_entries_never_outlive_their_token(self):
+        cache = TokenCache(ttl=300, refresh_window=30)
+        entry = cache.set("token", make_token(lifetime=60))
+        self.assertLessEqual(entry.expires, 1060.0)
+        self.assertIsNone(entry.refresh_at,
+                          "expiring tokens should never be refreshed.")
+
+    def test_stale_entries(self):
+        cache = TokenCache(ttl=300, stale_grace=600)
+        cache.set("token", make_token())
+        self.now.return_value = 1500.0
+        self.assertIsNone(cache.get("token"))
+        self.assertIsNotNone(cache.get("token", stale=True))
+        self.now.return_value = 1900.0
+        self.assertIsNone(cache.get("token", stale=True))
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_entries_never_outlive_their_token(self):
+        cache = TokenCache(ttl=300, stale_grace=600)
+        entry = cache.set("token", make_token(lifetime=400))
+        self.assertEqual(entry.expires, 1300.0)
+        self.assertLessEqual(entry.stale_until, 1400.0)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = TokenCache(max_size=2)
+        cache.set("a", make_token())
+        cache.set("b", make_token())
+        cache.get("a")
+        cache.set("c", make_token())
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+
+class TestTokenRefresher(TestCase):
+
+    def test_refreshes_once_at_a_time(self):
+        gate = threading.Event()
+        refresh = mock.Mock(side_effect=lambda token: gate.wait(5))
+        refresher = TokenRefresher(refresh, workers=1, rate=100)
+        self.addCleanup(refresher.shutdown)
+
+        self.assertTrue(refresher.schedule("token"))
+        self.assertFalse(refresher.schedule("token"),
+                         "a pending token should not be queued again.")
+        gate.set()
+        refresher.shutdown()
+        refresh.assert_called_once_with("token")
+        self.assertEqual(refresher.refreshed, 1)
+
+    def test_rate_is_capped(self):
+        refresher = TokenRefresher(mock.Mock(), rate=1)
+        self.addCleanup(refresher.shutdown)
+        self.assertTrue(refresher.schedule("a"))
+        self.assertFalse(refresher.schedule("b"))
+        self.assertEqual(refresher.skipped, 1)
+
+    def test_failures_are_counted(self):
+        refresher = TokenRefresher(mock.Mock(side_effect=ValueError()))
+        refresher.schedule("token")
+        refresher.shutdown()
+        self.assertEqual(refresher.failed, 1)
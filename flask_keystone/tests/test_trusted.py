@@ -0,0 +1,129 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for trusted.TrustedHeaderMiddleware.
+"""
+
+import time
+
+from unittest import TestCase
+
+from flask_keystone.trusted import sign_headers, TrustedHeaderMiddleware
+
+
+HEADERS = {
+    "X-Identity-Status": "Confirmed",
+    "X-User-Id": "auser",
+    "X-Project-Id": "aproject",
+    "X-Roles": "admin,member",
+}
+
+
+def environ_for(headers, method="GET", path="/servers"):
+    environ = dict(("HTTP_" + name.upper().replace("-", "_"), value)
+                   for name, value in headers.items())
+    environ["REQUEST_METHOD"] = method
+    environ["PATH_INFO"] = path
+    return environ
+
+
+class TestTrustedHeaderMiddleware(TestCase):
+
+    def setUp(self):
+        self.seen = []
+        self.middleware = TrustedHeaderMiddleware(self._app, "secret",
+                                                  max_age=60)
+
+    def _app(self, environ, start_response):
+        self.seen.append(environ)
+        return []
+
+    def _call(self, headers, method="GET", path="/servers"):
+        self.middleware(environ_for(headers, method, path), None)
+        return self.seen[-1]
+
+    def test_valid_signature(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("secret", headers,
+                                                       "GET", "/servers")
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Confirmed")
+        self.assertEqual(environ["HTTP_X_ROLES"], "admin,member")
+        self.assertNotIn("HTTP_X_IDENTITY_SIGNATURE", environ)
+        self.assertEqual(self.middleware.stats()["verified"], 1)
+
+    def test_tampered_header(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("secret", headers,
+                                                       "GET", "/servers")
+        headers["X-Roles"] = "admin,member,cloud_admin"
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        self.assertNotIn("HTTP_X_ROLES", environ)
+        self.assertNotIn("HTTP_X_USER_ID", environ)
+        self.assertEqual(self.middleware.stats()["rejected"], 1)
+
+    def test_added_header(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("secret", headers,
+                                                       "GET", "/servers")
+        headers["X-Is-Admin-Project"] = "True"
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+
+    def test_other_request(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("secret", headers,
+                                                       "GET", "/servers")
+        environ = self._call(headers, path="/servers/detail")
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        environ = self._call(headers, method="DELETE")
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        self.assertEqual(self.middleware.stats()["rejected"], 2)
+
+    def test_script_name(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("secret", headers,
+                                                       "GET", "/v2/servers")
+        environ = environ_for(headers)
+        environ["SCRIPT_NAME"] = "/v2"
+        self.middleware(environ, None)
+        self.assertEqual(self.seen[-1]["HTTP_X_IDENTITY_STATUS"], "Confirmed")
+
+    def test_wrong_key(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers("other", headers,
+                                                       "GET", "/servers")
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+
+    def test_expired_signature(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = sign_headers(
+            "secret", headers, "GET", "/servers",
+            timestamp=time.time() - 120)
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+
+    def test_malformed_signature(self):
+        headers = dict(HEADERS)
+        headers["X-Identity-Signature"] = "not-a-signature\xe9"
+        environ = self._call(headers)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+
+    def test_unsigned(self):
+        environ = self._call(HEADERS)
+        self.assertEqual(environ["HTTP_X_IDENTITY_STATUS"], "Invalid")
+        self.assertNotIn("HTTP_X_USER_ID", environ)
+        self.assertEqual(self.middleware.stats()["unsigned"], 1)
@@ -58,10 +58,48 @@ class TestUserBase(TestCase):
                          "user.user_id should be rtrox.")
         self.assertEqual(user.project_id, "123456",
                          "user.project_id should be '123456'.")
-        self.assertEqual(user.roles, [
+        self.assertEqual(user.roles, frozenset([
             "admin_role_1",
             "support_role_1"
-        ], "user.roles does contain the required roles.")
+        ]), "user.roles does contain the required roles.")
+
+    def test_roles_are_stripped_and_deduplicated(self):
+        request = build_mock_request(headers=[
+            ("X-Roles", " admin_role_1, support_role_1,,admin_role_1 ")
+        ])
+        user = UserBase(request)
+        self.assertEqual(user.roles, frozenset([
+            "admin_role_1",
+            "support_role_1"
+        ]))
+        self.assertTrue(user._has_keystone_role("admin_role_1"))
+        self.assertFalse(user._has_keystone_role(""))
+
+    def test_unlisted_headers(self):
+        request = build_mock_request(headers=[
+            ("X-Request-Id", "req-1"),
+            ("Accept", "application/json"),
+        ])
+        user = UserBase(request)
+        self.assertEqual(user.request_id, "req-1",
+                         "every X- header should become an attribute.")
+        self.assertFalse(hasattr(user, "accept"),
+                         "only X- headers should become attributes.")
+
+    def test_reserved_headers(self):
+        request = build_mock_request(headers=[
+            ("X-Role-Mask", "1"),
+            ("X-Has-Role", "admin"),
+            ("X-Roles", "admin_role_1"),
+        ])
+
+        class User(UserBase):
+            pass
+
+        User.generate_has_role_function(test_roles_dict())
+        user = User(request)
+        self.assertEqual(user.role_mask, user.role_map.mask_for(user.roles))
+        self.assertTrue(user.has_role("admin"))
 
     def test_transform_header(self):
         user = UserBase(self.request)
@@ -70,6 +108,20 @@ class TestUserBase(TestCase):
             "user_id",
             "Transforming 'X-User-Id' header should yield 'user_id'."
         )
+        self.assertEqual(user.transform_header("X-Max"), "max",
+                         "only the leading 'X-' should be removed.")
+        self.assertEqual(user.transform_header("X-Auth-X-"), "auth_x_")
+        self.assertEqual(user.transform_header("Xylophone"), "xylophone")
+
+    def test_attribute_names_are_reused(self):
+        request = build_mock_request(headers=[("X-Custom-Header", "a")])
+        first = UserBase(request)
+        second = UserBase(build_mock_request(
+            headers=[("X-Custom-Header", "b")]))
+        self.assertIs([name for name in vars(first)
+                       if name == "custom_header"][0],
+                      [name for name in vars(second)
+                       if name == "custom_header"][0])
 
     def test_has_keystone_role(self):
         user = UserBase(self.request)
@@ -80,6 +132,28 @@ class TestUserBase(TestCase):
         self.assertFalse(user._has_keystone_role("any_other_role"),
                          'user returned True for a non-existant role.')
 
+    def test_in_project(self):
+        user = UserBase(self.request)
+        self.assertTrue(user.in_project("123456"),
+                        "user should be scoped to project '123456'.")
+        self.assertFalse(user.in_project("654321"),
+                         "user should not be scoped to project '654321'.")
+        self.assertFalse(user.in_domain("default"),
+                         "user should not be scoped to any domain.")
+
+    def test_in_domain(self):
+        project_scoped = UserBase(build_mock_request(headers=[
+            ("X-Project-Id", "123456"),
+            ("X-Project-Domain-Id", "default"),
+        ]))
+        self.assertFalse(project_scoped.in_domain("default"),
+                         "a project-scoped user is not domain-scoped.")
+        domain_scoped = UserBase(build_mock_request(headers=[
+            ("X-Domain-Id", "default"),
+        ]))
+        self.assertTrue(domain_scoped.in_domain("default"))
+        self.assertFalse(domain_scoped.in_domain(None))
+
 
 class TestUserClassGenerator(TestCase):
     """
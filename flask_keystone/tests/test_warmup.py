@@ -0,0 +1,40 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test Cases for the pre-fork warmup benchmark.
+"""
+
+import os
+import unittest
+
+from oslo_config import fixture
+
+from testtools import TestCase
+
+from flask_keystone.benchmarks import warmup
+
+
+class TestWarmup(TestCase):
+
+    def setUp(self):
+        super(TestWarmup, self).setUp()
+        self.useFixture(fixture.Config())
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_run(self):
+        results = warmup.run(workers=1, requests=1)
+        self.assertEqual(sorted(results), ["cold", "warm"])
+        for figures in results.values():
+            self.assertIsNotNone(figures["first"],
+                                 "each worker should report its latency.")
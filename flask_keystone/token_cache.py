@@ -0,0 +1,345 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process cache of validated tokens, and their background refresh.
+
+:mod:`keystonemiddleware` caches the result of validating a token for
+`token_cache_time` seconds, after which the next request carrying the token
+pays for a synchronous round trip to Keystone. Long-lived service clients,
+which reuse a single token for hours, see this latency every few minutes.
+
+When `token_refresh_enabled` is set, validated tokens are also kept in a
+:class:`TokenCache`, which records when each entry expires. A request made
+within `token_refresh_window` seconds of its token's entry expiring is
+served from the cache as usual, while a :class:`TokenRefresher` revalidates
+the token in the background (stale-while-revalidate):
+
+.. code-block:: ini
+
+   [keystone_authtoken]
+   token_cache_time = 300
+
+   [flask_keystone]
+   token_refresh_enabled = True
+   token_refresh_window = 30
+   token_refresh_workers = 2
+   token_refresh_rate = 10
+
+Only tokens which are in use get refreshed, and entries never outlive the
+token itself: a token which is about to expire is left to expire. Refreshes
+are run by a small pool of threads, and at most `token_refresh_rate` of them
+are started per second; refreshes beyond that are skipped, and the token is
+validated synchronously once its entry has expired. Tokens are revalidated
+with the `keystone_authtoken` credentials of the service, which therefore
+need an `auth_type`.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from keystoneauth1 import access
+from oslo_log import log as logging
+
+from flask_keystone.ratelimit import TokenBucket
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _access(data):
+    """Parse token data, or return None if it cannot be."""
+    try:
+        return access.create(body=data)
+    except Exception:
+        return None
+
+
+def _lifetime(auth_ref):
+    if auth_ref is None or auth_ref.expires is None:
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return (auth_ref.expires - now).total_seconds()
+
+
+def token_lifetime(data):
+    """
+    Determine the number of seconds a token remains valid for.
+
+    :param dict data: Token data, as returned by Keystone.
+    :returns: Seconds until the token expires, or None if unknown.
+    :rtype: float
+    """
+    return _lifetime(_access(data))
+
+
+class CachedToken(object):
+    """
+    A validated token held by a :class:`TokenCache`.
+
+    :param dict data: Token data, as returned by Keystone.
+    :param float expires: Monotonic time at which the entry expires.
+    :param float refresh_at: Monotonic time after which the entry should be
+                             refreshed, or None if it should not be.
+    :param float stale_until: Monotonic time until which the expired entry
+                              may still be served while Keystone is
+                              unavailable. (default: `expires`)
+    :param access: The parsed token data, or None if it could not be
+                   parsed.
+    :type access: :class:`keystoneauth1.access.AccessInfo`
+    """
+
+    __slots__ = ("data", "expires", "refresh_at", "stale_until", "access")
+
+    def __init__(self, data, expires, refresh_at, stale_until=None,
+                 access=None):
+        self.data = data
+        self.access = access
+        self.expires = expires
+        self.refresh_at = refresh_at
+        self.stale_until = expires if stale_until is None else stale_until
+
+    def refresh_due(self, now):
+        """
+        Whether the entry should be refreshed.
+
+        :param float now: Current monotonic timestamp.
+        :rtype: bool
+        """
+        return self.refresh_at is not None and now >= self.refresh_at
+
+
+class TokenCache(object):
+    """
+    Bounded, least recently used cache of validated tokens.
+
+    :param int max_size: Maximum number of tokens held. (default: 10000)
+    :param float ttl: Seconds an entry is kept for. (default: 300)
+    :param float refresh_window: Seconds before an entry expires from which
+                                 it is due to be refreshed. (default: 0)
+    :param float stale_grace: Seconds after an entry expires during which
+                              it is kept, to be served if Keystone is
+                              unavailable. (default: 0)
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0, refresh_window=0.0,
+                 stale_grace=0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_window = refresh_window
+        self.stale_grace = stale_grace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token, stale=False):
+        """
+        Retrieve the entry of a token, if it has not expired.
+
+        :param str token: The token id.
+        :param bool stale: Also return an expired entry, if it is still
+                           within its stale grace period.
+        :rtype: :class:`CachedToken`
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if now >= entry.expires:
+                if now >= entry.stale_until:
+                    del self._entries[token]
+                    return None
+                if not stale:
+                    return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def set(self, token, data):
+        """
+        Cache the data of a validated token.
+
+        :param str token: The token id.
+        :param dict data: Token data, as returned by Keystone.
+        :returns: The new entry.
+        :rtype: :class:`CachedToken`
+
+        The entry expires after `ttl` seconds, or when the token itself
+        expires if that is sooner. Entries expiring with their token are
+        never due to be refreshed, and stale entries are never kept past
+        the token's expiry either.
+        """
+        now = time.monotonic()
+        expires = now + self.ttl
+        refresh_at = expires - self.refresh_window
+        stale_until = expires + self.stale_grace
+        auth_ref = _access(data)
+        lifetime = _lifetime(auth_ref)
+        if lifetime is not None:
+            if now + lifetime <= expires:
+                expires = now + lifetime
+                refresh_at = None
+            stale_until = min(stale_until, now + lifetime)
+        entry = CachedToken(data, expires, refresh_at, stale_until, auth_ref)
+        with self._lock:
+            self._entries[token] = entry
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, token):
+        """
+        Remove a token from the cache.
+
+        :param str token: The token id.
+        """
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_where(self, predicate):
+        """
+        Remove every token whose entry matches a predicate.
+
+        :param predicate: Function taking a :class:`CachedToken`, and
+                          returning whether to remove it.
+        :returns: The number of tokens removed.
+        :rtype: int
+        """
+        with self._lock:
+            tokens = [token for token, entry in self._entries.items()
+                      if predicate(entry)]
+            for token in tokens:
+                del self._entries[token]
+        return len(tokens)
+
+    def clear(self):
+        """Remove every token from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenRefresher(object):
+    """
+    Bounded pool revalidating tokens in the background.
+
+    :param refresh: Function revalidating a single token id.
+    :param int workers: Number of threads refreshing tokens. (default: 2)
+    :param float rate: Maximum number of refreshes started per second.
+                       (default: 10)
+    :param int max_pending: Maximum number of refreshes queued or running
+                            at once. (default: 100)
+
+    A token is only refreshed once at a time, however many requests find it
+    due. Threads are started on the first refresh, and the pool is replaced
+    if the process has forked since, so it is safe to create a
+    TokenRefresher before a pre-fork server spawns its workers.
+    """
+
+    def __init__(self, refresh, workers=2, rate=10.0, max_pending=100):
+        self.refresh = refresh
+        self.workers = workers
+        self.rate = rate
+        self.max_pending = max_pending
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._bucket = TokenBucket(rate, max(1.0, rate), time.monotonic())
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def schedule(self, token):
+        """
+        Queue a token to be refreshed, unless already queued or over rate.
+
+        :param str token: The token id.
+        :returns: Whether or not a refresh was queued.
+        :rtype: bool
+        """
+        with self._lock:
+            executor = self._get_executor()
+            if token in self._pending:
+                return False
+            full = len(self._pending) >= self.max_pending
+            if full or not self._bucket.consume(time.monotonic()):
+                self.skipped += 1
+                return False
+            self._pending.add(token)
+        executor.submit(self._run, token)
+        return True
+
+    def stats(self):
+        """
+        Report the outcome of refreshes so far.
+
+        :returns: Counts of tokens `refreshed`, refreshes which `failed`,
+                  refreshes `skipped` for being over rate, and refreshes
+                  currently `pending`.
+        :rtype: dict
+        """
+        return {
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "pending": len(self._pending),
+        }
+
+    def shutdown(self, wait=True):
+        """
+        Stop the refresh threads.
+
+        :param bool wait: Wait for queued refreshes to complete.
+        """
+        with self._lock:
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _get_executor(self):
+        """
+        Return the pool of the current process, creating it if needed.
+
+        Must be called with the lock held.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            # NOTE: the threads of a parent's pool did not survive the fork,
+            # nor will the refreshes it had pending.
+            self._pending.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._pid = pid
+        return self._executor
+
+    def _run(self, token):
+        """Refresh a token, recording the outcome."""
+        # NOTE: ThreadPoolExecutor only names its threads from Python 3.6.
+        threading.current_thread().name = "flask-keystone-refresh"
+        try:
+            self.refresh(token)
+        except Exception as e:
+            self.failed += 1
+            LOG.debug("Failed to refresh token: %s" % e)
+        else:
+            self.refreshed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(token)
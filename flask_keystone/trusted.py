@@ -0,0 +1,220 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Trusted identity headers, signed by an upstream hop.
+
+Services behind a gateway which already validates tokens, and load tests,
+gain nothing from validating every token again. With
+`trusted_headers_enabled`, the application is not wrapped in
+:mod:`keystonemiddleware` at all. Instead, the identity headers it would set
+(`X-Identity-Status`, `X-User-Id`, `X-Roles` and so on) are taken from the
+request, provided they are signed with a key shared with the upstream hop:
+
+.. code-block:: ini
+
+   [flask_keystone]
+   trusted_headers_enabled = True
+   trusted_headers_key = a-long-random-secret
+   trusted_headers_max_age = 300
+
+The upstream hop adds an `X-Identity-Signature` header, of the form
+`<timestamp>:<signature>`, where the signature is the hex encoded
+HMAC-SHA256 of the timestamp, the method and path of the request, and
+every identity header of the request, as computed by :func:`sign_headers`:
+
+.. code-block:: python
+
+   headers["X-Identity-Signature"] = sign_headers(key, headers, "GET",
+                                                  "/servers/detail")
+
+The path is the one the service sees (`SCRIPT_NAME` and `PATH_INFO`, that
+is without query string, and percent-decoded), so a hop rewriting paths
+must sign the rewritten one. A captured set of signed headers can only be
+replayed against the same method and path, until the signature expires.
+
+Signatures older than `trusted_headers_max_age` seconds (or from as far in
+the future) are rejected, unless it is 0. The identity headers of a request
+with a missing or invalid signature are all removed, and its
+`X-Identity-Status` set to "Invalid", so that it is treated exactly as a
+request with an invalid token. Signatures are compared in constant time.
+"""
+
+import hashlib
+import hmac
+import itertools
+import time
+
+from oslo_log import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Identity-Signature"
+
+_IDENTITY_TEMPLATES = (
+    "X%s-Domain-Id", "X%s-Domain-Name",
+    "X%s-Project-Id", "X%s-Project-Name",
+    "X%s-Project-Domain-Id", "X%s-Project-Domain-Name",
+    "X%s-User-Id", "X%s-User-Name",
+    "X%s-User-Domain-Id", "X%s-User-Domain-Name",
+    "X%s-Roles",
+)
+
+#: Headers carrying an identity, as set by keystonemiddleware.
+IDENTITY_HEADERS = tuple(sorted(itertools.chain(
+    (template % prefix for template in _IDENTITY_TEMPLATES
+     for prefix in ("", "-Service")),
+    ("X-Identity-Status", "X-Service-Identity-Status",
+     "X-Is-Admin-Project", "OpenStack-System-Scope", "X-Service-Catalog",
+     "X-Role", "X-User", "X-Tenant-Id", "X-Tenant-Name", "X-Tenant"),
+), key=str.lower))
+
+#: WSGI environ keys of :data:`IDENTITY_HEADERS`, with their lower case
+#: names, in signing order.
+_IDENTITY_ENVIRON = tuple(
+    ("HTTP_" + header.upper().replace("-", "_"), header.lower())
+    for header in IDENTITY_HEADERS
+)
+
+_SIGNATURE_ENVIRON = "HTTP_X_IDENTITY_SIGNATURE"
+
+
+def _message(timestamp, method, path, values):
+    """
+    Build the signed message of a request.
+
+    :param str timestamp: Unix time of the signature.
+    :param str method: The method of the request.
+    :param bytes path: The path of the request.
+    :param values: The (name, value) pairs of its identity headers.
+    :rtype: bytes
+    """
+    head = "%s\n%s " % (timestamp, method.upper())
+    parts = ["\n"]
+    for name, value in values:
+        parts.extend((name, ":", value, "\n"))
+    return b"".join((head.encode("latin-1"), path,
+                     "".join(parts).encode("latin-1")))
+
+
+def _as_key(key):
+    return key.encode("utf-8") if isinstance(key, str) else key
+
+
+def sign_headers(key, headers, method, path, timestamp=None):
+    """
+    Sign the identity headers of a request.
+
+    :param key: The key shared with the service.
+    :type key: str OR bytes
+    :param dict headers: The headers of the request.
+    :param str method: The method of the request, such as "GET".
+    :param str path: The path of the request, as the service sees it:
+                     without query string, and percent-decoded.
+    :param int timestamp: Unix time of the signature. (default: now)
+    :returns: The value of the `X-Identity-Signature` header.
+    :rtype: str
+    """
+    lowered = dict((name.lower(), value) for name, value in headers.items()
+                   if name.lower() != SIGNATURE_HEADER.lower())
+    timestamp = "%d" % (time.time() if timestamp is None else timestamp)
+    values = [(name, lowered[name]) for _, name in _IDENTITY_ENVIRON
+              if name in lowered]
+    message = _message(timestamp, method, path.encode("utf-8"), values)
+    digest = hmac.new(_as_key(key), message, hashlib.sha256).hexdigest()
+    return "%s:%s" % (timestamp, digest)
+
+
+class TrustedHeaderMiddleware(object):
+    """
+    WSGI middleware trusting signed identity headers.
+
+    :param app: The WSGI application to wrap.
+    :param key: The key shared with upstream hops.
+    :type key: str OR bytes
+    :param float max_age: Seconds a signature is accepted for, or 0 to
+                          accept signatures of any age. (default: 300)
+    """
+
+    def __init__(self, app, key, max_age=300.0):
+        self.app = app
+        self.max_age = max_age
+        self.verified = 0
+        self.rejected = 0
+        self.unsigned = 0
+        # NOTE: the key is only hashed into the HMAC state once; each
+        # request copies that state.
+        self._hmac = hmac.new(_as_key(key), digestmod=hashlib.sha256)
+
+    def __call__(self, environ, start_response):
+        signature = environ.pop(_SIGNATURE_ENVIRON, None)
+        if signature is None:
+            self.unsigned += 1
+            self._strip(environ)
+        elif self.verify(environ, signature):
+            self.verified += 1
+        else:
+            self.rejected += 1
+            LOG.info("Rejected identity headers with an invalid signature.")
+            self._strip(environ)
+        return self.app(environ, start_response)
+
+    def verify(self, environ, signature):
+        """
+        Check the signature of a request's identity headers.
+
+        :param dict environ: The WSGI environ of the request.
+        :param str signature: The value of its `X-Identity-Signature`.
+        :returns: Whether or not the signature is valid and recent.
+        :rtype: bool
+        """
+        timestamp, _, provided = signature.partition(":")
+        try:
+            signed_at = int(timestamp)
+        except ValueError:
+            return False
+        if self.max_age and abs(time.time() - signed_at) > self.max_age:
+            return False
+
+        values = [(name, environ[key]) for key, name in _IDENTITY_ENVIRON
+                  if key in environ]
+        # NOTE: WSGI paths are the request's bytes decoded as latin-1.
+        path = "".join((environ.get("SCRIPT_NAME", ""),
+                        environ.get("PATH_INFO", ""))).encode("latin-1")
+        mac = self._hmac.copy()
+        mac.update(_message(timestamp, environ.get("REQUEST_METHOD", "GET"),
+                            path, values))
+        return hmac.compare_digest(mac.hexdigest().encode("ascii"),
+                                   provided.encode("latin-1"))
+
+    def stats(self):
+        """
+        Report the signatures checked so far.
+
+        :returns: Counts of requests whose headers were `verified`,
+                  `rejected` for an invalid signature, or `unsigned`.
+        :rtype: dict
+        """
+        return {
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "unsigned": self.unsigned,
+        }
+
+    @staticmethod
+    def _strip(environ):
+        """Remove every identity header, and mark the identity invalid."""
+        for key, _ in _IDENTITY_ENVIRON:
+            environ.pop(key, None)
+        environ["HTTP_X_IDENTITY_STATUS"] = "Invalid"
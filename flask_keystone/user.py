@@ -23,15 +23,79 @@ Once generated, the User model will have the following attributes:
 - An `is_{role_name}()` method, which takes no arguments, and returns a
   boolean if the user has the requested configured role.
 - A `has_role(*role_name*)` method, which takes the requested configured_roles
-  role as an arugment and returns a boolean if the user has the requested
-  configured role.
+  role (or a role expression such as "admin or (support and billing)") as an
+  arugment and returns a boolean if the user has the requested configured
+  role.
 - Attributes for all headers added by `keystonemiddleware`. ("X-Project-Id"
   becomes `User.project_id`, etc.)
+- `in_project(*project_id*)` and `in_domain(*domain_id*)` methods, which
+  return a boolean if the user's token is scoped to the given project or
+  domain.
+- A `snapshot()` method, which returns a picklable
+  :class:`flask_keystone.snapshot.IdentitySnapshot` of the user for use in
+  background jobs.
 """
 
-from oslo_config import cfg
 from oslo_log import log as logging
 
+from flask_keystone.roles import is_expression, RoleExpression, RoleMap
+from flask_keystone.snapshot import IdentitySnapshot
+
+
+_MAX_CACHED_ATTRIBUTES = 1024
+
+
+def header_attribute(header):
+    """
+    Transform a header name into the name of a User attribute.
+
+    :param str header: The header name, such as "X-Project-Id".
+    :returns: The attribute name, such as "project_id".
+    :rtype: str
+
+    Only a leading "X-" is removed, so that names such as "X-Max" or
+    "X-Auth-X" keep their trailing characters.
+    """
+    if header[:2].upper() == "X-":
+        header = header[2:]
+    return header.replace("-", "_").lower()
+
+
+#: Attribute names of the identity headers set by keystonemiddleware, keyed
+#: on their WSGI environ key (the "X-Project-Id" header is found under
+#: "HTTP_X_PROJECT_ID", and becomes `User.project_id`).
+IDENTITY_ATTRIBUTES = dict(("HTTP_X_" + name.upper(), name) for name in (
+    "identity_status", "service_identity_status",
+    "auth_token", "service_token",
+    "domain_id", "service_domain_id",
+    "domain_name", "service_domain_name",
+    "project_id", "service_project_id",
+    "project_name", "service_project_name",
+    "project_domain_id", "service_project_domain_id",
+    "project_domain_name", "service_project_domain_name",
+    "user_id", "service_user_id",
+    "user_name", "service_user_name",
+    "user_domain_id", "service_user_domain_id",
+    "user_domain_name", "service_user_domain_name",
+    "roles", "service_roles",
+    "is_admin_project", "service_catalog",
+    "tenant_id", "tenant_name", "tenant", "user", "role",
+))
+
+#: Attribute names of every other "X-" header seen so far, keyed on their
+#: WSGI environ key, so that each name is only built once.
+_attribute_names = dict(IDENTITY_ATTRIBUTES)
+
+
+def _attribute_name(key):
+    """Look up, or build and remember, the attribute name of an environ key."""
+    name = _attribute_names.get(key)
+    if name is None:
+        name = key[7:].lower()
+        if len(_attribute_names) < _MAX_CACHED_ATTRIBUTES:
+            _attribute_names[key] = name
+    return name
+
 
 class UserBase(object):
     """
@@ -55,28 +119,54 @@ class UserBase(object):
     -  `request.headers["X-User-Id"]` becomes `User.user_id` and so on.
     """
 
+    # NOTE: the logger is shared by every instance, as logging is set up
+    # once by FlaskKeystone.init_app rather than on every request.
+    logger = logging.getLogger(__name__)
+    role_map = RoleMap({})
+
     def __init__(self, request):
         """
         Initialize an instance of :class:`flask_keystone.UserBase`.
 
         During initialization, headers are transformed and applied as
-        attributes to the object. Keystone Roles are also then added to a
-        `UserBase.roles` attribute so that they can be easily transformed to
-        a list.
-        """
-        self.logger = logging.getLogger(__name__)
-        try:
-            logging.register_options(cfg.CONF)
-        except cfg.ArgsAlreadyParsedError:  # pragma: no cover
-            pass
-        logging.setup(cfg.CONF, "flask_keystone")
-
-        for header in request.headers:
-            if header[0].startswith("X-"):
-                setattr(self, self.transform_header(header[0]), header[1])
-        self.roles = request.headers.get("X-Roles", "").split(",")
+        attributes to the object. Keystone Roles are also then parsed into a
+        `UserBase.roles` frozenset, stripped of whitespace and duplicates,
+        so that membership tests take constant time however many roles the
+        user holds.
+
+        Headers are read straight from the WSGI environ, and their attribute
+        names looked up in a table seeded with :data:`IDENTITY_ATTRIBUTES`,
+        rather than going through `request.headers`. The roles, and the mask
+        of configured roles they grant, are looked up in the class's
+        :class:`flask_keystone.roles.RoleMap`, which memoizes them per
+        "X-Roles" value, so steady-state requests allocate neither attribute
+        names nor role names.
+        """
+        environ = request.environ
+        names = _attribute_names
+        cls = type(self)
+        for key, value in environ.items():
+            if key.startswith("HTTP_X_"):
+                name = names.get(key) or _attribute_name(key)
+                # NOTE: headers named after attributes of the class, such as
+                # "X-Role-Mask" or "X-Has-Role", are ignored rather than
+                # shadowing (or failing to set) its methods and properties.
+                if not hasattr(cls, name):
+                    setattr(self, name, value)
+        self.roles, self._role_mask = self.role_map.lookup(
+            environ.get("HTTP_X_ROLES", ""))
         self.anonymous = False
 
+        self.project_ids = frozenset(filter(None, (
+            getattr(self, "project_id", None),
+            getattr(self, "tenant_id", None)
+        )))
+        # NOTE: the domain owning a project-scoped token's project is not
+        # part of its scope, so "X-Project-Domain-Id" is left out.
+        self.domain_ids = frozenset(filter(None, (
+            getattr(self, "domain_id", None),
+        )))
+
     def transform_header(self, header):
         """
         transforms incoming header names for use as attrs.
@@ -89,7 +179,56 @@ class UserBase(object):
                 "X-Project-Id" => "project_id"
                 "X-User-Id"    => "user_id"
         """
-        return header.strip("X-").replace("-", "_").lower()
+        return header_attribute(header)
+
+    @property
+    def role_mask(self):
+        """
+        The mask of configured roles held by this instance.
+
+        :rtype: int
+
+        The mask is computed from the "X-Roles" header against the class's
+        :class:`flask_keystone.roles.RoleMap` when the instance is created,
+        or from `UserBase.roles` on first access if it wasn't.
+        """
+        mask = self.__dict__.get("_role_mask")
+        if mask is None:
+            mask = self._role_mask = self.role_map.mask_for(self.roles)
+        return mask
+
+    def snapshot(self):
+        """
+        Take a compact, picklable snapshot of this instance.
+
+        :rtype: :class:`flask_keystone.snapshot.IdentitySnapshot`
+        """
+        return IdentitySnapshot.from_user(self)
+
+    def in_project(self, project_id):
+        """
+        Determine whether this instance is scoped to a project.
+
+        :param str project_id: The project (or legacy tenant) id to test.
+        :returns: Whether or not the token is scoped to the project.
+        :rtype: bool
+
+        Both "X-Project-Id" and the legacy "X-Tenant-Id" are indexed once
+        when the user is created, so this check is a single set lookup.
+        """
+        return project_id in self.project_ids
+
+    def in_domain(self, domain_id):
+        """
+        Determine whether this instance is scoped to a domain.
+
+        :param str domain_id: The domain id to test.
+        :returns: Whether or not the token is scoped to the domain. A
+                  project-scoped token is never scoped to the domain owning
+                  its project.
+        :rtype: bool
+        """
+        return domain_id in self.domain_ids
 
     def _has_keystone_role(self, role):
         """
@@ -115,14 +254,22 @@ class UserBase(object):
 
         :class:`FlaskKeystone` uses this to add these methods to a dynamically
         generated class which inherits from this class.
+
+        The roles are compiled into a :class:`flask_keystone.roles.RoleMap`,
+        set as `cls.role_map`, so that each role check is a bitwise test
+        against the instance's `role_mask`.
         """
+        role_map = RoleMap(roles)
+        bits = role_map.bits
+
         def has_role_func(self, role):
             """
             Determine if an instance of this class has the configured role.
 
-            :param str role: The role identifier from `oslo.config.cfg` to
-                             against which to evaluate this instance for
-                             membership.
+            :param role: The role identifier from `oslo.config.cfg` to
+                         against which to evaluate this instance for
+                         membership, or a role expression.
+            :type role: str OR :class:`flask_keystone.roles.RoleExpression`
             :returns: Whether or not the instance has the desired role.
             :rtype: bool
 
@@ -130,14 +277,18 @@ class UserBase(object):
             from the :class:`oslo.config.cfg`, rather than a keystone role
             itself.
             """
-            if role not in roles:
-                msg = "Evaluating has_role('%s'), Role '%s' does not exist."
-                self.logger.warn(msg % (role, self.user_id))
-                return False
-            for group in roles[role]:
-                if self._has_keystone_role(group):
-                    return True
+            bit = bits.get(role)
+            if bit is not None:
+                return self.role_mask & bit != 0
+            if isinstance(role, RoleExpression):
+                return role.evaluate(role_map, self.role_mask)
+            if isinstance(role, str) and is_expression(role):
+                return role_map.expression(role).evaluate(role_map,
+                                                          self.role_mask)
+            msg = "Evaluating has_role('%s'), Role '%s' does not exist."
+            self.logger.warn(msg % (role, self.user_id))
             return False
+        cls.role_map = role_map
         setattr(cls, "has_role", has_role_func)
 
     @staticmethod
@@ -168,6 +168,9 @@ setup(
         'keystoneauth1',
         'flask_oslolog'
     ],
+    extras_require={
+        'offline': ['cryptography'],
+    },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
 
@@ -193,6 +196,8 @@ setup(
         exclude=["*.tests", "*.tests.*", "tests.*", "tests"]
     ),
     entry_points={
-        'console_scripts': [],
+        'console_scripts': [
+            'flask-keystone-bench = flask_keystone.benchmarks.load:main',
+        ],
     }
 )